@@ -0,0 +1 @@
+# Benchmarks voor de API (offline, geen echte Gemini/Tavily calls)
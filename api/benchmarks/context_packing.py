@@ -0,0 +1,99 @@
+"""
+Benchmark: context packing voor search samenvattingen
+Vergelijkt de oorspronkelijke prompt (alle Tavily content volledig) met
+lib/context_packing.py op gesimuleerde resultaten waarin sites elkaars snippets
+overnemen (syndicatie, boilerplate):
+
+- geschatte prompt tokens voor en na packing
+- aantal weggefilterde duplicaten
+- CPU tijd van de packing zelf
+
+Gebruik (vanuit api/):
+    python -m benchmarks.context_packing
+    python -m benchmarks.context_packing --results 10 --sentences 40 --overlap 0.4 --budget 2000
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from lib.context_packing import full_context, pack_results
+from lib.utils import estimate_tokens
+
+WORDS = ("firebase", "gemini", "python", "latency", "cache", "stream", "vector", "router",
+         "query", "result", "model", "token", "region", "europe", "instance", "function",
+         "deploy", "cold", "start", "memory", "request", "response", "search", "index")
+
+
+def make_results(count: int, sentences: int, overlap: float, seed: int = 1) -> List[Dict[str, Any]]:
+    """
+    Resultaten met `sentences` zinnen; een fractie `overlap` komt uit een gedeelde pool
+    (soms licht aangepast), de rest is uniek per site
+    """
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+    shared = [sentence() for _ in range(sentences)]
+    results = []
+    for i in range(count):
+        parts = []
+        for _ in range(sentences):
+            if rng.random() < overlap:
+                text = rng.choice(shared)
+                if rng.random() < 0.3:
+                    # Near-duplicate: één woord anders
+                    words = text.split()
+                    words[rng.randrange(len(words))] = rng.choice(WORDS)
+                    text = " ".join(words)
+                parts.append(text)
+            else:
+                parts.append(sentence())
+        results.append({"title": f"Result {i}", "url": f"https://example.com/{i}", "content": " ".join(parts)})
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Context packing benchmark")
+    parser.add_argument("--results", type=int, default=5, help="Aantal zoekresultaten")
+    parser.add_argument("--sentences", type=int, default=20, help="Zinnen per resultaat")
+    parser.add_argument("--overlap", type=float, default=0.3, help="Fractie gedeelde zinnen")
+    parser.add_argument("--budget", type=int, default=2000, help="Token budget (SEARCH_CONTEXT_TOKENS)")
+    parser.add_argument("--query", default="firebase cold start latency", help="Query voor de ranking")
+    parser.add_argument("--rounds", type=int, default=20, help="Herhalingen voor de CPU meting")
+    parser.add_argument("--json", action="store_true", help="Resultaten als JSON")
+    args = parser.parse_args(argv)
+
+    results = make_results(args.results, args.sentences, args.overlap)
+    start = time.process_time()
+    for _ in range(args.rounds):
+        packed = pack_results(args.query, results, args.budget)
+    cpu_ms = (time.process_time() - start) / args.rounds * 1000
+
+    # Alleen dedupe (budget ruim genoeg voor alles): hoeveel scheelt dat al
+    dedupe_only = pack_results(args.query, results, 10 ** 9)
+    report = {
+        "config": vars(args),
+        "tokens_full": estimate_tokens(full_context(results)),
+        "tokens_dedupe_only": dedupe_only.tokens_out,
+        **packed.stats(),
+        "cpu_ms": round(cpu_ms, 2),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print(f"{args.results} resultaten × {args.sentences} zinnen, overlap {args.overlap:.0%}, budget {args.budget}")
+    print(f"  volledig:        {report['tokens_full']:>7} tokens")
+    print(f"  alleen dedupe:   {report['tokens_dedupe_only']:>7} tokens")
+    print(f"  packed:          {report['tokens_out']:>7} tokens  (bespaard {report['tokens_saved']}, "
+          f"{report['duplicates']} duplicaten, {report['passages_out']}/{report['passages_in']} passages)")
+    print(f"  cpu:             {report['cpu_ms']:>7} ms per packing")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,236 @@
+"""
+Lokale stand-ins voor Tavily en Gemini (HTTP, volledig offline)
+
+Spreken hetzelfde wire protocol als de echte APIs, zodat de echte clients
+(requests.Session pool, google-generativeai REST transport) gebenchmarkt worden:
+
+    TAVILY_BASE_URL=http://127.0.0.1:<port>
+    GEMINI_API_ENDPOINT=http://127.0.0.1:<port>
+
+Latency, jitter, streaming chunk cadence en error rate zijn configureerbaar.
+Embeddings (embedContent/batchEmbedContents) zijn deterministisch per woord.
+Los te starten (vanuit api/):
+    python -m benchmarks.fakes --gemini-latency 0.4 --chunk-interval 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+WORDS = ("firebase", "gemini", "python", "latency", "cache", "stream", "vector", "router",
+         "query", "result", "model", "token", "region", "europe", "instance", "function")
+
+
+@dataclass
+class FakeConfig:
+    """Gedrag van de fake upstreams (latency in seconden)"""
+    tavily_latency: float = 0.15
+    gemini_latency: float = 0.4
+    embed_latency: float = 0.05
+    jitter: float = 0.2
+    chunk_interval: float = 0.05
+    chunks: int = 8
+    error_rate: float = 0.0
+    seed: int = 1
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: FakeConfig
+    rng: random.Random
+    lock = threading.Lock()
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def _sleep(self, seconds: float):
+        with self.lock:
+            factor = 1 + self.rng.uniform(-self.config.jitter, self.config.jitter)
+        time.sleep(max(seconds * factor, 0))
+
+    def _fail(self) -> bool:
+        with self.lock:
+            failed = self.rng.random() < self.config.error_rate
+        if failed:
+            self._json({"error": {"code": 503, "message": "fake upstream error"}}, status=503)
+        return failed
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _json(self, payload: Dict[str, Any], status: int = 200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class TavilyHandler(_Handler):
+    """POST /search (Tavily REST API)"""
+
+    def do_POST(self):
+        payload = self._body()
+        self._sleep(self.config.tavily_latency)
+        if self._fail():
+            return
+        query = payload.get("query", "")
+        with self.lock:
+            results = [
+                {
+                    "title": f"{query} {i}",
+                    "url": f"https://example.com/{abs(hash(query)) % 10000}/{i}",
+                    "content": _text(self.rng, 60),
+                    "score": round(1 - i * 0.05, 2),
+                    "published_date": "2025-01-01",
+                }
+                for i in range(int(payload.get("max_results", 5)))
+            ]
+        self._json({"query": query, "results": results, "response_time": self.config.tavily_latency})
+
+
+class GeminiHandler(_Handler):
+    """
+    generateContent / streamGenerateContent (Generative Language REST API)
+    Streaming volgt het REST transport formaat: een JSON array, element voor element.
+    """
+
+    PATH = re.compile(r"^/v1beta/models/(?P<model>[^:]+):(?P<method>\w+)")
+    EMBEDDING_DIM = 768
+
+    def _response(self, text: str, prompt_tokens: int, output_tokens: int) -> Dict[str, Any]:
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            },
+        }
+
+    def _embedding(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Deterministische bag-of-words embedding (gelijke woorden → hoge cosine similarity)"""
+        dim = int(request.get("outputDimensionality") or self.EMBEDDING_DIM)
+        values = [0.0] * dim
+        for word in self._content_text(request.get("content", {})).lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+            index = int.from_bytes(digest, "big")
+            values[index % dim] += 1.0 if index & 1 else -1.0
+        return {"values": values}
+
+    @staticmethod
+    def _content_text(content: Dict[str, Any]) -> str:
+        return " ".join(part.get("text", "") for part in content.get("parts", []))
+
+    def do_POST(self):
+        match = self.PATH.match(self.path)
+        payload = self._body()
+        if not match:
+            self._json({"error": {"code": 404, "message": f"unknown path {self.path}"}}, status=404)
+            return
+        prompt_tokens = len(json.dumps(payload.get("contents", []))) // 4
+
+        if match.group("method") in ("embedContent", "batchEmbedContents"):
+            self._sleep(self.config.embed_latency)
+            if self._fail():
+                return
+            if match.group("method") == "embedContent":
+                self._json({"embedding": self._embedding(payload)})
+            else:
+                self._json({"embeddings": [self._embedding(request) for request in payload.get("requests", [])]})
+        elif match.group("method") == "generateContent":
+            self._sleep(self.config.gemini_latency)
+            if self._fail():
+                return
+            with self.lock:
+                text = _text(self.rng, 12 * self.config.chunks)
+            self._json(self._response(text, prompt_tokens, len(text) // 4))
+        elif match.group("method") == "streamGenerateContent":
+            # Tijd tot het eerste token, daarna een chunk per chunk_interval
+            self._sleep(self.config.gemini_latency)
+            if self._fail():
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(self.config.chunks):
+                if i:
+                    self._sleep(self.config.chunk_interval)
+                with self.lock:
+                    text = _text(self.rng, 12) + " "
+                element = json.dumps(self._response(text, prompt_tokens, len(text) // 4))
+                self._chunk((("[" if i == 0 else ",") + element + "\r\n").encode("utf-8"))
+            self._chunk(b"]")
+            self._chunk(b"")
+        else:
+            self._json({"error": {"code": 404, "message": f"unsupported method {match.group('method')}"}}, status=404)
+
+
+def start_server(handler: type, config: FakeConfig, port: int = 0) -> ThreadingHTTPServer:
+    """Start een fake server in een daemon thread (port 0 = vrije poort)"""
+    handler = type(handler.__name__, (handler,), {"config": config, "rng": random.Random(config.seed)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve(config: Dict[str, Any], ready: Any, ports: Tuple[int, int] = (0, 0)):
+    """
+    Entry point voor een apart proces (zodat de fakes de RSS/CPU van de benchmark niet vervuilen)
+
+    Args:
+        config: FakeConfig als dict
+        ready: multiprocessing Queue; krijgt (tavily_url, gemini_url)
+        ports: Optionele vaste poorten
+    """
+    fake_config = FakeConfig(**config)
+    tavily = start_server(TavilyHandler, fake_config, ports[0])
+    gemini = start_server(GeminiHandler, fake_config, ports[1])
+    ready.put((f"http://127.0.0.1:{tavily.server_port}", f"http://127.0.0.1:{gemini.server_port}"))
+    threading.Event().wait()
+
+
+def main(argv: Optional[list] = None):
+    defaults = FakeConfig()
+    parser = argparse.ArgumentParser(description="Fake Tavily + Gemini servers")
+    parser.add_argument("--tavily-port", type=int, default=8701)
+    parser.add_argument("--gemini-port", type=int, default=8702)
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = vars(parser.parse_args(argv))
+    ports = (args.pop("tavily_port"), args.pop("gemini_port"))
+    config = FakeConfig(**args)
+    tavily = start_server(TavilyHandler, config, ports[0])
+    gemini = start_server(GeminiHandler, config, ports[1])
+    print(f"TAVILY_BASE_URL=http://127.0.0.1:{tavily.server_port}")
+    print(f"GEMINI_API_ENDPOINT=http://127.0.0.1:{gemini.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
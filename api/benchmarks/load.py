@@ -0,0 +1,477 @@
+"""
+Load test benchmark voor alle routes in lib/router.ROUTES
+Draait offline tegen lokale stand-ins voor Tavily en Gemini (benchmarks/fakes.py,
+in een apart proces) en optioneel de Firestore emulator voor de /api/items routes.
+
+Rapporteert per route: throughput, p50/p95/p99 latency, time-to-first-byte en
+time-to-first-data (eerste chunk die geen SSE comment is) voor streaming routes,
+en de piek RSS van het proces. Baselines opslaan en vergelijken vangt regressies.
+
+Gebruik (vanuit api/):
+    python -m benchmarks.load                                  # alle routes, in-process
+    python -m benchmarks.load --routes ai/chat --concurrency 32 --requests 400
+    python -m benchmarks.load --save benchmarks/baselines/ci.json
+    python -m benchmarks.load --compare benchmarks/baselines/ci.json --tolerance 0.25
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python -m benchmarks.load --routes items
+    python -m benchmarks.load --url http://127.0.0.1:8000      # tegen uvicorn/gunicorn (lib/asgi.py)
+
+Exit code 1 bij een regressie t.o.v. --compare.
+"""
+import argparse
+import base64
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.fakes import FakeConfig, serve
+
+# Caches die standaard uit staan, zodat elke request de clients en upstreams raakt
+CACHE_PREFIXES = ("SEARCH_CACHE", "SUMMARY_CACHE", "IMAGE_CACHE")
+
+# Routes die Firestore nodig hebben (alleen met FIRESTORE_EMULATOR_HOST)
+FIRESTORE_ROUTES = ("/api/items",)
+
+IMAGE_VARIANTS = 8
+
+# Afgeronde chat streams waarop de resume route gebenchmarkt wordt
+RESUME_STREAMS = 8
+
+Spec = Dict[str, Any]
+
+
+def _image_payloads() -> List[str]:
+    """Een paar verschillende (ruis) JPEGs van ~1 megapixel, base64"""
+    from PIL import Image
+    images = []
+    for _ in range(IMAGE_VARIANTS):
+        out = io.BytesIO()
+        Image.effect_noise((1280, 960), 48).convert("RGB").save(out, format="JPEG", quality=90)
+        images.append(base64.b64encode(out.getvalue()).decode("ascii"))
+    return images
+
+
+def build_cases(selected: List[str], transport: Callable) -> Dict[str, Callable[[int], Spec]]:
+    """
+    Request builders per route label (i = volgnummer van de request)
+    Een spec mag "path" (ingevulde {params}) en "headers" bevatten naast "query"/"json".
+    """
+    images: List[str] = []
+    if any("ai/image" in label for label in selected):
+        images = _image_payloads()
+
+    # Resume: eerst een paar volledige streams via POST /api/ai/chat/stream, daarna
+    # hervatten vanaf verschillende Last-Event-IDs (replay uit de buffer van de instance)
+    stream_ids: List[str] = []
+    if any("{stream_id}" in label for label in selected):
+        stream_ids = [transport.start_stream(f"Resume bench {n}") for n in range(RESUME_STREAMS)]
+
+    return {
+        "GET /api": lambda i: {},
+        "GET /api/health": lambda i: {},
+        "GET /api/hello": lambda i: {"query": {"name": f"bench{i}"}},
+        "GET /api/metrics": lambda i: {"headers": {"Authorization": f"Bearer {os.getenv('METRICS_TOKEN', '')}"}},
+        "POST /api/ai/chat": lambda i: {"json": {"message": f"Vraag {i}: wat is Firebase?"}},
+        "POST /api/ai/chat/stream": lambda i: {"json": {"message": f"Vraag {i}: leg Gemini uit"}},
+        "GET /api/ai/chat/stream/{stream_id}": lambda i: {
+            "path": f"/api/ai/chat/stream/{stream_ids[i % len(stream_ids)]}",
+            "headers": {"Last-Event-ID": str(i % 5)},
+        },
+        "POST /api/ai/image": lambda i: {"json": {
+            "image_data": images[i % len(images)],
+            "message": f"Beschrijf afbeelding {i}",
+            "perceptual": False,
+        }},
+        "POST /api/search": lambda i: {"json": {"query": f"firebase functions {i}", "max_results": 5}},
+        "POST /api/search/batch": lambda i: {"json": {
+            "queries": [f"batch {i} topic {j}" for j in range(5)], "max_results": 3
+        }},
+        "GET /api/items": lambda i: {"query": {"limit": 50}},
+        "POST /api/items": lambda i: {"json": {"name": f"bench item {i}"}},
+        "POST /api/items/batch": lambda i: {"json": [{"name": f"bench {i}-{j}"} for j in range(100)]},
+        "POST /api/items/search": lambda i: {"json": {
+            "query": f"firebase vector {i}", "k": 10, "filters": {"tags": ["bench"]} if i % 2 else None
+        }},
+    }
+
+
+def _is_data(chunk: bytes) -> bool:
+    """Eerste echte data (SSE comments zoals ": connected" tellen niet)"""
+    return bool(chunk.strip()) and not chunk.startswith(b":")
+
+
+class InProcessTransport:
+    """Roept route_request direct aan (meet clients + routes zonder server overhead)"""
+
+    def __init__(self):
+        from firebase_functions import https_fn
+        from werkzeug.test import EnvironBuilder
+        from lib.router import route_request
+        self._request_cls = https_fn.Request
+        self._builder = EnvironBuilder
+        self._route_request = route_request
+
+    def __call__(self, method: str, path: str, spec: Spec) -> Tuple[int, float, Optional[float], Optional[float], bool]:
+        environ = self._builder(
+            method=method, path=spec.get("path", path), query_string=spec.get("query"),
+            json=spec.get("json"), headers=spec.get("headers")
+        ).get_environ()
+        start = time.perf_counter()
+        response = self._route_request(self._request_cls(environ))
+        first_byte = first_data = None
+        try:
+            for chunk in response.iter_encoded():
+                now = time.perf_counter() - start
+                if first_byte is None and chunk:
+                    first_byte = now
+                if first_data is None and _is_data(chunk):
+                    first_data = now
+        finally:
+            response.close()
+        return response.status_code, time.perf_counter() - start, first_byte, first_data, response.is_streamed
+
+    def start_stream(self, message: str) -> str:
+        """Volledige chat stream; geeft de X-Stream-Id terug"""
+        environ = self._builder(method="POST", path="/api/ai/chat/stream", json={"message": message}).get_environ()
+        response = self._route_request(self._request_cls(environ))
+        try:
+            for _ in response.iter_encoded():
+                pass
+        finally:
+            response.close()
+        return response.headers["X-Stream-Id"]
+
+
+class HttpTransport:
+    """HTTP naar een draaiende server (keep-alive verbinding per thread)"""
+
+    def __init__(self, base_url: str):
+        parts = urlsplit(base_url)
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self._host, self._port, timeout=120)
+        return connection
+
+    def __call__(self, method: str, path: str, spec: Spec) -> Tuple[int, float, Optional[float], Optional[float], bool]:
+        path = spec.get("path", path)
+        if spec.get("query"):
+            path = f"{path}?{urlencode(spec['query'])}"
+        body = json.dumps(spec["json"]).encode("utf-8") if "json" in spec else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        headers.update(spec.get("headers") or {})
+        connection = self._connection()
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+        first_byte = first_data = None
+        while True:
+            chunk = response.read1(65536)
+            if not chunk:
+                break
+            now = time.perf_counter() - start
+            if first_byte is None:
+                first_byte = now
+            if first_data is None and _is_data(chunk):
+                first_data = now
+        # read1 sluit een Content-Length response niet zelf af (nodig voor keep-alive hergebruik)
+        response.close()
+        streamed = response.getheader("Transfer-Encoding") == "chunked"
+        return response.status, time.perf_counter() - start, first_byte, first_data, streamed
+
+    def start_stream(self, message: str) -> str:
+        """Volledige chat stream; geeft de X-Stream-Id terug"""
+        connection = self._connection()
+        body = json.dumps({"message": message}).encode("utf-8")
+        connection.request("POST", "/api/ai/chat/stream", body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        return response.getheader("X-Stream-Id")
+
+
+def peak_rss_mb() -> float:
+    """Piek resident set size van dit proces (ru_maxrss is KB op Linux)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_route(
+    route: Any,
+    build: Callable[[int], Spec],
+    transport: Callable,
+    concurrency: int,
+    requests: int,
+    warmup: int
+) -> Dict[str, Any]:
+    """Draai één route: warmup (niet gemeten, eerste = cold), daarna requests op concurrency"""
+    from lib.metrics import Histogram
+
+    cold_ms = None
+    for i in range(warmup):
+        _, elapsed, _, _, _ = transport(route.method, route.path, build(-1 - i))
+        cold_ms = round(elapsed * 1000, 2) if cold_ms is None else cold_ms
+
+    latency, ttfb, ttfd = Histogram(requests), Histogram(requests), Histogram(requests)
+    statuses: Counter = Counter()
+    streamed = False
+
+    def one(i: int):
+        nonlocal streamed
+        try:
+            status, elapsed, first_byte, first_data, is_streamed = transport(route.method, route.path, build(i))
+        except Exception as e:
+            statuses[type(e).__name__] += 1
+            return
+        statuses[str(status)] += 1
+        latency.observe(elapsed * 1000)
+        streamed = streamed or is_streamed
+        if first_byte is not None:
+            ttfb.observe(first_byte * 1000)
+        if first_data is not None:
+            ttfd.observe(first_data * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+    result = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4),
+        "statuses": dict(statuses),
+        "throughput_rps": round(requests / wall, 2),
+        "latency_ms": latency.snapshot(),
+        "cold_ms": cold_ms,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if streamed:
+        result["ttfb_ms"] = ttfb.snapshot()
+        result["ttfd_ms"] = ttfd.snapshot()
+    return result
+
+
+def _start_fakes(config: FakeConfig) -> Tuple[Any, str, str]:
+    """Fake upstreams in een apart proces (eigen CPU/RSS)"""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=serve, args=(asdict(config), ready), daemon=True)
+    process.start()
+    tavily_url, gemini_url = ready.get(timeout=30)
+    return process, tavily_url, gemini_url
+
+
+def _init_firestore_emulator():
+    """firebase_admin app tegen de emulator (geen echte credentials nodig)"""
+    import firebase_admin
+    from firebase_admin import credentials
+    from google.auth.credentials import AnonymousCredentials
+
+    class EmulatorCredential(credentials.Base):
+        def get_credential(self):
+            return AnonymousCredentials()
+
+    project = os.getenv("GCLOUD_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT") or "demo-benchmark"
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(EmulatorCredential(), {"projectId": project})
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Vergelijk met een baseline
+
+    Returns:
+        Lijst van regressies (leeg = ok)
+    """
+    regressions = []
+    for label, current in results["routes"].items():
+        base = baseline.get("routes", {}).get(label)
+        if base is None:
+            continue
+        checks = [
+            ("p95", current["latency_ms"].get("p95"), base["latency_ms"].get("p95"), True),
+            ("p99", current["latency_ms"].get("p99"), base["latency_ms"].get("p99"), True),
+            ("throughput", current["throughput_rps"], base["throughput_rps"], False),
+            ("peak_rss", current["peak_rss_mb"], base["peak_rss_mb"], True),
+        ]
+        if "ttfd_ms" in current and "ttfd_ms" in base:
+            checks.append(("ttfd_p95", current["ttfd_ms"].get("p95"), base["ttfd_ms"].get("p95"), True))
+        for name, value, reference, higher_is_worse in checks:
+            if value is None or not reference:
+                continue
+            change = (value - reference) / reference
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"{label}: {name} {reference} → {value} ({change:+.0%})")
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{label}: error_rate {base['error_rate']} → {current['error_rate']}")
+    if baseline.get("config") != results.get("config"):
+        print("Let op: baseline is gemaakt met een andere config", file=sys.stderr)
+    return regressions
+
+
+def _print_table(results: Dict[str, Any]):
+    print(f"{'route':<36} {'c':>3} {'n':>5} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'ttfd50':>8} {'cold':>8} {'rss':>7}")
+    for label, r in results["routes"].items():
+        lat = r["latency_ms"]
+        ttfd = r.get("ttfd_ms", {}).get("p50", "-")
+        print(f"{label:<36} {r['concurrency']:>3} {r['requests']:>5} {r['errors']:>4} {r['throughput_rps']:>8} "
+              f"{lat.get('p50', '-'):>8} {lat.get('p95', '-'):>8} {lat.get('p99', '-'):>8} "
+              f"{ttfd:>8} {r['cold_ms'] if r['cold_ms'] is not None else '-':>8} {r['peak_rss_mb']:>7}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    defaults = FakeConfig()
+    parser = argparse.ArgumentParser(description="Load test alle API routes tegen lokale fakes")
+    parser.add_argument("--routes", nargs="*", default=[], help="Filter op route label (substring)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Gemeten requests per route")
+    parser.add_argument("--warmup", type=int, default=2, help="Ongemeten requests per route (eerste = cold)")
+    parser.add_argument("--ignore-caps", action="store_true",
+                        help="Negeer max_concurrency van de route (verwacht dan 503s)")
+    parser.add_argument("--cache", action="store_true", help="Laat de response caches aan")
+    parser.add_argument("--semantic-cache", action="store_true", help="Zet de semantische chat cache aan")
+    parser.add_argument("--show-logs", action="store_true", help="Toon de structured request logs")
+    parser.add_argument("--url", help="Benchmark een draaiende server i.p.v. in-process")
+    parser.add_argument("--save", help="Schrijf resultaten als baseline JSON")
+    parser.add_argument("--compare", help="Vergelijk met een baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Toegestane verslechtering (0.2 = 20%%)")
+    parser.add_argument("--tavily-latency", type=float, default=defaults.tavily_latency)
+    parser.add_argument("--gemini-latency", type=float, default=defaults.gemini_latency)
+    parser.add_argument("--embed-latency", type=float, default=defaults.embed_latency)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--chunk-interval", type=float, default=defaults.chunk_interval)
+    parser.add_argument("--chunks", type=int, default=defaults.chunks)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    args = parser.parse_args(argv)
+
+    fake_config = FakeConfig(
+        tavily_latency=args.tavily_latency,
+        gemini_latency=args.gemini_latency,
+        embed_latency=args.embed_latency,
+        jitter=args.jitter,
+        chunk_interval=args.chunk_interval,
+        chunks=args.chunks,
+        error_rate=args.error_rate,
+    )
+
+    fakes = None
+    if args.url:
+        transport: Callable = HttpTransport(args.url)
+        print(f"Target: {args.url} (server moet zelf naar benchmarks.fakes wijzen)")
+    else:
+        fakes, tavily_url, gemini_url = _start_fakes(fake_config)
+        os.environ.update({
+            "TAVILY_BASE_URL": tavily_url,
+            "GEMINI_API_ENDPOINT": gemini_url,
+            "TAVILY_API_KEY": os.getenv("TAVILY_API_KEY", "benchmark"),
+            "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "benchmark"),
+            "METRICS_TOKEN": os.getenv("METRICS_TOKEN", "benchmark"),
+        })
+        if not args.cache:
+            for prefix in CACHE_PREFIXES:
+                os.environ[f"{prefix}_MAX_ENTRIES"] = "0"
+        if args.semantic_cache:
+            os.environ["SEMANTIC_CACHE"] = "1"
+        if os.getenv("FIRESTORE_EMULATOR_HOST"):
+            _init_firestore_emulator()
+        transport = InProcessTransport()
+
+    from lib.router import ROUTES
+
+    firestore = bool(os.getenv("FIRESTORE_EMULATOR_HOST") or args.url)
+    selected = []
+    for route in ROUTES:
+        if args.routes and not any(pattern in route.label for pattern in args.routes):
+            continue
+        if not firestore and route.path.startswith(FIRESTORE_ROUTES):
+            print(f"skip {route.label} (zet FIRESTORE_EMULATOR_HOST)")
+            continue
+        selected.append(route)
+
+    results: Dict[str, Any] = {
+        "config": {
+            "fakes": asdict(fake_config),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "cache": args.cache,
+            "semantic_cache": args.semantic_cache,
+            "target": "http" if args.url else "in-process",
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "routes": {},
+    }
+
+    # Request logs (firebase_functions.logger → stdout) worden wel geschreven, maar niet getoond
+    stdout = sys.stdout
+    if not args.show_logs:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        cases = build_cases([route.label for route in selected], transport)
+        for route in selected:
+            build = cases.get(route.label)
+            if build is None:
+                print(f"geen benchmark case voor {route.label}: voeg toe aan build_cases()", file=sys.stderr)
+                continue
+            concurrency = args.concurrency
+            if route.max_concurrency and not args.ignore_caps:
+                concurrency = min(concurrency, route.max_concurrency)
+            results["routes"][route.label] = run_route(
+                route, build, transport, concurrency, args.requests, args.warmup
+            )
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if fakes is not None:
+            fakes.terminate()
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    _print_table(results)
+    print(f"peak RSS: {results['peak_rss_mb']} MB" + (" (benchmark client)" if args.url else ""))
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline opgeslagen: {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"geen regressies t.o.v. {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
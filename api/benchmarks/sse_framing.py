@@ -0,0 +1,169 @@
+"""
+Benchmark: SSE framing van een token stream
+Vergelijkt de oude framing (per chunk dict + json.dumps + f-string + encode),
+sse_message per chunk en SSEWriter (coalescing + id's) op:
+
+- bytes on the wire
+- write syscalls (per frame één write(2) op een socket, gemeten via /proc/thread-self/io)
+- time-to-first-token (eerste data byte bij de lezer) en totale duur
+- CPU per chunk voor alleen de framing
+
+De upstream is gesimuleerd: kleine Gemini-achtige chunks met een vaste cadence.
+
+Gebruik (vanuit api/):
+    python -m benchmarks.sse_framing
+    python -m benchmarks.sse_framing --chunks 400 --interval 0.004 --flush-ms 20 --flush-bytes 256
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from lib.sse import SSE_CONNECTED, SSEWriter, sse_message
+
+WORDS = ("firebase", "gemini", "python", "latency", "cache", "stream", "vector", "router",
+         "query", "result", "model", "token", "region", "europe", "instance", "function")
+
+Framing = Callable[[Iterable[str]], Iterator[bytes]]
+
+
+def make_chunks(count: int, seed: int = 1) -> List[str]:
+    """Token-achtige chunks van 1-3 woorden"""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))) + " " for _ in range(count)]
+
+
+def upstream(chunks: List[str], first_delay: float, interval: float) -> Iterator[str]:
+    time.sleep(first_delay)
+    for i, chunk in enumerate(chunks):
+        if i:
+            time.sleep(interval)
+        yield chunk
+
+
+def legacy_framing(source: Iterable[str]) -> Iterator[bytes]:
+    """Oorspronkelijke generate(): dict + json.dumps + f-string + encode per chunk"""
+    yield SSE_CONNECTED
+    for chunk in source:
+        yield f"data: {json.dumps({'chunk': chunk})}\n\n".encode("utf-8")
+    yield f"data: {json.dumps({'done': True})}\n\n".encode("utf-8")
+
+
+def per_chunk_framing(source: Iterable[str]) -> Iterator[bytes]:
+    """sse_message per chunk (snelle JSON, geen coalescing)"""
+    yield SSE_CONNECTED
+    for chunk in source:
+        yield sse_message({"chunk": chunk})
+    yield sse_message({"done": True})
+
+
+def writer_framing(flush_interval: float, flush_bytes: int) -> Framing:
+    def framing(source: Iterable[str]) -> Iterator[bytes]:
+        writer = SSEWriter(flush_interval=flush_interval, flush_bytes=flush_bytes, heartbeat=0)
+        yield SSE_CONNECTED
+        yield from writer.chunks(source)
+        yield writer.event({"done": True})
+    return framing
+
+
+def _write_syscalls() -> Optional[int]:
+    """write(2) calls van deze thread (None als /proc niet beschikbaar is)"""
+    try:
+        with open("/proc/thread-self/io") as f:
+            for line in f:
+                if line.startswith("syscw:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def run_stream(framing: Framing, chunks: List[str], first_delay: float, interval: float) -> Dict[str, Any]:
+    """Stream over een echte socket pair: schrijver (deze thread) → lezer thread"""
+    sender, receiver = socket.socketpair()
+    received: Dict[str, Any] = {"bytes": 0, "ttft": None}
+
+    def read():
+        while True:
+            data = receiver.recv(65536)
+            if not data:
+                return
+            if received["ttft"] is None and b"data:" in data:
+                received["ttft"] = time.perf_counter() - start
+            received["bytes"] += len(data)
+
+    reader = threading.Thread(target=read)
+    start = time.perf_counter()
+    reader.start()
+    writes = 0
+    syscalls_before = _write_syscalls()
+    # Schrijf via os.write zodat elke frame precies één write(2) is (zoals een WSGI server per chunk)
+    for frame in framing(upstream(chunks, first_delay, interval)):
+        view = memoryview(frame)
+        while view:
+            view = view[os.write(sender.fileno(), view):]
+            writes += 1
+    syscalls_after = _write_syscalls()
+    sender.close()
+    reader.join()
+    receiver.close()
+    return {
+        "bytes": received["bytes"],
+        "writes": writes,
+        "syscalls": syscalls_after - syscalls_before if syscalls_before is not None else None,
+        "ttft_ms": round(received["ttft"] * 1000, 2) if received["ttft"] is not None else None,
+        "total_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def framing_cpu(framing: Framing, chunks: List[str], rounds: int = 20) -> float:
+    """µs CPU per upstream chunk voor alleen de framing (zonder sleeps of I/O)"""
+    start = time.process_time()
+    for _ in range(rounds):
+        for _ in framing(iter(chunks)):
+            pass
+    return round((time.process_time() - start) / (rounds * len(chunks)) * 1e6, 2)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="SSE framing benchmark")
+    parser.add_argument("--chunks", type=int, default=200, help="Upstream chunks per stream")
+    parser.add_argument("--first-delay", type=float, default=0.3, help="Seconden tot het eerste token")
+    parser.add_argument("--interval", type=float, default=0.005, help="Seconden tussen chunks")
+    parser.add_argument("--flush-ms", type=float, default=20, help="SSEWriter tijdvenster")
+    parser.add_argument("--flush-bytes", type=int, default=256, help="SSEWriter grootte venster")
+    parser.add_argument("--json", action="store_true", help="Resultaten als JSON")
+    args = parser.parse_args(argv)
+
+    chunks = make_chunks(args.chunks)
+    variants: Dict[str, Framing] = {
+        "legacy": legacy_framing,
+        "sse_message": per_chunk_framing,
+        "writer": writer_framing(args.flush_ms / 1000, args.flush_bytes),
+    }
+    results = {}
+    for name, framing in variants.items():
+        results[name] = {
+            **run_stream(framing, chunks, args.first_delay, args.interval),
+            "cpu_us_per_chunk": framing_cpu(writer_framing(0, 0) if name == "writer" else framing, chunks),
+        }
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "results": results}, indent=2))
+        return 0
+
+    print(f"{args.chunks} chunks, eerste na {args.first_delay}s, daarna elke {args.interval * 1000:.1f}ms "
+          f"(writer: {args.flush_ms:g}ms / {args.flush_bytes}B)")
+    print(f"{'framing':<12} {'bytes':>8} {'writes':>7} {'syscalls':>9} {'ttft_ms':>8} {'total_ms':>9} {'cpu_us':>7}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['bytes']:>8} {r['writes']:>7} {r['syscalls'] if r['syscalls'] is not None else '-':>9} "
+              f"{r['ttft_ms']:>8} {r['total_ms']:>9} {r['cpu_us_per_chunk']:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+"""
+Regressie benchmark: upstream calls per TavilyClient methode
+Draait volledig offline met een stub session en faalt als een methode
+meer upstream calls doet dan verwacht.
+
+Gebruik (vanuit api/):
+    python -m benchmarks.upstream_calls
+"""
+import sys
+import time
+from typing import Any, Dict, List
+
+from lib.tavily_client import TavilyClient
+
+
+# Verwacht aantal upstream calls per aanroep van een client methode
+EXPECTED_CALLS_PER_INVOCATION = {
+    "search": 1,
+    "get_clean_results": 1,
+    "search_news": 1,
+}
+
+
+class _StubResponse:
+    def __init__(self, payload: Dict[str, Any]):
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self) -> Dict[str, Any]:
+        n = self._payload.get("max_results", 5)
+        return {"results": [
+            {
+                "title": f"{self._payload['query']} {i}",
+                "url": f"https://example.com/{i}",
+                "content": "lorem ipsum",
+                "published_date": "2025-01-01",
+            }
+            for i in range(n)
+        ]}
+
+
+class StubSession:
+    """Vervangt requests.Session: telt POSTs en antwoordt direct"""
+
+    def __init__(self):
+        self.posts: List[Dict[str, Any]] = []
+
+    def post(self, url: str, json: Dict[str, Any], timeout: Any = None) -> _StubResponse:
+        self.posts.append(json)
+        return _StubResponse(json)
+
+
+def run() -> int:
+    """Draai elke client methode en vergelijk upstream calls met de verwachting"""
+    failures = 0
+    print(f"{'method':<20} {'invocations':>11} {'upstream':>9} {'per call':>9} {'ms':>8}")
+
+    cases = {
+        "search": lambda c: c.search("python"),
+        "get_clean_results": lambda c: c.get_clean_results("python"),
+        "search_news": lambda c: c.search_news("python", days=3),
+    }
+    for name, invoke in cases.items():
+        client = TavilyClient(api_key="benchmark")
+        client.session = StubSession()
+        invocations = 20
+        start = time.perf_counter()
+        for _ in range(invocations):
+            invoke(client)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        upstream = len(client.session.posts)
+        per_call = upstream / invocations
+        ok = per_call <= EXPECTED_CALLS_PER_INVOCATION[name]
+        failures += 0 if ok else 1
+        print(f"{name:<20} {invocations:>11} {upstream:>9} {per_call:>9.2f} {elapsed_ms:>8.2f}"
+              f"{'' if ok else '  REGRESSION'}")
+
+    # Batch: 1 call per unieke query
+    client = TavilyClient(api_key="benchmark")
+    client.session = StubSession()
+    queries = ["ai", "python", "ai", "firebase"]
+    client.search_news_batch(queries)
+    upstream = len(client.session.posts)
+    ok = upstream == len(set(queries))
+    failures += 0 if ok else 1
+    print(f"{'search_news_batch':<20} {1:>11} {upstream:>9} {'-':>9} {'-':>8}"
+          f"{'' if ok else '  REGRESSION'}")
+    print(f"call_stats: {client.call_stats()}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
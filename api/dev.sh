@@ -1,3 +1,10 @@
-# FastAPI Backend lokaal draaien
+# API lokaal draaien (zelfde router als de Firebase Function, zie lib/asgi.py)
+# Vereist: pip install uvicorn gunicorn
 cd api
+
+# Development (auto reload)
 uvicorn main:app --reload --host 0.0.0.0 --port 8000
+
+# Load tests / container: meerdere worker processen
+#   uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4
+#   gunicorn main:wsgi_app -k gthread --workers 4 --threads 32 --bind 0.0.0.0:8000
@@ -1,15 +1,25 @@
 """
 API Library - AI Clients
+
+Clients worden lazy geladen (PEP 562) zodat `import lib.*` niet de hele
+AI stack (google.generativeai, PIL, requests) importeert bij cold start.
 """
+import importlib
+
+_EXPORTS = {
+    'GeminiClient': 'gemini_client',
+    'quick_chat': 'gemini_client',
+    'analyze_image': 'gemini_client',
+    'TavilyClient': 'tavily_client',
+    'quick_search': 'tavily_client',
+    'search_and_summarize': 'tavily_client',
+}
+
+__all__ = list(_EXPORTS)
+
 
-from .gemini_client import GeminiClient, quick_chat, analyze_image
-from .tavily_client import TavilyClient, quick_search, search_and_summarize
-
-__all__ = [
-    'GeminiClient',
-    'TavilyClient',
-    'quick_chat',
-    'analyze_image',
-    'quick_search',
-    'search_and_summarize',
-]
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f".{_EXPORTS[name]}", __name__)
+    return getattr(module, name)
@@ -0,0 +1,128 @@
+"""
+Async helpers
+Eén achtergrond event loop per proces waarop alle async upstream calls draaien
+(AsyncTavilyClient, GeminiClient.*_async). Synchrone handlers gebruiken run()
+of iter_completed(); zo blijven gRPC channels en httpx pools aan één loop
+gebonden, ook onder uvicorn (waar handlers in een thread pool draaien).
+
+    results = aio.run(aio.gather_bounded([client.search(q) for q in queries], limit=5, timeout=10))
+
+Per-call deadlines en een concurrency limiet zitten in gather_bounded /
+iter_completed: één trage upstream houdt de rest niet op.
+"""
+import asyncio
+import queue
+import threading
+from typing import Any, Awaitable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_DONE = object()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Lazy initialization van de achtergrond event loop (daemon thread)"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="aio", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run(awaitable: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    Voer een coroutine uit op de achtergrond loop en wacht op het resultaat
+    De contextvars van de caller (metrics van de huidige request) gaan mee.
+
+    Raises:
+        TimeoutError: Na timeout seconden (de coroutine wordt dan geannuleerd)
+    """
+    future = asyncio.run_coroutine_threadsafe(_await(awaitable), get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+async def _await(awaitable: Awaitable[T]) -> T:
+    return await awaitable
+
+
+async def _bounded(semaphore: asyncio.Semaphore, awaitable: Awaitable[T], timeout: Optional[float]) -> T:
+    async with semaphore:
+        return await asyncio.wait_for(awaitable, timeout)
+
+
+async def gather_bounded(
+    awaitables: Iterable[Awaitable[T]],
+    limit: int = 8,
+    timeout: Optional[float] = None,
+    return_exceptions: bool = True
+) -> List[Any]:
+    """
+    asyncio.gather met max `limit` gelijktijdige calls en een deadline per call
+
+    Args:
+        awaitables: Coroutines (worden pas gestart als er een slot vrij is)
+        limit: Max gelijktijdige calls
+        timeout: Max seconden per call (vanaf de start van die call)
+        return_exceptions: Fouten (ook asyncio.TimeoutError) als resultaat teruggeven
+            in plaats van de hele gather af te breken
+
+    Returns:
+        Resultaten in dezelfde volgorde als awaitables
+    """
+    semaphore = asyncio.Semaphore(limit)
+    return await asyncio.gather(
+        *(_bounded(semaphore, awaitable, timeout) for awaitable in awaitables),
+        return_exceptions=return_exceptions
+    )
+
+
+def iter_completed(
+    awaitables: Iterable[Awaitable[T]],
+    limit: int = 8,
+    timeout: Optional[float] = None
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Synchrone iterator over (index, resultaat of exception) in volgorde van afronding
+    Voor streaming responses (NDJSON/SSE) vanuit een synchrone handler. Sluiten van
+    de iterator (client disconnect) annuleert de calls die nog lopen.
+
+    Args:
+        awaitables: Coroutines
+        limit: Max gelijktijdige calls
+        timeout: Max seconden per call
+    """
+    awaitables = list(awaitables)
+    results: "queue.Queue[Any]" = queue.Queue()
+
+    async def produce():
+        semaphore = asyncio.Semaphore(limit)
+
+        async def one(index: int, awaitable: Awaitable[T]):
+            try:
+                results.put((index, await _bounded(semaphore, awaitable, timeout)))
+            except Exception as e:
+                results.put((index, e))
+
+        try:
+            await asyncio.gather(*(one(i, a) for i, a in enumerate(awaitables)))
+        finally:
+            results.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(produce(), get_loop())
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,196 @@
+"""
+ASGI / WSGI adapter
+Draait dezelfde router (route_request) buiten Firebase Functions, onder
+uvicorn (ASGI) of gunicorn (WSGI) met meerdere workers. Handig voor lokale
+load tests en container deployments.
+
+    uvicorn main:app --workers 4
+    gunicorn main:wsgi_app -k gthread --workers 4 --threads 32
+
+Handlers zijn synchroon: het ASGI adapter draait ze in een thread pool en
+leest streaming bodies (SSE, NDJSON) chunk voor chunk uit dezelfde pool, zodat
+de event loop nooit blokkeert en elke chunk direct naar de client gaat.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Tuple
+from firebase_functions import https_fn
+from werkzeug.http import remove_hop_by_hop_headers
+from lib.router import route_request
+from lib.utils import create_json_response
+
+# Threads voor handlers en stream chunks (per worker proces)
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "64"))
+# Bovengrens voor de gebufferde request body (de router checkt daarna per route)
+ASGI_MAX_BODY = int(os.getenv("ASGI_MAX_BODY", str(32 * 1024 * 1024)))
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+_DONE = object()
+
+
+def wsgi_app(environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+    """
+    WSGI app rond de router (gunicorn, waitress, werkzeug dev server)
+    De Werkzeug response is zelf een WSGI app; streaming bodies worden per chunk doorgegeven.
+    """
+    response = _handle(environ)
+    return response(environ, start_response)
+
+
+def _handle(environ: Dict[str, Any]) -> https_fn.Response:
+    """Router aanroepen; hop-by-hop headers (bijv. Connection bij SSE) zijn aan de server (PEP 3333)"""
+    response = route_request(https_fn.Request(environ))
+    remove_hop_by_hop_headers(response.headers)
+    return response
+
+
+def _environ(scope: Scope, body: bytes) -> Dict[str, Any]:
+    """WSGI environ uit een ASGI http scope + gebufferde body"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        # WSGI strings zijn latin-1 gecodeerde bytes
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = f"HTTP_{name}"
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def _read_body(receive: Receive) -> Tuple[bytes, bool]:
+    """
+    Lees de volledige request body
+
+    Returns:
+        Tuple van (body, too_large)
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if len(body) > ASGI_MAX_BODY:
+            return b"", True
+        if not message.get("more_body"):
+            break
+    return bytes(body), False
+
+
+async def _watch_disconnect(receive: Receive, disconnected: asyncio.Event):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    disconnected.set()
+
+
+def _next_chunk(iterator: Iterator[bytes]) -> Any:
+    return next(iterator, _DONE)
+
+
+async def _send_response(
+    response: https_fn.Response,
+    environ: Dict[str, Any],
+    send: Send,
+    disconnected: asyncio.Event
+):
+    """Response headers + body versturen; streaming bodies chunk voor chunk"""
+    loop = asyncio.get_running_loop()
+    app_iter, status, headers = response.get_wsgi_response(environ)
+    await send({
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+
+    try:
+        if not response.is_streamed:
+            # Eén write voor de hele body (geen extra lege write die op een delayed ACK wacht)
+            await send({"type": "http.response.body", "body": b"".join(app_iter), "more_body": False})
+            return
+        iterator = iter(app_iter)
+        while not disconnected.is_set():
+            # next() kan blokkeren op een upstream stream: buiten de event loop
+            chunk = await loop.run_in_executor(_executor, _next_chunk, iterator)
+            if chunk is _DONE:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        # Sluit de generator (ook bij disconnect), zodat upstream streams stoppen en metrics afronden
+        close = getattr(app_iter, "close", None)
+        if close:
+            await loop.run_in_executor(_executor, close)
+
+
+async def _lifespan(receive: Receive, send: Send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Scope, receive: Receive, send: Send):
+    """ASGI app rond de router (uvicorn, hypercorn)"""
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    body, too_large = await _read_body(receive)
+    if too_large:
+        response = create_json_response(
+            {"error": f"Request body too large (max {ASGI_MAX_BODY} bytes)"},
+            status=413
+        )
+        environ = _environ(scope, b"")
+        return await _send_response(response, environ, send, asyncio.Event())
+
+    environ = _environ(scope, body)
+    loop = asyncio.get_running_loop()
+    response = await loop.run_in_executor(_executor, _handle, environ)
+
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+    try:
+        await _send_response(response, environ, send, disconnected)
+    finally:
+        watcher.cancel()
+
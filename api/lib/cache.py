@@ -0,0 +1,300 @@
+"""
+Cache utilities
+In-process LRU cache met TTL en byte limiet, optioneel met Firestore als gedeelde tweede laag
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+from lib import metrics
+
+
+def to_timestamp(epoch: float) -> datetime:
+    """
+    Epoch seconden → UTC datetime (Firestore Timestamp)
+    
+    Firestore TTL policies werken alleen op Timestamp velden; `expires_at` wordt
+    daarom zo opgeslagen, zodat verlopen documenten automatisch verdwijnen.
+    """
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+def from_timestamp(value: Any) -> float:
+    """Firestore Timestamp (of een oud float veld) → epoch seconden"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value or 0)
+
+
+@dataclass
+class CacheEntry:
+    """Eén gecachte waarde met metadata"""
+    value: Any
+    created_at: float
+    expires_at: float
+    size: int = 0
+
+    @property
+    def age(self) -> float:
+        """Leeftijd in seconden"""
+        return max(time.time() - self.created_at, 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+
+def make_cache_key(namespace: str, **parts: Any) -> str:
+    """
+    Stabiele cache key van een namespace + willekeurige (JSON) onderdelen
+
+    Returns:
+        "<namespace>:<sha256 hex>"
+    """
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def _size_of(value: Any) -> int:
+    """Geschatte grootte van een waarde in bytes (JSON encoded)"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(json.dumps(value, default=str).encode("utf-8"))
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache met TTL en max aantal entries/bytes
+
+    Oudste (least recently used) entries worden verwijderd als een van de
+    limieten overschreden wordt.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 300
+    ):
+        """
+        Args:
+            max_entries: Max aantal entries
+            max_bytes: Max totale grootte van alle waarden in bytes
+            ttl: Default time-to-live in seconden
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Haal entry op (None bij miss of verlopen)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry.expired:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[float] = None,
+        created_at: Optional[float] = None
+    ) -> Optional[CacheEntry]:
+        """
+        Sla waarde op
+
+        Args:
+            key: Cache key
+            value: JSON-serialiseerbare waarde (of bytes)
+            ttl: Optionele TTL (default: self.ttl)
+            created_at: Optioneel origineel tijdstip (bij overnemen uit een andere laag)
+
+        Returns:
+            De nieuwe CacheEntry, of None als de waarde groter is dan max_bytes
+        """
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return None
+        now = time.time()
+        created_at = created_at or now
+        entry = CacheEntry(value, created_at, now + (self.ttl if ttl is None else ttl), size)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = entry
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+        return entry
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss statistieken en huidige grootte"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class FirestoreCache:
+    """
+    Gedeelde cache laag in Firestore (over alle instances heen)
+
+    Documenten: {value: <json string>, created_at: float, expires_at: Timestamp}
+    Fouten worden genegeerd: de cache mag een request nooit laten falen.
+    Verlopen documenten worden bij het lezen genegeerd; zet een TTL policy op
+    `expires_at` om ze ook op te ruimen (zie README).
+    """
+
+    def __init__(self, collection: str, get_db: Callable[[], Any]):
+        """
+        Args:
+            collection: Firestore collectie naam (bijv. "_cache_search")
+            get_db: Functie die de Firestore client teruggeeft (lazy)
+        """
+        self.collection = collection
+        self._get_db = get_db
+
+    def _doc(self, key: str):
+        # Document ids mogen geen '/' bevatten
+        doc_id = key.replace("/", "_")
+        return self._get_db().collection(self.collection).document(doc_id)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with metrics.timed_upstream("firestore"):
+                snapshot = self._doc(key).get()
+            if not snapshot.exists:
+                return None
+            data = snapshot.to_dict()
+            entry = CacheEntry(
+                json.loads(data["value"]),
+                data["created_at"],
+                from_timestamp(data["expires_at"]),
+                len(data["value"])
+            )
+        except Exception:
+            # Firestore fout of onleesbaar document: behandelen als miss
+            return None
+        return None if entry.expired else entry
+
+    def set(self, key: str, entry: CacheEntry):
+        try:
+            with metrics.timed_upstream("firestore"):
+                self._doc(key).set({
+                    "value": json.dumps(entry.value, default=str),
+                    "created_at": entry.created_at,
+                    "expires_at": to_timestamp(entry.expires_at),
+                })
+        except Exception:
+            pass
+
+
+class TieredCache:
+    """
+    Twee-laags cache: in-process TTLCache + optioneel FirestoreCache
+
+    Een Firestore hit wordt ook in het geheugen gezet (met resterende TTL).
+    """
+
+    def __init__(self, local: TTLCache, remote: Optional[FirestoreCache] = None):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key: str) -> Tuple[Optional[CacheEntry], Optional[str]]:
+        """
+        Returns:
+            Tuple van (entry, tier) waarbij tier "memory", "firestore" of None is
+        """
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry, "memory"
+        if self.remote is not None:
+            entry = self.remote.get(key)
+            if entry is not None:
+                self.local.set(
+                    key,
+                    entry.value,
+                    ttl=entry.expires_at - time.time(),
+                    created_at=entry.created_at
+                )
+                return entry, "firestore"
+        return None, None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> CacheEntry:
+        entry = self.local.set(key, value, ttl=ttl)
+        if entry is None:
+            now = time.time()
+            entry = CacheEntry(value, now, now + (self.local.ttl if ttl is None else ttl))
+        if self.remote is not None:
+            self.remote.set(key, entry)
+        return entry
+
+    def get_or_set(
+        self,
+        key: str,
+        compute: Callable[[], Any],
+        ttl: Optional[float] = None
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Haal waarde uit de cache of bereken (en cache) hem
+
+        Returns:
+            Tuple van (value, info) met info = {"status": "HIT"/"MISS", "tier": ..., "age": seconden}
+        """
+        entry, tier = self.get(key)
+        if entry is not None:
+            return entry.value, {"status": "HIT", "tier": tier, "age": entry.age}
+        value = compute()
+        self.set(key, value, ttl=ttl)
+        return value, {"status": "MISS", "tier": None, "age": 0.0}
+
+    def stats(self) -> Dict[str, Any]:
+        return self.local.stats()
+
+
+def cache_headers(info: Dict[str, Any]) -> Dict[str, str]:
+    """HTTP headers voor cache status (X-Cache, X-Cache-Tier, Age)"""
+    headers = {
+        "X-Cache": info["status"],
+        "Age": str(int(info["age"])),
+    }
+    if info.get("tier"):
+        headers["X-Cache-Tier"] = info["tier"]
+    return headers
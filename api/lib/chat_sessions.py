@@ -0,0 +1,274 @@
+"""
+Server-side chat sessies
+Geschiedenis staat in Firestore (per session id) in plaats van bij elke request
+vanuit de client. Oudere turns worden incrementeel samengevat zodra de
+geschiedenis over een token budget gaat, zodat lange gesprekken een (bijna)
+constante request grootte houden.
+
+Turns worden in een Firestore transactie toegevoegd (gelijktijdige turns op
+dezelfde sessie gaan niet verloren); compactie loopt na de response in een
+achtergrond thread, zodat geen enkele turn op de samenvatting call wacht.
+"""
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+from lib import metrics
+from lib.utils import estimate_tokens
+
+COMPACTION_PROMPT = (
+    "Vat het onderstaande gesprek beknopt samen voor jezelf, zodat je het gesprek "
+    "later kunt voortzetten. Behoud feiten, namen, beslissingen en open vragen.\n\n"
+    "{previous}{turns}"
+)
+
+
+class SessionNotFoundError(KeyError):
+    """Onbekende session_id (HTTP 404)"""
+
+
+@dataclass
+class ChatSession:
+    """Staat van één gesprek"""
+    id: str
+    summary: str = ""
+    turns: List[Dict[str, Any]] = field(default_factory=list)
+    cache_name: Optional[str] = None
+    cache_key: Optional[str] = None
+    cache_expires_at: float = 0.0
+    turn_count: int = 0
+
+
+def _turns_text(turns: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"{turn['role']}: {' '.join(str(part) for part in turn['parts'])}"
+        for turn in turns
+    )
+
+
+class ChatSessionStore:
+    """
+    Laad, bewaar en compacteer chat sessies in Firestore
+
+    Gebruik:
+        session = store.load(session_id)
+        response = client.chat(message, **store.chat_kwargs(session, system_prompt))
+        store.record_turn(session, message, response, system_prompt)
+    """
+
+    COLLECTION = "chat_sessions"
+
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        get_gemini: Callable[[], Any],
+        token_budget: int = 4000,
+        keep_recent: int = 6,
+        cache_min_tokens: int = 32768,
+        cache_ttl: int = 3600
+    ):
+        """
+        Args:
+            get_db: Functie die de Firestore client teruggeeft (lazy)
+            get_gemini: Functie die de GeminiClient teruggeeft (lazy)
+            token_budget: Max geschatte tokens in de turns voor compactie
+            keep_recent: Aantal meest recente turns dat letterlijk bewaard blijft
+            cache_min_tokens: Vanaf deze prefix grootte wordt een upstream context cache gemaakt
+            cache_ttl: Levensduur van de upstream context cache in seconden
+        """
+        self._get_db = get_db
+        self._get_gemini = get_gemini
+        self.token_budget = token_budget
+        # Altijd een even aantal (user + model paren)
+        self.keep_recent = max(2, keep_recent - keep_recent % 2)
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_ttl = cache_ttl
+        # Sessies waarvoor in deze instance al een compactie loopt
+        self._compacting: Set[str] = set()
+        self._compacting_lock = threading.Lock()
+
+    def _collection(self):
+        return self._get_db().collection(self.COLLECTION)
+
+    def load(self, session_id: Optional[str] = None) -> ChatSession:
+        """
+        Laad een sessie (of start een nieuwe zonder session_id)
+
+        Raises:
+            SessionNotFoundError: Als de sessie niet bestaat
+        """
+        if not session_id:
+            return ChatSession(id=self._collection().document().id)
+        with metrics.timed_upstream("firestore"):
+            snapshot = self._collection().document(session_id).get()
+        if not snapshot.exists:
+            raise SessionNotFoundError(f"Chat session not found: {session_id}")
+        return self._from_dict(session_id, snapshot.to_dict())
+
+    @staticmethod
+    def _from_dict(session_id: str, data: Dict[str, Any]) -> ChatSession:
+        return ChatSession(
+            id=session_id,
+            summary=data.get("summary", ""),
+            turns=data.get("turns", []),
+            cache_name=data.get("cache_name"),
+            cache_key=data.get("cache_key"),
+            cache_expires_at=data.get("cache_expires_at", 0.0),
+            turn_count=data.get("turn_count", 0)
+        )
+
+    def _summary_contents(self, session: ChatSession) -> List[Dict[str, Any]]:
+        """Samenvatting als vaste prefix van de chat geschiedenis"""
+        if not session.summary:
+            return []
+        return [
+            {"role": "user", "parts": [f"Samenvatting van het gesprek tot nu toe:\n{session.summary}"]},
+            {"role": "model", "parts": ["Begrepen, ik ga verder vanaf deze samenvatting."]},
+        ]
+
+    @staticmethod
+    def _prefix_key(system_prompt: Optional[str], summary: str) -> str:
+        return hashlib.sha256(f"{system_prompt or ''}\x00{summary}".encode("utf-8")).hexdigest()
+
+    def chat_kwargs(self, session: ChatSession, system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Keyword arguments voor GeminiClient.chat / stream_chat
+
+        Met een geldige upstream context cache zitten system prompt en samenvatting
+        in de cache en gaan alleen de recente turns mee.
+        """
+        cache_valid = (
+            session.cache_name
+            and session.cache_key == self._prefix_key(system_prompt, session.summary)
+            and session.cache_expires_at > time.time() + 60
+        )
+        if cache_valid:
+            return {"history": list(session.turns), "cached_content": session.cache_name}
+        return {
+            "history": self._summary_contents(session) + list(session.turns),
+            "system_prompt": system_prompt,
+        }
+
+    def record_turn(
+        self,
+        session: ChatSession,
+        message: str,
+        response: str,
+        system_prompt: Optional[str] = None
+    ):
+        """
+        Voeg een user/model turn toe en sla op
+
+        De turn wordt in een transactie achter de opgeslagen turns gezet (Firestore
+        probeert opnieuw bij een conflict), niet over de geladen sessie heen: twee
+        gelijktijdige turns (dubbele submit, twee tabs) blijven allebei bewaard.
+        Gaat de geschiedenis daarna over het token budget, dan wordt in de
+        achtergrond gecompacteerd; deze turn wacht daar niet op.
+        """
+        from firebase_admin import firestore
+
+        turn = [
+            {"role": "user", "parts": [message]},
+            {"role": "model", "parts": [response]},
+        ]
+        ref = self._collection().document(session.id)
+
+        @firestore.transactional
+        def append(transaction) -> Dict[str, Any]:
+            snapshot = ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else {}
+            data["turns"] = data.get("turns", []) + turn
+            data["turn_count"] = data.get("turn_count", 0) + 1
+            data["updated_at"] = time.time()
+            transaction.set(ref, data)
+            return data
+
+        with metrics.timed_upstream("firestore"):
+            data = append(self._get_db().transaction())
+        stored = self._from_dict(session.id, data)
+        session.summary, session.turns, session.turn_count = stored.summary, stored.turns, stored.turn_count
+
+        if estimate_tokens(_turns_text(session.turns)) > self.token_budget:
+            self._compact_later(session.id, system_prompt)
+
+    def _compact_later(self, session_id: str, system_prompt: Optional[str]):
+        """Compacteer in een achtergrond thread (hoogstens één tegelijk per sessie per instance)"""
+        with self._compacting_lock:
+            if session_id in self._compacting:
+                return
+            self._compacting.add(session_id)
+        threading.Thread(
+            target=self._compact_session, args=(session_id, system_prompt),
+            name=f"compact-{session_id[:8]}", daemon=True
+        ).start()
+
+    def _compact_session(self, session_id: str, system_prompt: Optional[str]):
+        """
+        Samenvatting maken buiten de transactie, daarna in een transactie opslaan
+
+        Alleen als de samenvatting en de gecompacteerde turns nog ongewijzigd zijn
+        (anders heeft een andere instance al gecompacteerd); turns die intussen
+        zijn toegevoegd blijven staan.
+        """
+        from firebase_admin import firestore
+
+        try:
+            session = self.load(session_id)
+            compacted = len(session.turns) - self.keep_recent
+            if compacted <= 0 or estimate_tokens(_turns_text(session.turns)) <= self.token_budget:
+                return
+            previous_summary = session.summary
+            old = session.turns[:compacted]
+            self._compact(session, system_prompt)
+            ref = self._collection().document(session_id)
+
+            @firestore.transactional
+            def save(transaction) -> bool:
+                data = ref.get(transaction=transaction).to_dict() or {}
+                turns = data.get("turns", [])
+                if data.get("summary", "") != previous_summary or turns[:compacted] != old:
+                    return False
+                transaction.update(ref, {
+                    "summary": session.summary,
+                    "turns": turns[compacted:],
+                    "cache_name": session.cache_name,
+                    "cache_key": session.cache_key,
+                    "cache_expires_at": session.cache_expires_at,
+                    "updated_at": time.time(),
+                })
+                return True
+
+            with metrics.timed_upstream("firestore"):
+                saved = save(self._get_db().transaction())
+            metrics.increment("chat_sessions.compacted" if saved else "chat_sessions.compaction_conflicts")
+        except Exception:
+            metrics.increment("chat_sessions.compaction_errors")
+        finally:
+            with self._compacting_lock:
+                self._compacting.discard(session_id)
+
+    def _compact(self, session: ChatSession, system_prompt: Optional[str]):
+        """Vat de oudste turns samen in de lopende samenvatting"""
+        old, session.turns = session.turns[:-self.keep_recent], session.turns[-self.keep_recent:]
+        if not old:
+            return
+        previous = f"Eerdere samenvatting:\n{session.summary}\n\n" if session.summary else ""
+        prompt = COMPACTION_PROMPT.format(previous=previous, turns=_turns_text(old))
+        session.summary = self._get_gemini().chat(prompt)
+
+        # Stabiele prefix (system prompt + samenvatting) upstream cachen als hij groot genoeg is
+        session.cache_name = None
+        session.cache_key = None
+        session.cache_expires_at = 0.0
+        prefix_tokens = estimate_tokens((system_prompt or "") + session.summary)
+        if prefix_tokens >= self.cache_min_tokens:
+            name = self._get_gemini().create_context_cache(
+                self._summary_contents(session),
+                system_prompt=system_prompt,
+                ttl_seconds=self.cache_ttl
+            )
+            if name:
+                session.cache_name = name
+                session.cache_key = self._prefix_key(system_prompt, session.summary)
+                session.cache_expires_at = time.time() + self.cache_ttl
@@ -0,0 +1,255 @@
+"""
+Context packing voor samenvattingen
+Zoekresultaten → passages → near-duplicates eruit → gerangschikt op relevantie
+voor de query → zoveel als binnen een token budget past. De prompt groeit zo niet
+meer mee met hoeveel tekst Tavily teruggeeft, en dezelfde snippet van twee sites
+wordt maar één keer betaald.
+
+Near-duplicates: simhash (64 bits) over woord shingles als snelle check, daarna
+shingle containment tegen de al gekozen passages. Relevantie: BM25 over de passages.
+"""
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+from lib.utils import estimate_tokens
+
+# Woorden per shingle
+SHINGLE_SIZE = 3
+# Max hamming afstand tussen simhashes voor een (vrijwel) identieke passage
+SIMHASH_DISTANCE = 3
+# Fractie gedeelde shingles (van de kleinste passage) waarboven een passage dubbel is
+CONTAINMENT = 0.8
+# Een passage die niet meer past wordt ingekort als er minstens zoveel tokens over zijn
+MIN_PASSAGE_TOKENS = 24
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_MASK64 = (1 << 64) - 1
+
+
+@dataclass
+class Passage:
+    """Stuk tekst uit één zoekresultaat"""
+    source: int
+    position: int
+    text: str
+    tokens: int
+    words: List[str] = field(repr=False)
+    shingles: Set[int] = field(repr=False)
+    simhash: int = 0
+    score: float = 0.0
+
+
+@dataclass
+class PackedContext:
+    """Resultaat van pack_results: prompt context + wat het heeft opgeleverd"""
+    text: str
+    tokens_in: int
+    tokens_out: int
+    passages_in: int
+    passages_out: int
+    duplicates: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.tokens_in - self.tokens_out, 0)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_saved": self.tokens_saved,
+            "passages_in": self.passages_in,
+            "passages_out": self.passages_out,
+            "duplicates": self.duplicates,
+        }
+
+
+def _words(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if len(word) > 1]
+
+
+def _shingles(words: List[str]) -> Set[int]:
+    """64-bit hashes van de woord shingles (hash() is per proces gesalt; alleen binnen één packing vergelijken)"""
+    if len(words) < SHINGLE_SIZE:
+        return {hash(tuple(words)) & _MASK64} if words else set()
+    return {hash(tuple(words[i:i + SHINGLE_SIZE])) & _MASK64 for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def simhash(shingles: Set[int]) -> int:
+    """64-bit simhash: per bit de meerderheid over alle shingle hashes"""
+    if not shingles:
+        return 0
+    # Lazy: numpy pas laden als er echt gepackt wordt (niet bij elke /api/search cold start)
+    import numpy as np
+    values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    bits = np.unpackbits(values.view(np.uint8)).reshape(len(shingles), 64)
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def split_passages(text: str, max_words: int = 80) -> List[str]:
+    """Zinnen samengevoegd tot passages van hooguit max_words woorden (te lange zinnen worden geknipt)"""
+    sentences: List[str] = []
+    for sentence in _SENTENCE.split(text):
+        words = sentence.split()
+        sentences.extend(" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words))
+
+    passages: List[str] = []
+    current: List[str] = []
+    size = 0
+    for sentence in sentences:
+        words = sentence.count(" ") + 1
+        if current and size + words > max_words:
+            passages.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += words
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def _source_header(result: Dict[str, Any]) -> str:
+    return f"Bron: {result.get('title', '')}\nURL: {result.get('url', '')}\n"
+
+
+def full_context(results: List[Dict[str, Any]]) -> str:
+    """Context zonder packing: alle resultaten volledig (de oorspronkelijke prompt)"""
+    return "\n\n".join(_source_header(r) + str(r.get("content", "")) for r in results)
+
+
+def _bm25(passages: List[Passage], query: List[str]):
+    """Zet passage.score op de BM25 score voor de query termen"""
+    if not passages:
+        return
+    terms = set(query)
+    average = sum(len(p.words) for p in passages) / len(passages) or 1.0
+    frequency = Counter(term for p in passages for term in terms.intersection(p.words))
+    idf = {
+        term: math.log(1 + (len(passages) - frequency[term] + 0.5) / (frequency[term] + 0.5))
+        for term in terms
+    }
+    for p in passages:
+        counts = Counter(word for word in p.words if word in terms)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(p.words) / average)
+        p.score = sum(idf[t] * n * (BM25_K1 + 1) / (n + norm) for t, n in counts.items())
+
+
+def _duplicate(passage: Passage, selected: List[Passage]) -> bool:
+    for other in selected:
+        if (passage.simhash ^ other.simhash).bit_count() <= SIMHASH_DISTANCE:
+            return True
+        smallest = min(len(passage.shingles), len(other.shingles))
+        if smallest and len(passage.shingles & other.shingles) >= CONTAINMENT * smallest:
+            return True
+    return False
+
+
+def _truncate(text: str, tokens: int) -> str:
+    """Kap af op een woordgrens binnen ~tokens (met ellipsis)"""
+    cut = text[:max(tokens * 4 - 1, 0)]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut + "…"
+
+
+def pack_results(
+    query: str,
+    results: List[Dict[str, Any]],
+    token_budget: int = 2000,
+    max_words: int = 80
+) -> PackedContext:
+    """
+    Bouw een compacte context uit zoekresultaten
+
+    Args:
+        query: Zoek query (voor de relevantie ranking)
+        results: Tavily resultaten (title, url, content)
+        token_budget: Max geschatte tokens voor de hele context (incl. bron regels)
+        max_words: Max woorden per passage
+
+    Returns:
+        PackedContext; passages staan per bron in de oorspronkelijke volgorde,
+        bronnen zonder gekozen passage vallen weg
+    """
+    passages: List[Passage] = []
+    seen: Set[str] = set()
+    exact = 0
+    for source, result in enumerate(results):
+        # Letterlijk herhaalde zinnen (boilerplate, dezelfde snippet op twee sites) vallen er direct uit
+        sentences = []
+        for sentence in _SENTENCE.split(str(result.get("content", ""))):
+            key = " ".join(sentence.lower().split())
+            if not key:
+                continue
+            if key in seen:
+                exact += 1
+                continue
+            seen.add(key)
+            sentences.append(sentence.strip())
+        for position, text in enumerate(split_passages("\n".join(sentences), max_words)):
+            words = _words(text)
+            shingles = _shingles(words)
+            passages.append(Passage(
+                source=source,
+                position=position,
+                text=text,
+                tokens=estimate_tokens(text) + 1,
+                words=words,
+                shingles=shingles,
+                simhash=simhash(shingles)
+            ))
+
+    _bm25(passages, _words(query))
+    # Hoogste score eerst; bij gelijke score de volgorde van Tavily (beste resultaat eerst)
+    ranked = sorted(passages, key=lambda p: (-p.score, p.source, p.position))
+
+    selected: List[Passage] = []
+    sources: Set[int] = set()
+    used = 0
+    duplicates = exact
+    for passage in ranked:
+        if _duplicate(passage, selected):
+            duplicates += 1
+            continue
+        header = 0 if passage.source in sources else estimate_tokens(_source_header(results[passage.source])) + 1
+        remaining = token_budget - used - header
+        if passage.tokens > remaining:
+            if remaining < MIN_PASSAGE_TOKENS:
+                # Past niet meer; een kortere passage misschien nog wel
+                continue
+            passage.text = _truncate(passage.text, remaining - 1)
+            passage.tokens = estimate_tokens(passage.text) + 1
+        used += header + passage.tokens
+        sources.add(passage.source)
+        selected.append(passage)
+
+    blocks = []
+    for source in sorted(sources):
+        chosen = sorted((p for p in selected if p.source == source), key=lambda p: p.position)
+        blocks.append(_source_header(results[source]) + "\n".join(p.text for p in chosen))
+    text = "\n\n".join(blocks)
+
+    return PackedContext(
+        text=text,
+        tokens_in=estimate_tokens(full_context(results)),
+        tokens_out=estimate_tokens(text),
+        passages_in=len(passages),
+        passages_out=len(selected),
+        duplicates=duplicates
+    )
+
+
+def pack_or_full(query: str, results: List[Dict[str, Any]], token_budget: Optional[int]) -> PackedContext:
+    """pack_results, of de volledige context als token_budget 0/None is (packing uit)"""
+    if not token_budget:
+        text = full_context(results)
+        tokens = estimate_tokens(text)
+        return PackedContext(text, tokens, tokens, len(results), len(results), 0)
+    return pack_results(query, results, token_budget)
@@ -0,0 +1,120 @@
+"""
+Response encoding
+Snelle JSON serialisatie (orjson als die geïnstalleerd is), gzip/brotli
+compressie via Accept-Encoding, sterke ETags met If-None-Match → 304 en
+per-route Cache-Control (zodat de Firebase Hosting CDN veilige GETs cachet).
+"""
+import gzip
+import hashlib
+import json
+import os
+from typing import Any, Callable, Optional
+from firebase_functions import https_fn
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Kleinere bodies passen in één TCP segment: compressie levert dan niets op
+COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def json_dumps(data: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    Serialiseer naar compacte UTF-8 JSON bytes
+
+    Args:
+        data: JSON-serialiseerbare data
+        default: Fallback voor onbekende types (zoals bij json.dumps)
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=default, option=_ORJSON_OPTIONS)
+    return json.dumps(data, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _negotiate(req: https_fn.Request) -> Optional[str]:
+    """Beste content-coding die de client accepteert ("br", "gzip" of None)"""
+    accepted = req.accept_encodings
+    if brotli is not None and accepted["br"] > 0:
+        return "br"
+    if accepted["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def _compress(data: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0: deterministische output
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _etag(data: bytes, coding: Optional[str]) -> str:
+    """Sterke ETag per representatie (gecomprimeerde varianten krijgen een eigen suffix)"""
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return f'"{digest}-{coding}"' if coding else f'"{digest}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match gebruikt weak comparison: W/ prefix negeren
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def finalize_response(
+    req: https_fn.Request,
+    response: https_fn.Response,
+    cache_control: Optional[str] = None
+) -> https_fn.Response:
+    """
+    Post-processing van een (niet-streaming) response
+
+    1. Cache-Control van de route (alleen bij 200, als de handler zelf niets zet)
+    2. GET/HEAD 200: sterke ETag, If-None-Match match → 304 zonder body
+    3. gzip/brotli compressie boven COMPRESS_MIN_BYTES voor JSON/tekst
+
+    Streaming responses (SSE, NDJSON) worden ongewijzigd doorgegeven.
+    """
+    if response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+
+    compressible = (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+    body = response.get_data()
+    coding = _negotiate(req) if compressible and len(body) >= COMPRESS_MIN_BYTES else None
+    if compressible:
+        response.vary.add("Accept-Encoding")
+
+    if response.status_code == 200:
+        if cache_control and "Cache-Control" not in response.headers:
+            response.headers["Cache-Control"] = cache_control
+        if req.method in ("GET", "HEAD"):
+            etag = _etag(body, coding)
+            response.headers["ETag"] = etag
+            if_none_match = req.headers.get("If-None-Match")
+            if if_none_match and _etag_matches(if_none_match, etag):
+                not_modified = https_fn.Response(status=304)
+                for name in ("ETag", "Cache-Control", "Vary"):
+                    if name in response.headers:
+                        not_modified.headers[name] = response.headers[name]
+                return not_modified
+
+    if coding:
+        response.set_data(_compress(body, coding))
+        response.headers["Content-Encoding"] = coding
+    return response
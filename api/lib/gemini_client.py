@@ -2,36 +2,149 @@
 Gemini AI Client
 Simple wrapper voor Google's Gemini API met chat en image support
 """
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
-import google.generativeai as genai
-from PIL import Image
-import io
-import base64
+import json
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterator, TYPE_CHECKING
+from lib import metrics
+from lib.singleflight import SingleFlight, make_key
+from lib.startup import timed
+
+with timed("google.generativeai"):
+    import google.generativeai as genai
+
+if TYPE_CHECKING:
+    from lib.image_pipeline import PreparedImage
 
 
 class GeminiClient:
-    """Client voor Gemini AI interacties"""
+    """
+    Client voor Gemini AI interacties
+    
+    Identieke chat/stream_chat calls die tegelijk lopen delen één generatie (lib/singleflight.py).
+    De *_async methodes draaien op de gRPC asyncio transport (gebruik ze vanaf de loop uit lib/aio.py).
+    """
     
-    def __init__(self, api_key: Optional[str] = None):
+    MODEL_NAME = 'gemini-2.0-flash-exp'
+    EMBEDDING_MODEL = 'models/text-embedding-004'
+    
+    # Max aantal GenerativeModel instances per (system prompt, generation config)
+    MODEL_CACHE_SIZE = 32
+    
+    def __init__(self, api_key: Optional[str] = None, coalesce: bool = True):
         """
         Initialiseer Gemini client
         
         Args:
             api_key: Gemini API key (gebruikt GEMINI_API_KEY env var als niet gegeven)
+            coalesce: Identieke gelijktijdige chat calls samenvoegen tot één generatie
         """
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("Gemini API key is vereist")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # GEMINI_API_ENDPOINT: alternatieve (REST) endpoint, bijv. een lokale stand-in (benchmarks/fakes.py)
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        # De REST transport van genai heeft geen echte async client: *_async gaan dan via een thread
+        self._rest = bool(endpoint)
+        if endpoint:
+            genai.configure(api_key=self.api_key, transport="rest", client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=self.api_key)
+        self.model = genai.GenerativeModel(self.MODEL_NAME)
+        self._models: "OrderedDict[str, genai.GenerativeModel]" = OrderedDict()
+        self._models_lock = threading.Lock()
+        self._chat_flight = SingleFlight("gemini_chat") if coalesce else None
+        self._stream_flight = SingleFlight("gemini_stream") if coalesce else None
+    
+    def get_model(
+        self,
+        system_prompt: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        cached_content: Optional[str] = None
+    ) -> "genai.GenerativeModel":
+        """
+        GenerativeModel met native system instruction (gecached per prompt + config)
+        
+        De system prompt gaat als configuratie mee met elke request, in plaats
+        van als los chat bericht met een eigen generatie round trip.
+        
+        Args:
+            system_prompt: Optionele systeem instructies
+            generation_config: Optionele generation config (temperature, max_output_tokens, ...)
+            cached_content: Optionele naam van een upstream context cache (bevat
+                de system instruction en een vaste prefix, zie create_context_cache)
+            
+        Returns:
+            genai.GenerativeModel
+        """
+        if not system_prompt and not generation_config and not cached_content:
+            return self.model
+        
+        key = json.dumps([system_prompt, generation_config, cached_content], sort_keys=True)
+        with self._models_lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+            if cached_content:
+                model = genai.GenerativeModel.from_cached_content(
+                    cached_content,
+                    generation_config=generation_config
+                )
+            else:
+                model = genai.GenerativeModel(
+                    self.MODEL_NAME,
+                    system_instruction=system_prompt or None,
+                    generation_config=generation_config
+                )
+            self._models[key] = model
+            if len(self._models) > self.MODEL_CACHE_SIZE:
+                self._models.popitem(last=False)
+            return model
+    
+    def create_context_cache(
+        self,
+        contents: List[Dict[str, Any]],
+        system_prompt: Optional[str] = None,
+        ttl_seconds: int = 3600
+    ) -> Optional[str]:
+        """
+        Maak een upstream context cache voor een vaste prompt prefix
+        
+        Best-effort: het model of de prefix (te weinig tokens) wordt niet altijd
+        ondersteund; dan returnt deze methode None en werkt alles zonder cache.
+        
+        Args:
+            contents: Vaste prefix als chat contents [{"role": ..., "parts": [...]}]
+            system_prompt: Optionele systeem instructies
+            ttl_seconds: Levensduur van de cache
+            
+        Returns:
+            Naam van de cached content, of None
+        """
+        try:
+            with metrics.timed_upstream("gemini"):
+                cached = genai.caching.CachedContent.create(
+                    model=f"models/{self.MODEL_NAME}",
+                    system_instruction=system_prompt or None,
+                    contents=contents,
+                    ttl=datetime.timedelta(seconds=ttl_seconds)
+                )
+            return cached.name
+        except Exception:
+            return None
     
     def chat(
         self,
         message: str,
         history: Optional[List[Dict[str, str]]] = None,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        cached_content: Optional[str] = None
     ) -> str:
         """
         Stuur chat bericht naar Gemini
@@ -39,21 +152,59 @@ class GeminiClient:
         Args:
             message: Gebruiker bericht
             history: Optionele chat geschiedenis [{"role": "user/model", "parts": ["text"]}]
-            system_prompt: Optionele systeem instructies
+            system_prompt: Optionele systeem instructies (native system instruction)
+            generation_config: Optionele generation config
+            cached_content: Optionele upstream context cache naam
             
         Returns:
             Gemini response text
         """
-        # Start chat sessie met optionele geschiedenis
-        chat = self.model.start_chat(history=history or [])
-        
-        # Voeg system prompt toe als eerste bericht als gegeven
-        if system_prompt and not history:
-            chat.send_message(system_prompt)
-        
-        response = chat.send_message(message)
+        args = (message, history, system_prompt, generation_config, cached_content)
+        if self._chat_flight is None:
+            return self._chat(*args)
+        return self._chat_flight.do(make_key(*args), self._chat, *args)
+    
+    def _chat(
+        self,
+        message: str,
+        history: Optional[List[Dict[str, str]]],
+        system_prompt: Optional[str],
+        generation_config: Optional[Dict[str, Any]],
+        cached_content: Optional[str]
+    ) -> str:
+        model = self.get_model(system_prompt, generation_config, cached_content)
+        chat = model.start_chat(history=history or [])
+        with metrics.timed_upstream("gemini"):
+            response = chat.send_message(message)
+        metrics.record_tokens(response.usage_metadata)
         return response.text
     
+    def embed(
+        self,
+        texts: List[str],
+        task_type: str = "SEMANTIC_SIMILARITY",
+        output_dimensionality: Optional[int] = None
+    ) -> List[List[float]]:
+        """
+        Embeddings voor een of meer teksten (één upstream call per 100 teksten)
+        
+        Args:
+            texts: Teksten om te embedden
+            task_type: Gemini embedding task type
+            output_dimensionality: Optioneel kleinere vectoren (default: 768)
+            
+        Returns:
+            Lijst van vectoren (zelfde volgorde als texts)
+        """
+        with metrics.timed_upstream("gemini_embed"):
+            result = genai.embed_content(
+                model=self.EMBEDDING_MODEL,
+                content=list(texts),
+                task_type=task_type,
+                output_dimensionality=output_dimensionality
+            )
+        return result["embedding"]
+    
     def chat_with_image(
         self,
         message: str,
@@ -71,40 +222,184 @@ class GeminiClient:
         Returns:
             Gemini response text
         """
+        from lib.image_pipeline import decode_base64_image, prepare_image
+        
         # Laad image
         if image_format == "base64":
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
+            image_bytes = decode_base64_image(image_data)
         elif image_format == "path":
-            image = Image.open(image_data)
+            with open(image_data, "rb") as f:
+                image_bytes = f.read()
         else:
             raise ValueError("image_format moet 'base64' of 'path' zijn")
         
-        # Stuur naar Gemini
-        response = self.model.generate_content([message, image])
+        return self.analyze_prepared_image(message, prepare_image(image_bytes))
+    
+    def analyze_prepared_image(self, message: str, image: "PreparedImage") -> str:
+        """
+        Stuur een voorbewerkte image (zie lib/image_pipeline.py) naar Gemini
+        
+        Args:
+            message: Gebruiker vraag over de image
+            image: PreparedImage (verkleind, gestripte metadata)
+            
+        Returns:
+            Gemini response text
+        """
+        with metrics.timed_upstream("gemini"):
+            response = self.model.generate_content([message, image.part()])
+        metrics.record_tokens(response.usage_metadata)
         return response.text
     
     def stream_chat(
         self,
         message: str,
-        history: Optional[List[Dict[str, str]]] = None
-    ):
+        history: Optional[List[Dict[str, str]]] = None,
+        system_prompt: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        cached_content: Optional[str] = None
+    ) -> Iterator[str]:
         """
         Stream chat response (voor real-time output)
         
         Args:
             message: Gebruiker bericht
             history: Optionele chat geschiedenis
+            system_prompt: Optionele systeem instructies (native system instruction)
+            generation_config: Optionele generation config
+            cached_content: Optionele upstream context cache naam
             
+        Returns:
+            Iterator van text chunks als ze binnenkomen (een identieke lopende
+            stream wordt vanaf het begin meegelezen)
+        """
+        args = (message, history, system_prompt, generation_config, cached_content)
+        if self._stream_flight is None:
+            return self._stream_chat(*args)
+        return self._stream_flight.stream(make_key(*args), self._stream_chat, *args)
+    
+    def _stream_chat(
+        self,
+        message: str,
+        history: Optional[List[Dict[str, str]]],
+        system_prompt: Optional[str],
+        generation_config: Optional[Dict[str, Any]],
+        cached_content: Optional[str]
+    ) -> Iterator[str]:
+        model = self.get_model(system_prompt, generation_config, cached_content)
+        chat = model.start_chat(history=history or [])
+        with metrics.timed_upstream("gemini"):
+            response = chat.send_message(message, stream=True)
+        
+        chunk = None
+        for chunk in metrics.timed_iter("gemini", response):
+            if chunk.text:
+                yield chunk.text
+        
+        # Usage metadata staat in de laatste chunk
+        if chunk is not None:
+            metrics.record_tokens(chunk.usage_metadata)
+
+    async def chat_async(
+        self,
+        message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        system_prompt: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        cached_content: Optional[str] = None
+    ) -> str:
+        """
+        Async variant van chat (zelfde argumenten)
+        
+        Returns:
+            Gemini response text
+        """
+        args = (message, history, system_prompt, generation_config, cached_content)
+        if self._rest:
+            return await asyncio.to_thread(self.chat, *args)
+        if self._chat_flight is None:
+            return await self._chat_async(*args)
+        return await self._chat_flight.do_async(make_key(*args), self._chat_async, *args)
+    
+    async def _chat_async(
+        self,
+        message: str,
+        history: Optional[List[Dict[str, str]]],
+        system_prompt: Optional[str],
+        generation_config: Optional[Dict[str, Any]],
+        cached_content: Optional[str]
+    ) -> str:
+        model = self.get_model(system_prompt, generation_config, cached_content)
+        chat = model.start_chat(history=history or [])
+        with metrics.timed_upstream("gemini"):
+            response = await chat.send_message_async(message)
+        metrics.record_tokens(response.usage_metadata)
+        return response.text
+    
+    async def stream_chat_async(
+        self,
+        message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        system_prompt: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        cached_content: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Async variant van stream_chat (zelfde argumenten)
+        
         Yields:
             Text chunks als ze binnenkomen
         """
-        chat = self.model.start_chat(history=history or [])
-        response = chat.send_message(message, stream=True)
+        args = (message, history, system_prompt, generation_config, cached_content)
+        if self._rest:
+            iterator = self.stream_chat(*args)
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(next, iterator, None)
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                iterator.close()
         
-        for chunk in response:
+        model = self.get_model(system_prompt, generation_config, cached_content)
+        chat = model.start_chat(history=history or [])
+        with metrics.timed_upstream("gemini"):
+            response = await chat.send_message_async(message, stream=True)
+        
+        chunk = None
+        async for chunk in response:
             if chunk.text:
                 yield chunk.text
+        if chunk is not None:
+            metrics.record_tokens(chunk.usage_metadata)
+    
+    async def analyze_prepared_image_async(self, message: str, image: "PreparedImage") -> str:
+        """Async variant van analyze_prepared_image"""
+        if self._rest:
+            return await asyncio.to_thread(self.analyze_prepared_image, message, image)
+        with metrics.timed_upstream("gemini"):
+            response = await self.model.generate_content_async([message, image.part()])
+        metrics.record_tokens(response.usage_metadata)
+        return response.text
+    
+    async def embed_async(
+        self,
+        texts: List[str],
+        task_type: str = "SEMANTIC_SIMILARITY",
+        output_dimensionality: Optional[int] = None
+    ) -> List[List[float]]:
+        """Async variant van embed"""
+        if self._rest:
+            return await asyncio.to_thread(self.embed, texts, task_type, output_dimensionality)
+        with metrics.timed_upstream("gemini_embed"):
+            result = await genai.embed_content_async(
+                model=self.EMBEDDING_MODEL,
+                content=list(texts),
+                task_type=task_type,
+                output_dimensionality=output_dimensionality
+            )
+        return result["embedding"]
 
 
 # Convenience functies
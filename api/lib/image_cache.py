@@ -0,0 +1,126 @@
+"""
+Image analyse cache
+Resultaten gecached op content hash van de genormaliseerde image bytes + prompt.
+Optioneel perceptual mode: vindt ook her-encoded of verkleinde duplicaten via dHash.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from lib import metrics
+from lib.cache import TieredCache, make_cache_key
+from lib.image_pipeline import PreparedImage
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ImageAnalysisCache:
+    """
+    Twee lookups:
+        exact: sha256(genormaliseerde JPEG bytes) + prompt → TieredCache (geheugen + Firestore)
+        perceptual: dHash binnen hamming afstand van een eerder resultaat met dezelfde prompt
+                    (in-process index per prompt, alleen als perceptual aan staat)
+    """
+
+    def __init__(
+        self,
+        cache: TieredCache,
+        perceptual_threshold: int = 4,
+        index_size: int = 1024,
+        max_prompts: int = 256
+    ):
+        """
+        Args:
+            cache: TieredCache voor de resultaten
+            perceptual_threshold: Max hamming afstand (van 64 bits) voor een perceptual match
+            index_size: Max aantal dHashes per prompt in de perceptual index
+            max_prompts: Max aantal prompts in de perceptual index (LRU)
+        """
+        self.cache = cache
+        self.perceptual_threshold = perceptual_threshold
+        self.index_size = index_size
+        self.max_prompts = max_prompts
+        self._index: "OrderedDict[str, Deque[Tuple[int, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "perceptual": 0}
+        self.misses = 0
+
+    @staticmethod
+    def _prompt_hash(prompt: str) -> str:
+        normalized = " ".join(prompt.lower().split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(image: PreparedImage, prompt_hash: str) -> str:
+        return make_cache_key(
+            "image",
+            image=hashlib.sha256(image.data).hexdigest(),
+            prompt=prompt_hash
+        )
+
+    def _nearest(self, prompt_hash: str, phash: int) -> Optional[str]:
+        with self._lock:
+            entries = list(self._index.get(prompt_hash, ()))
+        best_key, best_distance = None, self.perceptual_threshold + 1
+        for candidate, key in entries:
+            distance = _hamming(candidate, phash)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def _remember(self, prompt_hash: str, phash: int, key: str):
+        with self._lock:
+            entries = self._index.get(prompt_hash)
+            if entries is None:
+                entries = self._index[prompt_hash] = deque(maxlen=self.index_size)
+                if len(self._index) > self.max_prompts:
+                    self._index.popitem(last=False)
+            else:
+                self._index.move_to_end(prompt_hash)
+            entries.append((phash, key))
+
+    def lookup(
+        self,
+        image: PreparedImage,
+        prompt: str,
+        perceptual: bool = False
+    ) -> Tuple[Optional[Any], Dict[str, Any]]:
+        """
+        Returns:
+            Tuple van (value of None, info) met info = {"status", "tier", "age", "match"}
+        """
+        prompt_hash = self._prompt_hash(prompt)
+        entry, tier = self.cache.get(self._key(image, prompt_hash))
+        match = "exact"
+        if entry is None and perceptual:
+            key = self._nearest(prompt_hash, image.phash)
+            if key is not None:
+                entry, tier = self.cache.get(key)
+                match = "perceptual"
+
+        if entry is None:
+            self.misses += 1
+            metrics.increment("image_cache.miss")
+            return None, {"status": "MISS", "tier": None, "age": 0.0, "match": None}
+
+        self.hits[match] += 1
+        metrics.increment(f"image_cache.hit_{match}")
+        return entry.value, {"status": "HIT", "tier": tier, "age": entry.age, "match": match}
+
+    def store(self, image: PreparedImage, prompt: str, value: Any):
+        prompt_hash = self._prompt_hash(prompt)
+        key = self._key(image, prompt_hash)
+        self.cache.set(key, value)
+        self._remember(prompt_hash, image.phash, key)
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.hits.values()) + self.misses
+        return {
+            **self.cache.stats(),
+            "hits_exact": self.hits["exact"],
+            "hits_perceptual": self.hits["perceptual"],
+            "lookup_misses": self.misses,
+            "lookup_hit_rate": round(sum(self.hits.values()) / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,277 @@
+"""
+Request metrics
+Per-route wall time, upstream tijd (Gemini, Tavily, Firestore), payload groottes
+en token counts. Gaat naar structured logs en GET /api/metrics.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from firebase_functions import https_fn, logger
+
+# Aantal samples per histogram (ring buffer, recentste samples tellen)
+HISTOGRAM_SAMPLES = 2048
+
+
+class Histogram:
+    """Thread-safe histogram over de laatste N samples met percentielen"""
+
+    def __init__(self, samples: int = HISTOGRAM_SAMPLES):
+        self._values: deque = deque(maxlen=samples)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        with self._lock:
+            self._values.append(value)
+            self.count += 1
+            self.total += value
+
+    def snapshot(self) -> Dict[str, float]:
+        """count, mean, p50, p95, p99, max"""
+        with self._lock:
+            values = sorted(self._values)
+            count, total = self.count, self.total
+        if not values:
+            return {"count": 0}
+
+        def pct(p: float) -> float:
+            return round(values[min(int(p * len(values)), len(values) - 1)], 2)
+
+        return {
+            "count": count,
+            "mean": round(total / count, 2),
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "max": round(values[-1], 2),
+        }
+
+
+class RequestMetrics:
+    """Metrics van één request (gedeeld met worker threads via contextvars)"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.start = time.perf_counter()
+        self.upstream_ms: Dict[str, float] = {}
+        self.upstream_calls: Dict[str, int] = {}
+        self.tokens: Dict[str, int] = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status = 0
+        self.ttfb_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add_upstream(self, kind: str, ms: float):
+        with self._lock:
+            self.upstream_ms[kind] = self.upstream_ms.get(kind, 0.0) + ms
+            self.upstream_calls[kind] = self.upstream_calls.get(kind, 0) + 1
+
+    def add_tokens(self, **counts: int):
+        with self._lock:
+            for name, value in counts.items():
+                self.tokens[name] = self.tokens.get(name, 0) + (value or 0)
+
+    @property
+    def wall_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+
+_current: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar(
+    "request_metrics", default=None
+)
+_histograms: Dict[str, Histogram] = {}
+_histograms_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+
+
+def _histogram(name: str) -> Histogram:
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    return histogram
+
+
+def observe(name: str, value: float):
+    """Voeg een sample toe aan een (globale) histogram"""
+    _histogram(name).observe(value)
+
+
+def increment(name: str, value: int = 1):
+    """Verhoog een globale counter"""
+    with _histograms_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def current() -> Optional[RequestMetrics]:
+    """Metrics van de huidige request (None buiten een request)"""
+    return _current.get()
+
+
+@contextmanager
+def timed_upstream(kind: str) -> Iterator[None]:
+    """
+    Meet een upstream call ("gemini", "tavily", "firestore")
+    Telt op bij de huidige request en bij de globale upstream histogram
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        observe(f"upstream.{kind}_ms", ms)
+        request = _current.get()
+        if request is not None:
+            request.add_upstream(kind, ms)
+
+
+def timed_iter(kind: str, iterable: Iterable) -> Iterator:
+    """
+    Itereer over een upstream stream en tel alleen de tijd in next() als upstream tijd
+    (niet de tijd die de consumer tussen chunks besteedt)
+    """
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                total += (time.perf_counter() - start) * 1000
+            yield item
+    finally:
+        observe(f"upstream.{kind}_ms", total)
+        request = _current.get()
+        if request is not None:
+            request.add_upstream(kind, total)
+
+
+def record_tokens(usage_metadata: Any):
+    """Token counts uit Gemini usage_metadata bij de huidige request optellen"""
+    if usage_metadata is None:
+        return
+    prompt = getattr(usage_metadata, "prompt_token_count", 0) or 0
+    output = getattr(usage_metadata, "candidates_token_count", 0) or 0
+    observe("tokens.prompt", prompt)
+    observe("tokens.output", output)
+    request = _current.get()
+    if request is not None:
+        request.add_tokens(prompt=prompt, output=output)
+
+
+def add_tokens(**counts: int):
+    """Extra token counts (bijv. context_saved) bij de huidige request; komen in de request log"""
+    request = _current.get()
+    if request is not None:
+        request.add_tokens(**counts)
+
+
+def copy_context() -> contextvars.Context:
+    """Context voor worker threads (zodat upstream tijd bij de juiste request telt)"""
+    return contextvars.copy_context()
+
+
+def _finish(request: RequestMetrics):
+    """Request afronden: histograms bijwerken en structured log schrijven"""
+    wall_ms = request.wall_ms
+    observe(f"route.{request.route}.wall_ms", wall_ms)
+    for kind, ms in request.upstream_ms.items():
+        observe(f"route.{request.route}.{kind}_ms", ms)
+    increment(f"status.{request.status}")
+
+    entry = {
+        "route": request.route,
+        "status": request.status,
+        "wall_ms": round(wall_ms, 2),
+        "upstream_ms": {kind: round(ms, 2) for kind, ms in request.upstream_ms.items()},
+        "upstream_calls": request.upstream_calls,
+        "request_bytes": request.request_bytes,
+        "response_bytes": request.response_bytes,
+    }
+    if request.ttfb_ms is not None:
+        entry["ttfb_ms"] = round(request.ttfb_ms, 2)
+    if request.tokens:
+        entry["tokens"] = request.tokens
+    logger.info("request", **entry)
+
+
+def _stream(iterable: Iterable[bytes], request: RequestMetrics) -> Iterator[bytes]:
+    """Streaming body doorgeven en pas na de laatste chunk afronden"""
+    iterator = iter(iterable)
+    try:
+        while True:
+            token = _current.set(request)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                _current.reset(token)
+            if request.ttfb_ms is None:
+                request.ttfb_ms = request.wall_ms
+            request.response_bytes += len(chunk)
+            yield chunk
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+        _finish(request)
+
+
+def instrument(
+    dispatch: Callable[[https_fn.Request], https_fn.Response],
+    route_label: Callable[[https_fn.Request], str]
+) -> Callable[[https_fn.Request], https_fn.Response]:
+    """
+    Middleware rond de router: meet elke request
+
+    Args:
+        dispatch: De router functie
+        route_label: Functie die een request naar een route label map (bijv. "POST /api/search")
+
+    Returns:
+        Gewrapte router functie
+    """
+    def wrapper(req: https_fn.Request) -> https_fn.Response:
+        request = RequestMetrics(route_label(req))
+        request.request_bytes = req.content_length or 0
+        token = _current.set(request)
+        try:
+            response = dispatch(req)
+        except Exception as e:
+            request.status = 500
+            logger.error("unhandled exception", route=request.route, error=repr(e))
+            _finish(request)
+            raise
+        finally:
+            _current.reset(token)
+
+        request.status = response.status_code
+        if response.is_streamed:
+            response.response = _stream(response.response, request)
+        else:
+            request.response_bytes = response.content_length or len(response.get_data())
+            _finish(request)
+        return response
+
+    return wrapper
+
+
+def snapshot() -> Dict[str, Any]:
+    """Alle histograms en counters (voor GET /api/metrics)"""
+    with _histograms_lock:
+        names = sorted(_histograms)
+        counters = dict(_counters)
+    return {
+        "histograms": {name: _histograms[name].snapshot() for name in names},
+        "counters": counters,
+    }
@@ -1,90 +1,389 @@
 """
 Router voor API endpoints
-Clean routing naar specifieke handlers
+Declaratieve route tabel: elke route declareert method, path en opties
+(timeout, max body, concurrency). De tabel wordt bij import één keer
+gecompileerd naar een dict (statische paths) + segment trie (paths met {params}).
+404, 405 en OPTIONS responses worden automatisch gegenereerd.
 """
 from firebase_functions import https_fn
-from lib.utils import create_json_response, normalize_path, parse_route
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from lib import metrics
+from lib.encoding import finalize_response
+from lib.startup import timed
+from lib.utils import create_json_response, normalize_path
 
-# Import route handlers
-from routes import basic_routes, ai_routes, search_routes, firestore_routes
 
+class LazyRoutes:
+    """
+    Route module dat pas geïmporteerd wordt bij de eerste request die het nodig heeft
+    Zo betaalt GET /api/health niet voor de import van de hele AI stack
+    """
+
+    def __init__(self, module_name: str):
+        self.module_name = module_name
+        self._module: Optional[ModuleType] = None
+
+    def __getattr__(self, name: str):
+        if self._module is None:
+            with timed(self.module_name):
+                self._module = importlib.import_module(self.module_name)
+        return getattr(self._module, name)
+
+
+# Route handlers (lazy geladen)
+basic_routes = LazyRoutes("routes.basic_routes")
+ai_routes = LazyRoutes("routes.ai_routes")
+search_routes = LazyRoutes("routes.search_routes")
+firestore_routes = LazyRoutes("routes.firestore_routes")
+
+MB = 1024 * 1024
+
+
+@dataclass
+class Route:
+    """
+    Declaratie van één endpoint
+
+    Args:
+        method: HTTP method ("GET", "POST", ...)
+        path: Path onder /api, optioneel met {param} segmenten (bijv. "/api/items/{id}")
+        module: LazyRoutes module met de handler
+        handler: Naam van de handler functie in de module
+        timeout: Max seconden tot de handler een response teruggeeft (504 daarna).
+            Bij streaming responses begrenst dit alleen het teruggeven van de Response,
+            niet het streamen van de body.
+        max_body: Max Content-Length in bytes (413 daarboven)
+        max_concurrency: Max gelijktijdige requests per instance (503 daarboven)
+        cache_control: Cache-Control header voor 200 responses (bijv. voor de Hosting CDN)
+        hint: Optionele query hint voor de route lijst (bijv. "?name=X")
+    """
+    method: str
+    path: str
+    module: LazyRoutes
+    handler: str
+    timeout: Optional[float] = None
+    max_body: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    cache_control: Optional[str] = None
+    hint: str = ""
+    _func: Optional[Callable[[https_fn.Request], https_fn.Response]] = field(
+        default=None, init=False, repr=False
+    )
+    _slots: Optional[threading.BoundedSemaphore] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.method = self.method.upper()
+        self.path = self.path.rstrip("/") or "/api"
+        if self.max_concurrency:
+            self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    @property
+    def label(self) -> str:
+        """Metrics label, bijv. "POST /api/search" """
+        return f"{self.method} {self.path}"
+
+    def resolve(self) -> Callable[[https_fn.Request], https_fn.Response]:
+        """Handler functie (importeert de route module bij de eerste call)"""
+        if self._func is None:
+            self._func = getattr(self.module, self.handler)
+        return self._func
+
+
+# Route registry: één regel per endpoint
+ROUTES: List[Route] = [
+    Route("GET", "/api", basic_routes, "handle_root",
+          cache_control="public, max-age=300, s-maxage=3600"),
+    Route("GET", "/api/health", basic_routes, "handle_health", cache_control="no-store"),
+    Route("GET", "/api/hello", basic_routes, "handle_hello", hint="?name=X",
+          cache_control="public, max-age=300, s-maxage=3600"),
+    Route("GET", "/api/metrics", basic_routes, "handle_metrics", cache_control="no-store"),
+    Route("POST", "/api/ai/chat", ai_routes, "handle_chat",
+          timeout=55, max_body=1 * MB),
+    Route("POST", "/api/ai/chat/stream", ai_routes, "handle_chat_stream",
+          timeout=30, max_body=1 * MB),
+    Route("GET", "/api/ai/chat/stream/{stream_id}", ai_routes, "handle_resume_chat_stream",
+          timeout=30, cache_control="no-store"),
+    # Eigen (nauwkeurigere) limieten per upload type in de handler; dit is de bovengrens
+    Route("POST", "/api/ai/image", ai_routes, "handle_image_analysis",
+          timeout=55, max_body=28 * MB, max_concurrency=4),
+    Route("POST", "/api/search", search_routes, "handle_search",
+          timeout=30, max_body=64 * 1024),
+    Route("POST", "/api/search/batch", search_routes, "handle_search_batch",
+          timeout=30, max_body=256 * 1024, max_concurrency=4),
+    # Korte CDN cache; daarna revalidatie via ETag
+    Route("GET", "/api/items", firestore_routes, "handle_get_items", timeout=30,
+          cache_control="public, max-age=0, s-maxage=30, stale-while-revalidate=60"),
+    Route("POST", "/api/items", firestore_routes, "handle_create_item",
+          timeout=30, max_body=1 * MB),
+    Route("POST", "/api/items/batch", firestore_routes, "handle_create_items_batch",
+          max_body=32 * MB, max_concurrency=2),
+    Route("POST", "/api/items/search", firestore_routes, "handle_search_items",
+          timeout=30, max_body=64 * 1024),
+]
+
+# Gedeelde workers voor routes met een timeout (de request thread wacht met een deadline)
+ROUTE_WORKERS = 32
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization, Last-Event-ID",
+    "Access-Control-Max-Age": "86400",
+}
+
+
+class _Node:
+    """Segment trie node voor paths met {params}"""
+    __slots__ = ("children", "param", "param_name", "methods")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.param: Optional["_Node"] = None
+        self.param_name: Optional[str] = None
+        self.methods: Optional[Dict[str, Route]] = None
+
+
+def _compile(routes: List[Route]) -> Tuple[Dict[str, Dict[str, Route]], _Node]:
+    """
+    Compileer de registry naar dispatch structuren
+
+    Returns:
+        Tuple van (statische paths → {method: Route}, trie root voor paths met params)
+
+    Raises:
+        ValueError: Bij dubbele method + path combinaties
+    """
+    static: Dict[str, Dict[str, Route]] = {}
+    root = _Node()
+    for route in routes:
+        if "{" not in route.path:
+            methods = static.setdefault(route.path, {})
+        else:
+            node = root
+            for segment in route.path.strip("/").split("/"):
+                if segment.startswith("{") and segment.endswith("}"):
+                    node.param = node.param or _Node()
+                    node.param_name = segment[1:-1]
+                    node = node.param
+                else:
+                    node = node.children.setdefault(segment, _Node())
+            if node.methods is None:
+                node.methods = {}
+            methods = node.methods
+        if route.method in methods:
+            raise ValueError(f"Duplicate route: {route.label}")
+        methods[route.method] = route
+        # HEAD volgt GET (Werkzeug laat de body weg)
+        if route.method == "GET":
+            methods.setdefault("HEAD", route)
+    return static, root
+
+
+_STATIC, _TRIE = _compile(ROUTES)
+
+# Voor de 404 body
+AVAILABLE_ROUTES = [f"{route.label}{route.hint}" for route in ROUTES]
+
+
+def _lookup_trie(path: str) -> Tuple[Optional[Dict[str, Route]], Dict[str, str]]:
+    node = _TRIE
+    params: Dict[str, str] = {}
+    for segment in path.strip("/").split("/"):
+        child = node.children.get(segment)
+        if child is None and node.param is not None and segment:
+            params[node.param_name] = segment
+            child = node.param
+        if child is None:
+            return None, {}
+        node = child
+    return node.methods, params
+
+
+def match(path: str) -> Tuple[str, Optional[Dict[str, Route]], Dict[str, str]]:
+    """
+    Zoek de routes voor een request path
+
+    Returns:
+        Tuple van (genormaliseerd path, {method: Route} of None, path params)
+    """
+    # Fast path: path staat letterlijk in de tabel (geen string bewerkingen)
+    methods = _STATIC.get(path)
+    if methods is not None:
+        return path, methods, {}
+    path = normalize_path(path).rstrip("/") or "/api"
+    methods = _STATIC.get(path)
+    if methods is not None:
+        return path, methods, {}
+    methods, params = _lookup_trie(path)
+    return path, methods, params
 
-def route_request(req: https_fn.Request) -> https_fn.Response:
+
+def route_params(req: https_fn.Request) -> Dict[str, str]:
+    """Waarden van {param} segmenten van de gematchte route"""
+    return req.environ.get("api.route_params", {})
+
+
+def _match_request(req: https_fn.Request) -> Tuple[str, Optional[Dict[str, Route]], Dict[str, str]]:
+    """match() voor het request path, één keer per request (route_label en _dispatch delen het resultaat)"""
+    result = req.environ.get("api.match")
+    if result is None:
+        result = req.environ["api.match"] = match(req.path)
+    return result
+
+
+def route_label(req: https_fn.Request) -> str:
+    """
+    Metrics label voor een request, bijv. "POST /api/search"
+    CORS preflights op een bestaand path krijgen "OPTIONS <route path>"; onbekende
+    paths worden samengevoegd tot "<METHOD> unmatched" (begrensde cardinaliteit)
+    """
+    _, methods, _ = _match_request(req)
+    if not methods:
+        return f"{req.method} unmatched"
+    route = methods.get(req.method)
+    if route is not None:
+        return route.label
+    if req.method == "OPTIONS":
+        return f"OPTIONS {next(iter(methods.values())).path}"
+    return f"{req.method} unmatched"
+
+
+def _noop():
+    pass
+
+
+def _allow(methods: Dict[str, Route]) -> str:
+    return ", ".join(sorted(set(methods) | {"OPTIONS"}))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=ROUTE_WORKERS, thread_name_prefix="route")
+    return _executor
+
+
+def _release_after(iterable: Iterable[bytes], release: Callable[[], None]) -> Iterator[bytes]:
+    """Concurrency slot pas vrijgeven als de streaming body klaar is"""
+    try:
+        yield from iterable
+    finally:
+        close = getattr(iterable, "close", None)
+        if close:
+            close()
+        release()
+
+
+def _call(
+    route: Route,
+    req: https_fn.Request,
+    release: Callable[[], None]
+) -> https_fn.Response:
+    """
+    Handler aanroepen, met deadline als de route een timeout heeft
+
+    release wordt precies één keer aangeroepen zodra het werk klaar is: na de
+    handler, na de streaming body, of (bij een timeout) pas als de worker klaar is.
+    """
+    func = route.resolve()
+    if route.timeout:
+        future = _get_executor().submit(metrics.copy_context().run, func, req)
+        try:
+            response = future.result(timeout=route.timeout)
+        except FutureTimeout:
+            # De worker loopt door (threads zijn niet te annuleren): slot blijft bezet tot hij klaar is
+            future.add_done_callback(lambda _: release())
+            metrics.increment(f"route.{route.label}.timeouts")
+            return create_json_response(
+                {"error": f"Request timed out after {route.timeout:g}s"},
+                status=504
+            )
+        except BaseException:
+            release()
+            raise
+    else:
+        try:
+            response = func(req)
+        except BaseException:
+            release()
+            raise
+
+    if response.is_streamed:
+        response.response = _release_after(response.response, release)
+    else:
+        release()
+    return response
+
+
+def _dispatch(req: https_fn.Request) -> https_fn.Response:
     """
     Main router die requests naar correcte handlers stuurt
-    
+
     Args:
         req: Firebase Functions Request object
-    
+
     Returns:
         https_fn.Response van de juiste handler
     """
-    # Normalize path
-    path = normalize_path(req.path)
+    path, methods, params = _match_request(req)
     method = req.method
-    
-    # Parse route
-    main_route, sub_route = parse_route(path)
-    
-    # Root endpoint
-    if main_route == '/' or not main_route:
-        return basic_routes.handle_root(req)
-    
-    # Health check
-    if main_route == 'health':
-        return basic_routes.handle_health(req)
-    
-    # Hello endpoint
-    if main_route == 'hello':
-        return basic_routes.handle_hello(req)
-    
-    # AI routes
-    if main_route == 'ai':
-        # Check for nested routes (e.g., ai/chat/stream)
-        if sub_route == 'chat/stream' and method == 'POST':
-            return ai_routes.handle_chat_stream(req)
-        elif sub_route == 'chat' and method == 'POST':
-            return ai_routes.handle_chat(req)
-        elif sub_route == 'image' and method == 'POST':
-            return ai_routes.handle_image_analysis(req)
-        else:
-            return create_json_response(
-                {"error": f"AI endpoint not found: {sub_route}"},
-                status=404
-            )
-    
-    # Search route
-    if main_route == 'search' and method == 'POST':
-        return search_routes.handle_search(req)
-    
-    # Firestore items routes
-    if main_route == 'items':
-        if method == 'POST':
-            return firestore_routes.handle_create_item(req)
-        elif method == 'GET':
-            return firestore_routes.handle_get_items(req)
-        else:
-            return create_json_response(
-                {"error": f"Method {method} not allowed for /items"},
-                status=405
-            )
-    
+
     # 404 - Route niet gevonden
-    return create_json_response(
-        {
-            "error": "Not found",
-            "path": path,
-            "available_routes": [
-                "GET /api",
-                "GET /api/health",
-                "GET /api/hello?name=X",
-                "POST /api/ai/chat",
-                "POST /api/ai/chat/stream",
-                "POST /api/ai/image",
-                "POST /api/search",
-                "GET /api/items",
-                "POST /api/items"
-            ]
-        },
-        status=404
-    )
+    if not methods:
+        return create_json_response(
+            {
+                "error": "Not found",
+                "path": path,
+                "available_routes": AVAILABLE_ROUTES
+            },
+            status=404
+        )
+
+    if method == "OPTIONS":
+        allow = _allow(methods)
+        return https_fn.Response(
+            status=204,
+            headers={**CORS_HEADERS, "Allow": allow, "Access-Control-Allow-Methods": allow}
+        )
+
+    route = methods.get(method)
+    if route is None:
+        return create_json_response(
+            {"error": f"Method {method} not allowed for {path}"},
+            status=405,
+            headers={"Allow": _allow(methods)}
+        )
+
+    if route.max_body is not None and (req.content_length or 0) > route.max_body:
+        return create_json_response(
+            {"error": f"Request body too large (max {route.max_body} bytes)"},
+            status=413
+        )
+
+    if params:
+        req.environ["api.route_params"] = params
+
+    slots = route._slots
+    if slots is not None and not slots.acquire(blocking=False):
+        metrics.increment(f"route.{route.label}.rejected")
+        return create_json_response(
+            {"error": "Too many concurrent requests, try again later"},
+            status=503,
+            headers={"Retry-After": "1"}
+        )
+
+    response = _call(route, req, slots.release if slots is not None else _noop)
+    # Compressie, ETag/304 en Cache-Control (streaming responses ongewijzigd)
+    return finalize_response(req, response, route.cache_control)
+
+
+# Instrumentatie middleware: timing, upstream tijd, payloads, tokens per route
+route_request = metrics.instrument(_dispatch, route_label)
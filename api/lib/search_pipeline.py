@@ -0,0 +1,209 @@
+"""
+Search pipeline
+Cached Tavily search → (cached) Gemini samenvatting, met de process-wide clients uit lib/utils
+
+De context voor de samenvatting gaat door lib/context_packing.py: dubbele passages
+eruit, gerangschikt op relevantie en afgekapt op SEARCH_CONTEXT_TOKENS.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from lib import metrics
+from lib.cache import make_cache_key
+from lib.context_packing import PackedContext, pack_or_full
+from lib.utils import (
+    get_gemini_client, get_tavily_client, get_async_tavily_client, get_search_cache, get_summary_cache
+)
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase en whitespace samengevoegd (voor cache keys en dedupe)"""
+    return " ".join(query.lower().split())
+
+
+def _normalize_domains(domains: Optional[List[str]]) -> List[str]:
+    """Domains lowercase, gesorteerd en zonder duplicaten (voor cache keys)"""
+    return sorted({d.strip().lower() for d in domains or [] if d and d.strip()})
+
+
+def _search_key(
+    query: str,
+    max_results: int,
+    search_depth: str,
+    include_domains: List[str],
+    exclude_domains: List[str]
+) -> str:
+    return make_cache_key(
+        "search",
+        query=normalize_query(query),
+        max_results=max_results,
+        search_depth=search_depth,
+        include_domains=include_domains,
+        exclude_domains=exclude_domains
+    )
+
+
+def cached_search(
+    query: str,
+    max_results: int = 5,
+    search_depth: str = "basic",
+    include_domains: Optional[List[str]] = None,
+    exclude_domains: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """
+    Tavily search via de result cache
+    
+    Key: genormaliseerde query + max_results + search_depth + domain lijsten
+    
+    Returns:
+        Tuple van (results, cache info)
+    """
+    include_domains = _normalize_domains(include_domains)
+    exclude_domains = _normalize_domains(exclude_domains)
+    key = _search_key(query, max_results, search_depth, include_domains, exclude_domains)
+    return get_search_cache().get_or_set(
+        key,
+        lambda: get_tavily_client().get_clean_results(
+            query,
+            max_results=max_results,
+            search_depth=search_depth,
+            include_domains=include_domains or None,
+            exclude_domains=exclude_domains or None
+        )
+    )
+
+
+async def cached_search_async(
+    query: str,
+    max_results: int = 5,
+    search_depth: str = "basic",
+    include_domains: Optional[List[str]] = None,
+    exclude_domains: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """
+    Async variant van cached_search (AsyncTavilyClient, zelfde cache keys)
+    Draai op de loop uit lib/aio.py. De Firestore cache laag is synchroon en gaat via een thread.
+    """
+    include_domains = _normalize_domains(include_domains)
+    exclude_domains = _normalize_domains(exclude_domains)
+    key = _search_key(query, max_results, search_depth, include_domains, exclude_domains)
+    cache = get_search_cache()
+    
+    if cache.remote is None:
+        entry, tier = cache.get(key)
+    else:
+        entry, tier = await asyncio.to_thread(cache.get, key)
+    if entry is not None:
+        return entry.value, {"status": "HIT", "tier": tier, "age": entry.age}
+    
+    results = await get_async_tavily_client().get_clean_results(
+        query,
+        max_results=max_results,
+        search_depth=search_depth,
+        include_domains=include_domains or None,
+        exclude_domains=exclude_domains or None
+    )
+    if cache.remote is None:
+        cache.set(key, results)
+    else:
+        await asyncio.to_thread(cache.set, key, results)
+    return results, {"status": "MISS", "tier": None, "age": 0.0}
+
+
+def context_token_budget() -> int:
+    """Token budget voor de zoekresultaten in de samenvatting prompt (SEARCH_CONTEXT_TOKENS, 0 = geen packing)"""
+    return int(os.getenv("SEARCH_CONTEXT_TOKENS", "2000"))
+
+
+def pack_summary_context(query: str, results: List[Dict[str, str]]) -> PackedContext:
+    """
+    Context packing voor de samenvatting, met metrics
+    De bespaarde tokens komen als tokens.context_saved in de request log en als histogram.
+    """
+    packed = pack_or_full(query, results, context_token_budget())
+    metrics.observe("tokens.context_saved", packed.tokens_saved)
+    if packed.duplicates:
+        metrics.increment("context_packing.duplicates", packed.duplicates)
+    metrics.add_tokens(context=packed.tokens_out, context_saved=packed.tokens_saved)
+    return packed
+
+
+def summary_prompt(query: str, context: str) -> str:
+    return f"Geef een heldere samenvatting van deze zoekresultaten over '{query}':\n\n{context}"
+
+
+def build_summary_prompt(query: str, results: List[Dict[str, str]]) -> str:
+    """Prompt voor Gemini met de (gepackte) zoekresultaten als context"""
+    return summary_prompt(query, pack_summary_context(query, results).text)
+
+
+def _summary_key(query: str, results: List[Dict[str, str]]) -> str:
+    """
+    Cache key: query + hash van de result set (nieuwe resultaten → nieuwe samenvatting)
+    + het context token budget (ander budget → andere prompt)
+    """
+    results_hash = hashlib.sha256(
+        json.dumps(results, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    return make_cache_key(
+        "summary",
+        query=normalize_query(query),
+        results=results_hash,
+        context_tokens=context_token_budget()
+    )
+
+
+def summarize_results(
+    query: str,
+    results: List[Dict[str, str]]
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Laat Gemini de zoekresultaten samenvatten (gecached)
+    
+    Returns:
+        Tuple van (summary, cache info); bij een MISS staat in info["context"]
+        wat context packing opleverde (tokens_in, tokens_out, tokens_saved, ...)
+    """
+    context: Dict[str, int] = {}
+    
+    def generate() -> str:
+        packed = pack_summary_context(query, results)
+        context.update(packed.stats())
+        return get_gemini_client().chat(summary_prompt(query, packed.text))
+    
+    summary, info = get_summary_cache().get_or_set(_summary_key(query, results), generate)
+    if context:
+        info["context"] = context
+    return summary, info
+
+
+def stream_summary(query: str, results: List[Dict[str, str]]) -> Iterator[str]:
+    """
+    Stream de samenvatting chunk voor chunk
+    Bij een cache hit komt de hele samenvatting in 1 chunk; anders wordt het
+    resultaat na afloop gecached.
+    
+    Yields:
+        Text chunks
+    """
+    cache = get_summary_cache()
+    key = _summary_key(query, results)
+    entry, _ = cache.get(key)
+    if entry is not None:
+        yield entry.value
+        return
+    
+    chunks = []
+    for chunk in get_gemini_client().stream_chat(build_summary_prompt(query, results)):
+        chunks.append(chunk)
+        yield chunk
+    cache.set(key, "".join(chunks))
+
+
+def search_and_summarize(query: str, max_results: int = 3) -> str:
+    """Cached search + cached samenvatting in één stap"""
+    results, _ = cached_search(query, max_results=max_results)
+    summary, _ = summarize_results(query, results)
+    return summary
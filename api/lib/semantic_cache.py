@@ -0,0 +1,255 @@
+"""
+Semantische response cache voor chat
+Near-duplicate vragen ("wat is X", "wat betekent X") krijgen het eerder gegenereerde
+antwoord: de vraag wordt ge-embed en vergeleken (cosine) met eerdere vragen in
+dezelfde partitie (system prompt). Boven de drempel → hit, geen generatie.
+
+Per partitie een genormaliseerde float32 matrix in het geheugen (één matrix-vector
+product per lookup), met Firestore als gedeelde laag over instances heen.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from lib import metrics
+from lib.cache import from_timestamp, to_timestamp
+
+
+@dataclass
+class SemanticEntry:
+    """Eén gecachte vraag + antwoord"""
+    id: str
+    message: str
+    answer: str
+    created_at: float
+    expires_at: float
+    last_used: float
+    hits: int = 0
+
+
+class _Partition:
+    """Vectoren en entries van één system prompt (rij i hoort bij entries[i])"""
+
+    def __init__(self, dim: int, capacity: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.entries: List[SemanticEntry] = []
+        self.ids: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def nearest(self, vector: np.ndarray) -> Tuple[int, float]:
+        """Index en cosine similarity van de dichtstbijzijnde vector (-1 als leeg)"""
+        n = len(self.entries)
+        if n == 0:
+            return -1, 0.0
+        scores = self.vectors[:n] @ vector
+        index = int(np.argmax(scores))
+        return index, float(scores[index])
+
+    def add(self, vector: np.ndarray, entry: SemanticEntry, max_entries: int):
+        if entry.id in self.ids:
+            return
+        if len(self.entries) >= max_entries:
+            # Verlopen entries eerst, anders least recently used
+            now = time.time()
+            victim = min(
+                range(len(self.entries)),
+                key=lambda i: (self.entries[i].expires_at > now, self.entries[i].last_used)
+            )
+            self.remove(victim)
+            metrics.increment("semantic_cache.evictions")
+        if len(self.entries) == len(self.vectors):
+            grown = np.zeros((len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+        self.vectors[len(self.entries)] = vector
+        self.ids[entry.id] = len(self.entries)
+        self.entries.append(entry)
+
+    def remove(self, index: int):
+        """Verwijder rij index door de laatste rij ervoor in de plaats te zetten (O(dim))"""
+        last = len(self.entries) - 1
+        removed = self.entries[index]
+        if index != last:
+            self.vectors[index] = self.vectors[last]
+            self.entries[index] = self.entries[last]
+            self.ids[self.entries[index].id] = index
+        self.entries.pop()
+        del self.ids[removed.id]
+
+
+def _normalize(vector: Any) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else array
+
+
+def _normalize_message(message: str) -> str:
+    return " ".join(message.lower().split())
+
+
+class SemanticCache:
+    """
+    Gebruik:
+        answer, info = cache.lookup(message, system_prompt)
+        if answer is None:
+            answer = client.chat(message, system_prompt=system_prompt)
+            cache.store(info, answer)
+    """
+
+    COLLECTION = "_cache_semantic"
+
+    def __init__(
+        self,
+        embed: Callable[[List[str]], List[List[float]]],
+        get_db: Optional[Callable[[], Any]] = None,
+        threshold: float = 0.92,
+        max_entries: int = 2048,
+        max_partitions: int = 64,
+        ttl: float = 86400
+    ):
+        """
+        Args:
+            embed: Functie die teksten naar embeddings map (bijv. GeminiClient.embed)
+            get_db: Functie die de Firestore client teruggeeft (None = alleen in-process)
+            threshold: Min cosine similarity voor een hit
+            max_entries: Max entries per partitie (LRU eviction)
+            max_partitions: Max aantal partities (system prompts) in het geheugen
+            ttl: Levensduur van een antwoord in seconden
+        """
+        self._embed = embed
+        self._get_db = get_db
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_partitions = max_partitions
+        self.ttl = ttl
+        self._partitions: "OrderedDict[str, _Partition]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def partition_key(system_prompt: Optional[str]) -> str:
+        return hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()[:32]
+
+    def _partition(self, key: str, dim: int) -> _Partition:
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is not None:
+                self._partitions.move_to_end(key)
+                return partition
+            partition = self._partitions[key] = _Partition(dim, min(self.max_entries, 64))
+            if len(self._partitions) > self.max_partitions:
+                self._partitions.popitem(last=False)
+        # Eerste keer in deze instance: vul vanuit Firestore
+        self._load(key, partition)
+        return partition
+
+    def _collection(self):
+        return self._get_db().collection(self.COLLECTION)
+
+    def _load(self, key: str, partition: _Partition):
+        if self._get_db is None:
+            return
+        try:
+            from google.cloud.firestore_v1.base_query import FieldFilter
+            query = self._collection().where(filter=FieldFilter("partition", "==", key))
+            with metrics.timed_upstream("firestore"):
+                docs = list(query.limit(self.max_entries).stream())
+        except Exception:
+            return
+        now = time.time()
+        with partition.lock:
+            for doc in docs:
+                data = doc.to_dict()
+                expires_at = from_timestamp(data.get("expires_at"))
+                if expires_at <= now or len(data.get("embedding", ())) != partition.vectors.shape[1]:
+                    continue
+                entry = SemanticEntry(
+                    id=doc.id,
+                    message=data["message"],
+                    answer=data["answer"],
+                    created_at=data["created_at"],
+                    expires_at=expires_at,
+                    last_used=data["created_at"]
+                )
+                partition.add(_normalize(data["embedding"]), entry, self.max_entries)
+
+    def lookup(self, message: str, system_prompt: Optional[str] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+        """
+        Zoek een semantisch gelijk antwoord
+
+        Returns:
+            Tuple van (answer of None, info). info gaat mee naar store() (bevat de embedding,
+            zodat een miss niet twee keer ge-embed wordt).
+        """
+        vector = _normalize(self._embed([_normalize_message(message)])[0])
+        key = self.partition_key(system_prompt)
+        partition = self._partition(key, len(vector))
+        info: Dict[str, Any] = {"partition": key, "message": message, "vector": vector, "status": "MISS"}
+
+        with partition.lock:
+            index, similarity = partition.nearest(vector)
+            info["similarity"] = round(similarity, 4)
+            if index >= 0 and similarity >= self.threshold:
+                entry = partition.entries[index]
+                now = time.time()
+                if entry.expires_at > now:
+                    entry.last_used = now
+                    entry.hits += 1
+                    self.hits += 1
+                    metrics.increment("semantic_cache.hit")
+                    metrics.observe("semantic_cache.similarity", similarity)
+                    info.update(status="HIT", age=now - entry.created_at, matched=entry.message)
+                    return entry.answer, info
+                partition.remove(index)
+
+        self.misses += 1
+        metrics.increment("semantic_cache.miss")
+        return None, info
+
+    def store(self, info: Dict[str, Any], answer: str):
+        """Sla een nieuw antwoord op (in-process + Firestore) met de embedding uit lookup()"""
+        now = time.time()
+        vector = info["vector"]
+        entry = SemanticEntry(
+            id=hashlib.sha256(f"{info['partition']}\x00{info['message']}".encode("utf-8")).hexdigest()[:40],
+            message=info["message"],
+            answer=answer,
+            created_at=now,
+            expires_at=now + self.ttl,
+            last_used=now
+        )
+        partition = self._partition(info["partition"], len(vector))
+        with partition.lock:
+            partition.add(vector, entry, self.max_entries)
+
+        if self._get_db is None:
+            return
+        try:
+            with metrics.timed_upstream("firestore"):
+                self._collection().document(entry.id).set({
+                    "partition": info["partition"],
+                    "message": entry.message,
+                    "answer": answer,
+                    "embedding": vector.tolist(),
+                    "created_at": entry.created_at,
+                    "expires_at": to_timestamp(entry.expires_at),
+                })
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        with self._lock:
+            partitions = list(self._partitions.values())
+        return {
+            "partitions": len(partitions),
+            "entries": sum(len(p.entries) for p in partitions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "threshold": self.threshold,
+        }
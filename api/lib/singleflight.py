@@ -0,0 +1,248 @@
+"""
+Single-flight request coalescing
+Gelijke upstream calls die tegelijk in dezelfde instance lopen (bijv. een piek
+op dezelfde search) wachten op één upstream call en delen het resultaat (of de
+exception). Alleen lopende calls worden samengevoegd; dit is geen cache.
+
+Streams (stream_chat) gaan via een Broadcast: één generatie, meerdere lezers.
+Late lezers krijgen eerst de al ontvangen chunks en lezen daarna live mee.
+
+Metrics (counters): singleflight.<naam>.calls (upstream calls) en
+singleflight.<naam>.collapsed (calls die meeliften op een lopende call).
+"""
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+from lib import metrics
+
+
+def make_key(*parts: Any) -> str:
+    """Stabiele key voor (geneste) argumenten"""
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+class SingleFlight:
+    """
+    Gebruik:
+        flight = SingleFlight("tavily")
+        result = flight.do(make_key(path, payload), self._post_upstream, path, payload)
+        result = await flight.do_async(make_key(path, payload), self._post_upstream_async, path, payload)
+        chunks = flight.stream(make_key(message, ...), self._stream_upstream, message)
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Naam voor de metrics counters
+        """
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._streams: Dict[Hashable, "Broadcast"] = {}
+        self._tasks: Dict[Hashable, "asyncio.Task"] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Roep fn aan, of wacht op een lopende call met dezelfde key
+
+        Returns:
+            Het resultaat van fn (gedeeld met alle wachtende callers)
+
+        Raises:
+            De exception van fn (ook bij de wachtende callers)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            metrics.increment(f"singleflight.{self.name}.collapsed")
+            return future.result()
+
+        metrics.increment(f"singleflight.{self.name}.calls")
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """
+        Async variant van do(): één upstream task per key (per event loop)
+
+        De upstream call draait als eigen task; een caller die afhaakt (deadline,
+        annulering) stopt hem niet voor de andere wachtende callers.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            task = self._tasks.get(flight_key)
+            leader = task is None
+            if leader:
+                task = self._tasks[flight_key] = loop.create_task(fn(*args, **kwargs))
+                task.add_done_callback(lambda done: self._task_done(flight_key, done))
+        metrics.increment(f"singleflight.{self.name}.{'calls' if leader else 'collapsed'}")
+        return await asyncio.shield(task)
+
+    def _task_done(self, flight_key: Hashable, task: "asyncio.Task"):
+        with self._lock:
+            self._tasks.pop(flight_key, None)
+        # Exception ophalen, ook als alle callers al afgehaakt zijn (geen "never retrieved" warning)
+        if not task.cancelled():
+            task.exception()
+
+    def stream(self, key: Hashable, fn: Callable[..., Iterable[Any]], *args: Any, **kwargs: Any) -> Iterator[Any]:
+        """
+        Lees mee met een lopende stream met dezelfde key, of start er een
+
+        fn moet een (lazy) iterator teruggeven, zoals een generator functie.
+        De stream stopt als alle lezers weg zijn (close()).
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            subscription = broadcast.subscribe() if broadcast is not None else None
+            if subscription is None:
+                broadcast = Broadcast(fn(*args, **kwargs), on_done=lambda: self._forget(key, broadcast))
+                self._streams[key] = broadcast
+                subscription = broadcast.subscribe()
+                leader = True
+            else:
+                leader = False
+        metrics.increment(f"singleflight.{self.name}.{'calls' if leader else 'collapsed'}")
+        return subscription
+
+    def _forget(self, key: Hashable, broadcast: "Broadcast"):
+        with self._lock:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._calls) + len(self._tasks), "streams": len(self._streams)}
+
+
+class Broadcast:
+    """
+    Eén bron iterator, meerdere lezers (thread-safe)
+
+    Er is geen aparte producer thread: de lezer die als eerste een nog niet
+    ontvangen chunk nodig heeft haalt hem op, de rest wacht. Valt die lezer weg,
+    dan neemt een andere het over. Zijn alle lezers weg, dan wordt de bron gesloten.
+    """
+
+    def __init__(self, source: Iterable[Any], on_done: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            source: Bron iterator (bijv. GeminiClient stream chunks)
+            on_done: Callback als de bron klaar, mislukt of gesloten is
+        """
+        self._source = iter(source)
+        self._on_done = on_done
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._producing = False
+        self._cancelled = False
+        self._subscribers = 0
+        self._cond = threading.Condition()
+
+    def subscribe(self) -> Optional["Subscription"]:
+        """Nieuwe lezer vanaf de eerste chunk (None als de bron al gesloten is)"""
+        with self._cond:
+            if self._cancelled:
+                return None
+            self._subscribers += 1
+        return Subscription(self)
+
+    def _get(self, index: int) -> Any:
+        """Chunk index (wacht of produceert); StopIteration aan het einde"""
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done and self._producing:
+                    self._cond.wait()
+                if index < len(self.chunks):
+                    return self.chunks[index]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    raise StopIteration
+                self._producing = True
+            self._produce()
+
+    def _produce(self):
+        try:
+            chunk = next(self._source)
+        except StopIteration:
+            self._finish(None)
+        except BaseException as e:
+            self._finish(e)
+        else:
+            with self._cond:
+                self.chunks.append(chunk)
+                self._producing = False
+                self._cond.notify_all()
+
+    def _finish(self, error: Optional[BaseException]):
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._producing = False
+            self._cond.notify_all()
+        if self._on_done:
+            self._on_done()
+
+    def _unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+            abandoned = self._subscribers == 0 and not self.done
+            if abandoned:
+                self._cancelled = True
+        if abandoned:
+            # Niemand leest meer: upstream stream stoppen
+            self._finish(GeneratorExit())
+            close = getattr(self._source, "close", None)
+            if close:
+                close()
+
+
+class Subscription:
+    """Iterator van één lezer over een Broadcast"""
+
+    def __init__(self, broadcast: Broadcast):
+        self._broadcast = broadcast
+        self._index = 0
+        self._closed = False
+
+    def __iter__(self) -> "Subscription":
+        return self
+
+    def __next__(self) -> Any:
+        if self._closed:
+            raise StopIteration
+        try:
+            chunk = self._broadcast._get(self._index)
+        except BaseException:
+            self.close()
+            raise
+        self._index += 1
+        return chunk
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._broadcast._unsubscribe()
+
+    # Net als een generator: een lezer die niet expliciet sluit (break, disconnect) telt niet meer mee
+    __del__ = close
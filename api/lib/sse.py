@@ -0,0 +1,193 @@
+"""
+Server-Sent Events helpers
+Gedeelde SSE framing en response headers voor streaming endpoints
+
+SSEWriter voegt kleine token chunks samen tot minder, grotere events (tijd- of
+grootte-venster), stuurt heartbeat comments als de upstream stil is en nummert
+events met `id:` (het aantal upstream chunks tot en met dit event).
+"""
+import os
+import queue
+import threading
+import time
+from firebase_functions import https_fn
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from lib import metrics
+from lib.encoding import json_dumps
+
+SSE_HEADERS = {
+    'Content-Type': 'text/event-stream; charset=utf-8',
+    'Cache-Control': 'no-cache, no-transform',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',
+    'Access-Control-Allow-Origin': '*',
+    # Leesbaar voor fetch() clients in de browser (hervatten met Last-Event-ID)
+    'Access-Control-Expose-Headers': 'X-Session-Id, X-Stream-Id'
+}
+
+# Eerste comment om de verbinding direct te openen
+SSE_CONNECTED = b": connected\n\n"
+SSE_HEARTBEAT = b": ping\n\n"
+
+# Coalescing en heartbeat defaults (0 = uit)
+SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL_MS", "20")) / 1000
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "256"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+_END = object()
+
+
+def sse_message(data: Dict[str, Any]) -> bytes:
+    """Format een dict als SSE data event (bytes)"""
+    return b"data: " + json_dumps(data) + b"\n\n"
+
+
+def sse_response(events: Iterable[bytes]) -> https_fn.Response:
+    """Streaming response met SSE headers"""
+    return https_fn.Response(events, status=200, headers=SSE_HEADERS)
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class SSEWriter:
+    """
+    Text chunks → SSE bytes (zelfde {"chunk": ...} events als sse_message, maar met id en coalescing)
+
+    Gebruik:
+        writer = SSEWriter()
+        yield SSE_CONNECTED
+        for frame in writer.chunks(client.stream_chat(message)):
+            yield frame
+        yield writer.event({"done": True})
+        # writer.text bevat de volledige tekst
+
+    Het eerste chunk gaat direct de deur uit (time-to-first-token). Daarna wordt
+    gebufferd tot flush_bytes bereikt is of flush_interval verstreken is sinds het
+    eerste gebufferde chunk. Met coalescing of heartbeats aan leest een pump thread
+    de upstream, zodat het tijdvenster en de heartbeat ook lopen als de upstream stil is.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = SSE_FLUSH_INTERVAL,
+        flush_bytes: int = SSE_FLUSH_BYTES,
+        heartbeat: float = SSE_HEARTBEAT_INTERVAL,
+        start_id: int = 0
+    ):
+        """
+        Args:
+            flush_interval: Max seconden dat een chunk gebufferd blijft (0 = elk chunk direct)
+            flush_bytes: Flush zodra de buffer zo groot is
+            heartbeat: Seconden stilte waarna een ": ping" comment volgt (0 = uit)
+            start_id: Eerste event id - 1 (bijv. bij hervatten van een stream)
+        """
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.heartbeat = heartbeat
+        self.last_id = start_id
+        self._parts: List[str] = []
+        self.events = 0
+
+    @property
+    def text(self) -> str:
+        """Alle tekst die door chunks() is gegaan"""
+        return "".join(self._parts)
+
+    def frame(self, text: str, count: int = 1) -> bytes:
+        """Eén chunk event; id = aantal upstream chunks tot en met dit event"""
+        self.last_id += count
+        self.events += 1
+        return b"id: %d\ndata: {\"chunk\":%b}\n\n" % (self.last_id, json_dumps(text))
+
+    def event(self, data: Dict[str, Any]) -> bytes:
+        """Overig event (done, error, ...) met het id van het laatste chunk"""
+        self.events += 1
+        return b"id: %d\ndata: %b\n\n" % (self.last_id, json_dumps(data))
+
+    def chunks(self, source: Iterable[str]) -> Iterator[bytes]:
+        """
+        SSE frames voor een upstream text stream
+
+        Raises:
+            De exception van de upstream (na het flushen van wat al binnen was)
+        """
+        if not self.flush_interval and not self.heartbeat:
+            for chunk in source:
+                self._parts.append(chunk)
+                yield self.frame(chunk)
+            return
+        yield from self._coalesced(source)
+
+    def _coalesced(self, source: Iterable[str]) -> Iterator[bytes]:
+        items: "queue.Queue[Any]" = queue.Queue()
+        stop = threading.Event()
+        context = metrics.copy_context()
+        threading.Thread(target=context.run, args=(_pump, source, items, stop), daemon=True).start()
+
+        buffer: List[str] = []
+        size = 0
+        first = True
+        deadline: Optional[float] = None
+        try:
+            while True:
+                if deadline is not None:
+                    wait = max(deadline - time.monotonic(), 0)
+                else:
+                    wait = self.heartbeat or None
+                try:
+                    item = items.get(timeout=wait)
+                except queue.Empty:
+                    if buffer:
+                        yield self._flush(buffer)
+                        buffer, size, deadline = [], 0, None
+                    else:
+                        yield SSE_HEARTBEAT
+                    continue
+
+                if item is _END or isinstance(item, _Failure):
+                    if buffer:
+                        yield self._flush(buffer)
+                    if isinstance(item, _Failure):
+                        raise item.error
+                    return
+
+                self._parts.append(item)
+                if first:
+                    first = False
+                    yield self.frame(item)
+                    continue
+                buffer.append(item)
+                size += len(item)
+                if size >= self.flush_bytes or not self.flush_interval:
+                    yield self._flush(buffer)
+                    buffer, size, deadline = [], 0, None
+                elif deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+        finally:
+            stop.set()
+
+    def _flush(self, buffer: List[str]) -> bytes:
+        if len(buffer) > 1:
+            metrics.increment("sse.coalesced_chunks", len(buffer) - 1)
+        return self.frame("".join(buffer), len(buffer))
+
+
+def _pump(source: Iterable[str], items: "queue.Queue[Any]", stop: threading.Event):
+    """Lees de upstream in een eigen thread; stopt (en sluit de bron) als de lezer weg is"""
+    iterator = iter(source)
+    try:
+        for chunk in iterator:
+            if stop.is_set():
+                break
+            items.put(chunk)
+        else:
+            items.put(_END)
+    except BaseException as e:
+        items.put(_Failure(e))
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
@@ -0,0 +1,43 @@
+"""
+Startup timing
+Meet cold start kosten per module zodat we zien waar de import tijd heen gaat
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator
+
+# Moment waarop dit proces begon met laden (zo vroeg mogelijk geïmporteerd in main.py)
+PROCESS_START = time.perf_counter()
+
+_timings: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """
+    Meet hoe lang een blok (meestal een import) duurt
+
+    Args:
+        name: Label in het startup rapport (bijv. "routes.ai_routes")
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Eerste meting telt: dat is de echte (koude) import
+        _timings.setdefault(name, (time.perf_counter() - start) * 1000)
+
+
+def startup_report() -> Dict[str, Any]:
+    """
+    Cold start rapport
+
+    Returns:
+        Dict met uptime en import tijd per module in ms (langzaamste eerst)
+    """
+    modules = sorted(_timings.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "uptime_ms": round((time.perf_counter() - PROCESS_START) * 1000, 2),
+        "modules_ms": {name: round(ms, 2) for name, ms in modules},
+        "total_import_ms": round(sum(_timings.values()), 2),
+    }
@@ -0,0 +1,349 @@
+"""
+Hervatbare chat streams
+Een generatie draait in een eigen producer thread en schrijft zijn chunks naar een
+StreamBuffer, los van de HTTP response. Valt de verbinding weg, dan loopt de
+generatie door; een reconnect met `Last-Event-ID` (= aantal al ontvangen chunks,
+zie SSEWriter) krijgt de gemiste chunks en leest daarna live mee.
+
+Buffers staan in het geheugen (TTL na afronding). Optioneel schrijft een eigen
+persist thread ze ook naar Firestore (buiten het pad naar het eerste token), zodat
+een reconnect die op een andere instance landt de stream ook kan hervatten
+(lopende generaties via polling). Alleen nieuwe chunks worden geschreven, als
+segment documenten `<stream_id>-<n>` naast een klein meta document `<stream_id>`:
+geen herschrijven van de hele tekst en geen 1 MiB limiet per document.
+
+Opruimen: één janitor thread haalt verlopen buffers uit het geheugen (ook als er
+geen nieuwe streams meer starten) en verwijdert de Firestore documenten van
+afgeronde streams na de TTL. `expires_at` is een Timestamp, zodat een Firestore
+TTL policy documenten opruimt die de janitor mist (instance gestopt).
+"""
+import bisect
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from lib import metrics
+from lib.cache import from_timestamp, to_timestamp
+
+# Max operaties per Firestore batch
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class StreamNotFoundError(KeyError):
+    """Onbekende of verlopen stream id (HTTP 404)"""
+
+
+class StreamBuffer:
+    """Chunks van één generatie (thread-safe, één schrijver, meerdere lezers)"""
+
+    def __init__(self, stream_id: str):
+        self.id = stream_id
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+        self._cond = threading.Condition()
+
+    def append(self, chunk: str):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[str] = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def follow(self, start: int = 0) -> Iterator[str]:
+        """
+        Chunks vanaf index start; wacht op nieuwe chunks tot de generatie klaar is
+
+        Raises:
+            RuntimeError: Als de generatie met een fout eindigde (na de chunks die er wel zijn)
+        """
+        index = start
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                pending = self.chunks[index:]
+                done, error = self.done, self.error
+            yield from pending
+            index += len(pending)
+            if done and index >= len(self.chunks):
+                if error is not None:
+                    raise RuntimeError(error)
+                return
+
+
+class ResumableStreams:
+    """
+    Gebruik:
+        buffer = streams.start(lambda: client.stream_chat(message), on_complete=save)
+        yield from writer.chunks(buffer.follow())
+
+        # Reconnect (eventueel op een andere instance)
+        chunks = streams.follow(stream_id, last_event_id)
+
+    De stream id gaat naar de client als X-Stream-Id header en in het done event.
+    """
+
+    COLLECTION = "_chat_streams"
+
+    def __init__(
+        self,
+        get_db: Optional[Callable[[], Any]] = None,
+        ttl: float = 300,
+        max_streams: int = 256,
+        persist_interval: float = 1.0,
+        poll_interval: float = 0.5,
+        stale_after: float = 30,
+        cleanup_interval: float = 60
+    ):
+        """
+        Args:
+            get_db: Functie die de Firestore client teruggeeft (None = alleen in-process)
+            ttl: Seconden dat een afgeronde stream hervat kan worden
+            max_streams: Max buffers in het geheugen (oudste afgeronde eerst weg)
+            persist_interval: Min seconden tussen Firestore writes tijdens een generatie
+            poll_interval: Seconden tussen Firestore reads bij het meelezen van een
+                generatie die op een andere instance loopt
+            stale_after: Seconden zonder update waarna een lopende remote generatie
+                als afgebroken geldt
+            cleanup_interval: Seconden tussen opruimrondes van de janitor thread
+        """
+        self._get_db = get_db
+        self.ttl = ttl
+        self.max_streams = max_streams
+        self.persist_interval = persist_interval
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.cleanup_interval = cleanup_interval
+        self._buffers: "OrderedDict[str, StreamBuffer]" = OrderedDict()
+        # (monotonic deadline, stream id, aantal segmenten) van afgeronde gepersisteerde streams
+        self._pending_deletes: List[Tuple[float, str, int]] = []
+        self._janitor: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(
+        self,
+        source: Callable[[], Iterable[str]],
+        on_complete: Optional[Callable[[str], None]] = None
+    ) -> StreamBuffer:
+        """
+        Start een generatie in een producer thread
+
+        Args:
+            source: Functie die de upstream chunk iterator teruggeeft (wordt in de producer aangeroepen)
+            on_complete: Callback met de volledige tekst, vóór de buffer als klaar gemarkeerd
+                wordt (bijv. de sessie opslaan); loopt ook als de client al weg is
+        """
+        buffer = StreamBuffer(uuid.uuid4().hex)
+        with self._lock:
+            self._evict()
+            self._buffers[buffer.id] = buffer
+            if self._janitor is None:
+                self._janitor = threading.Thread(target=self._cleanup_loop, name="stream-janitor", daemon=True)
+                self._janitor.start()
+        metrics.increment("streams.started")
+        threading.Thread(
+            target=metrics.copy_context().run, args=(self._produce, buffer, source, on_complete),
+            name=f"stream-{buffer.id[:8]}", daemon=True
+        ).start()
+        if self._get_db is not None:
+            threading.Thread(
+                target=metrics.copy_context().run, args=(self._persist_loop, buffer),
+                name=f"stream-persist-{buffer.id[:8]}", daemon=True
+            ).start()
+        return buffer
+
+    def _produce(
+        self,
+        buffer: StreamBuffer,
+        source: Callable[[], Iterable[str]],
+        on_complete: Optional[Callable[[str], None]]
+    ):
+        error = None
+        try:
+            for chunk in source():
+                buffer.append(chunk)
+            if on_complete:
+                on_complete(buffer.text)
+        except Exception as e:
+            error = str(e)
+        buffer.finish(error)
+
+    def _evict(self):
+        """Verlopen buffers weg; boven max_streams de oudste afgeronde (caller houdt _lock)"""
+        now = time.monotonic()
+        for stream_id in [
+            stream_id for stream_id, buffer in self._buffers.items()
+            if buffer.finished_at is not None and now - buffer.finished_at > self.ttl
+        ]:
+            del self._buffers[stream_id]
+        while len(self._buffers) >= self.max_streams:
+            finished = next((i for i, b in self._buffers.items() if b.done), None)
+            if finished is None:
+                break
+            del self._buffers[finished]
+
+    def _cleanup_loop(self):
+        """Janitor: verlopen buffers uit het geheugen, Firestore documenten na de TTL weg"""
+        while True:
+            time.sleep(self.cleanup_interval)
+            now = time.monotonic()
+            with self._lock:
+                self._evict()
+                due = [d for d in self._pending_deletes if d[0] <= now]
+                self._pending_deletes = [d for d in self._pending_deletes if d[0] > now]
+            for _, stream_id, segments in due:
+                self._delete(stream_id, segments)
+
+    def _delete(self, stream_id: str, segments: int):
+        """Meta + segment documenten van een verlopen stream verwijderen (best effort)"""
+        collection = self._collection()
+        refs = [collection.document(f"{stream_id}-{n:05d}") for n in range(segments)]
+        refs.append(collection.document(stream_id))
+        try:
+            for i in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+                batch = self._get_db().batch()
+                for ref in refs[i:i + FIRESTORE_BATCH_LIMIT]:
+                    batch.delete(ref)
+                with metrics.timed_upstream("firestore"):
+                    batch.commit()
+            metrics.increment("streams.deleted")
+        except Exception:
+            metrics.increment("streams.delete_errors")
+
+    def _collection(self):
+        return self._get_db().collection(self.COLLECTION)
+
+    def _persist_loop(self, buffer: StreamBuffer):
+        """
+        Schrijf nieuwe chunks hoogstens elke persist_interval seconden naar Firestore
+        Het meta document gaat er direct in, zodat een vroege reconnect op een andere
+        instance de stream vindt; de laatste write volgt zodra de generatie klaar is.
+        """
+        starts: List[int] = []
+        persisted = 0
+        while True:
+            with buffer._cond:
+                chunks = buffer.chunks[persisted:]
+                done, error = buffer.done, buffer.error
+            if self._persist(buffer.id, starts, persisted, chunks, done, error):
+                if chunks:
+                    starts.append(persisted)
+                    persisted += len(chunks)
+            if done:
+                with self._lock:
+                    self._pending_deletes.append((time.monotonic() + self.ttl, buffer.id, len(starts)))
+                return
+            with buffer._cond:
+                buffer._cond.wait_for(lambda: buffer.done, timeout=self.persist_interval)
+
+    def _persist(
+        self,
+        stream_id: str,
+        starts: List[int],
+        offset: int,
+        chunks: List[str],
+        done: bool,
+        error: Optional[str]
+    ) -> bool:
+        """Nieuw segment (chunks vanaf offset) + meta document in één batch (best effort)"""
+        now = time.time()
+        expires_at = to_timestamp(now + self.ttl)
+        collection = self._collection()
+        batch = self._get_db().batch()
+        if chunks:
+            batch.set(collection.document(f"{stream_id}-{len(starts):05d}"), {
+                "chunks": chunks,
+                "expires_at": expires_at,
+            })
+            starts = starts + [offset]
+        batch.set(collection.document(stream_id), {
+            "starts": starts,
+            "count": offset + len(chunks),
+            "done": done,
+            "error": error,
+            "updated_at": now,
+            "expires_at": expires_at,
+        })
+        try:
+            with metrics.timed_upstream("firestore"):
+                batch.commit()
+            return True
+        except Exception:
+            metrics.increment("streams.persist_errors")
+            return False
+
+    def follow(self, stream_id: str, last_event_id: int = 0) -> Iterator[str]:
+        """
+        Chunks na last_event_id, lokaal of vanuit Firestore
+
+        Raises:
+            StreamNotFoundError: Als de stream onbekend of verlopen is
+        """
+        with self._lock:
+            self._evict()
+            buffer = self._buffers.get(stream_id)
+        if buffer is not None:
+            metrics.increment("streams.resumed")
+            return buffer.follow(last_event_id)
+        snapshot = self._load(stream_id)
+        if snapshot is None:
+            raise StreamNotFoundError(f"Stream not found or expired: {stream_id}")
+        metrics.increment("streams.resumed_remote")
+        return self._follow_remote(stream_id, snapshot, last_event_id)
+
+    def _load(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Meta of segment document (None als het niet bestaat of verlopen is)"""
+        if self._get_db is None:
+            return None
+        with metrics.timed_upstream("firestore"):
+            snapshot = self._collection().document(doc_id).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        if from_timestamp(data.get("expires_at")) <= time.time():
+            return None
+        return data
+
+    def _follow_remote(self, stream_id: str, data: Dict[str, Any], index: int) -> Iterator[str]:
+        """Meelezen via Firestore met een generatie op een andere instance"""
+        while True:
+            starts = data.get("starts", [])
+            if index < data.get("count", 0):
+                # Alleen de segmenten vanaf het segment met chunk index
+                for number in range(max(bisect.bisect_right(starts, index) - 1, 0), len(starts)):
+                    segment = self._load(f"{stream_id}-{number:05d}")
+                    if segment is None:
+                        raise RuntimeError(f"Stream expired: {stream_id}")
+                    chunks = segment.get("chunks", [])
+                    yield from chunks[max(index - starts[number], 0):]
+                    index = max(index, starts[number] + len(chunks))
+            if data.get("done"):
+                if data.get("error") is not None:
+                    raise RuntimeError(data["error"])
+                return
+            if time.time() - data.get("updated_at", 0) > self.stale_after:
+                raise RuntimeError("Stream interrupted: generating instance stopped updating")
+            time.sleep(self.poll_interval)
+            data = self._load(stream_id)
+            if data is None:
+                raise RuntimeError(f"Stream expired: {stream_id}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            buffers = list(self._buffers.values())
+        return {
+            "streams": len(buffers),
+            "running": sum(1 for b in buffers if not b.done),
+        }
@@ -2,26 +2,151 @@
 Tavily Search Client
 Simple wrapper voor Tavily search API
 """
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
-import requests
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, TYPE_CHECKING
+from lib import metrics
+from lib.singleflight import SingleFlight, make_key
+from lib.startup import timed
+
+with timed("requests"):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    import httpx
 
 
 class TavilyClient:
-    """Client voor Tavily search API"""
+    """
+    Client voor Tavily search API
     
-    BASE_URL = "https://api.tavily.com"
+    Houdt een eigen keep-alive connection pool aan (requests.Session), zodat
+    warm instances via get_tavily_client() de TCP+TLS verbinding hergebruiken.
+    Gelijke requests die tegelijk lopen delen één upstream call (lib/singleflight.py).
+    """
     
-    def __init__(self, api_key: Optional[str] = None):
+    # Overschrijfbaar voor lokale stand-ins (benchmarks/fakes.py)
+    BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+    
+    # Pool & timeout defaults (overschrijfbaar via constructor)
+    POOL_SIZE = 10
+    CONNECT_TIMEOUT = 3.05
+    READ_TIMEOUT = 20.0
+    MAX_RETRIES = 2
+    BACKOFF_FACTOR = 0.3
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        pool_size: int = POOL_SIZE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        backoff_factor: float = BACKOFF_FACTOR,
+        coalesce: bool = True
+    ):
         """
         Initialiseer Tavily client
         
         Args:
             api_key: Tavily API key (gebruikt TAVILY_API_KEY env var als niet gegeven)
+            pool_size: Max aantal open (keep-alive) verbindingen naar Tavily
+            connect_timeout: Timeout in seconden voor het opzetten van de verbinding
+            read_timeout: Timeout in seconden voor het wachten op de response
+            max_retries: Aantal retries bij 429/5xx en verbindingsfouten
+            backoff_factor: Exponentiële backoff tussen retries (0.3 → 0.3s, 0.6s, ...)
+            coalesce: Gelijke gelijktijdige requests samenvoegen tot één upstream call
         """
         self.api_key = api_key or os.getenv("TAVILY_API_KEY")
         if not self.api_key:
             raise ValueError("Tavily API key is vereist")
+        
+        self.timeout = (connect_timeout, read_timeout)
+        
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=None,  # Tavily search POSTs zijn idempotent
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=False,
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        
+        # Upstream calls per client methode (regressie check: 1 call per search)
+        self._calls: Counter = Counter()
+        self._calls_lock = threading.Lock()
+        self._flight = SingleFlight("tavily") if coalesce else None
+    
+    def _post(self, path: str, payload: Dict[str, Any], method: str) -> Dict[str, Any]:
+        """
+        POST naar Tavily via de gedeelde session (keep-alive, timeouts, retries)
+        Een identieke request die al loopt wordt niet opnieuw verstuurd: de caller wacht op dat resultaat.
+        
+        Args:
+            path: API path (bijv. "/search")
+            payload: JSON body (zonder api_key)
+            method: Naam van de aanroepende client methode (voor call_stats)
+        """
+        if self._flight is None:
+            return self._post_upstream(path, payload, method)
+        return self._flight.do(make_key(path, payload), self._post_upstream, path, payload, method)
+    
+    def _post_upstream(self, path: str, payload: Dict[str, Any], method: str) -> Dict[str, Any]:
+        with self._calls_lock:
+            self._calls[method] += 1
+        payload = {"api_key": self.api_key, **payload}
+        with metrics.timed_upstream("tavily"):
+            response = self.session.post(
+                f"{self.BASE_URL}{path}",
+                json=payload,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            return response.json()
+    
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        Connection pool statistieken
+        
+        Returns:
+            Dict met requests, nieuwe verbindingen (misses) en hergebruikte verbindingen (hits)
+        """
+        pools = self._adapter.poolmanager.pools
+        requests_made = 0
+        connections = 0
+        for key in pools.keys():
+            pool = pools[key]
+            requests_made += pool.num_requests
+            connections += pool.num_connections
+        return {
+            "requests": requests_made,
+            "pool_misses": connections,
+            "pool_hits": max(requests_made - connections, 0),
+        }
+    
+    def call_stats(self) -> Dict[str, int]:
+        """Aantal upstream calls per client methode (samengevoegde calls tellen 1x)"""
+        with self._calls_lock:
+            return dict(self._calls)
+    
+    def close(self):
+        """Sluit alle open verbindingen"""
+        self.session.close()
     
     def search(
         self,
@@ -45,7 +170,6 @@ class TavilyClient:
             Dict met search results
         """
         payload = {
-            "api_key": self.api_key,
             "query": query,
             "max_results": max_results,
             "search_depth": search_depth,
@@ -56,17 +180,15 @@ class TavilyClient:
         if exclude_domains:
             payload["exclude_domains"] = exclude_domains
         
-        response = requests.post(
-            f"{self.BASE_URL}/search",
-            json=payload
-        )
-        response.raise_for_status()
-        return response.json()
+        return self._post("/search", payload, method="search")
     
     def get_clean_results(
         self,
         query: str,
-        max_results: int = 5
+        max_results: int = 5,
+        search_depth: str = "basic",
+        include_domains: Optional[List[str]] = None,
+        exclude_domains: Optional[List[str]] = None
     ) -> List[Dict[str, str]]:
         """
         Krijg alleen de essentials: title, url, content
@@ -74,21 +196,31 @@ class TavilyClient:
         Args:
             query: Zoek query
             max_results: Max aantal resultaten
+            search_depth: "basic" of "advanced"
+            include_domains: Lijst van domains om in te filteren
+            exclude_domains: Lijst van domains om uit te filteren
             
         Returns:
             List van dicts met title, url, content
         """
-        results = self.search(query, max_results)
-        
-        clean_results = []
-        for result in results.get("results", []):
-            clean_results.append({
-                "title": result.get("title", ""),
-                "url": result.get("url", ""),
-                "content": result.get("content", "")
-            })
+        results = self.search(
+            query,
+            max_results,
+            search_depth=search_depth,
+            include_domains=include_domains,
+            exclude_domains=exclude_domains
+        )
         
-        return clean_results
+        return self._clean(results)
+    
+    @staticmethod
+    def _clean(results: Dict[str, Any], *extra_fields: str) -> List[Dict[str, str]]:
+        """Reduceer een Tavily response tot title, url, content (+ extra velden)"""
+        fields = ("title", "url", "content") + extra_fields
+        return [
+            {field: result.get(field, "") for field in fields}
+            for result in results.get("results", [])
+        ]
     
     def search_news(
         self,
@@ -97,7 +229,7 @@ class TavilyClient:
         days: int = 7
     ) -> List[Dict[str, str]]:
         """
-        Zoek recent nieuws
+        Zoek recent nieuws (1 upstream call, topic "news")
         
         Args:
             query: Zoek query
@@ -105,10 +237,9 @@ class TavilyClient:
             days: Aantal dagen terug
             
         Returns:
-            List van nieuws resultaten
+            List van nieuws resultaten (title, url, content, published_date)
         """
         payload = {
-            "api_key": self.api_key,
             "query": query,
             "max_results": max_results,
             "search_depth": "advanced",
@@ -116,14 +247,177 @@ class TavilyClient:
             "days": days
         }
         
-        response = requests.post(
-            f"{self.BASE_URL}/search",
-            json=payload
-        )
-        response.raise_for_status()
+        results = self._post("/search", payload, method="search_news")
+        return self._clean(results, "published_date")
+    
+    def search_news_batch(
+        self,
+        queries: List[str],
+        max_results: int = 5,
+        days: int = 7,
+        max_workers: int = 5
+    ) -> Dict[str, List[Dict[str, str]]]:
+        """
+        Zoek nieuws voor meerdere topics tegelijk (concurrent fan-out over de gedeelde pool)
         
-        results = response.json()
-        return self.get_clean_results(query, max_results)
+        Args:
+            queries: Lijst van zoek queries (duplicaten worden 1x gezocht)
+            max_results: Max aantal resultaten per query
+            days: Aantal dagen terug
+            max_workers: Max aantal gelijktijdige upstream calls
+            
+        Returns:
+            Dict van query naar nieuws resultaten
+        """
+        unique = list(dict.fromkeys(queries))
+        if not unique:
+            return {}
+        workers = max(1, min(max_workers, len(unique)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            context = metrics.copy_context
+            results = pool.map(
+                lambda q: context().run(self.search_news, q, max_results=max_results, days=days),
+                unique
+            )
+            return dict(zip(unique, results))
+
+
+class AsyncTavilyClient:
+    """
+    Async client voor Tavily search API (httpx.AsyncClient)
+    
+    Eén keep-alive pool per client; gebruik hem vanaf één event loop
+    (de achtergrond loop uit lib/aio.py, via get_async_tavily_client()).
+    Zelfde timeouts, retries (429/5xx met backoff + Retry-After) en
+    single-flight coalescing als TavilyClient.
+    """
+    
+    BASE_URL = TavilyClient.BASE_URL
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        pool_size: int = TavilyClient.POOL_SIZE * 2,
+        connect_timeout: float = TavilyClient.CONNECT_TIMEOUT,
+        read_timeout: float = TavilyClient.READ_TIMEOUT,
+        max_retries: int = TavilyClient.MAX_RETRIES,
+        backoff_factor: float = TavilyClient.BACKOFF_FACTOR,
+        coalesce: bool = True
+    ):
+        """
+        Initialiseer async Tavily client
+        
+        Args:
+            api_key: Tavily API key (gebruikt TAVILY_API_KEY env var als niet gegeven)
+            pool_size: Max aantal open (keep-alive) verbindingen naar Tavily
+            connect_timeout: Timeout in seconden voor het opzetten van de verbinding
+            read_timeout: Timeout in seconden voor het wachten op de response
+            max_retries: Aantal retries bij 429/5xx en verbindingsfouten
+            backoff_factor: Exponentiële backoff tussen retries (0.3 → 0.3s, 0.6s, ...)
+            coalesce: Gelijke gelijktijdige requests samenvoegen tot één upstream call
+        """
+        self.api_key = api_key or os.getenv("TAVILY_API_KEY")
+        if not self.api_key:
+            raise ValueError("Tavily API key is vereist")
+        
+        with timed("httpx"):
+            import httpx as httpx_module
+        self._httpx = httpx_module
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session: "httpx.AsyncClient" = httpx_module.AsyncClient(
+            base_url=self.BASE_URL,
+            timeout=httpx_module.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx_module.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+        self._calls: Counter = Counter()
+        self._flight = SingleFlight("tavily_async") if coalesce else None
+    
+    async def _post(self, path: str, payload: Dict[str, Any], method: str) -> Dict[str, Any]:
+        """POST naar Tavily (identieke lopende requests delen één upstream call)"""
+        if self._flight is None:
+            return await self._post_upstream(path, payload, method)
+        return await self._flight.do_async(make_key(path, payload), self._post_upstream, path, payload, method)
+    
+    async def _post_upstream(self, path: str, payload: Dict[str, Any], method: str) -> Dict[str, Any]:
+        self._calls[method] += 1
+        payload = {"api_key": self.api_key, **payload}
+        attempt = 0
+        while True:
+            delay = self.backoff_factor * (2 ** attempt)
+            try:
+                with metrics.timed_upstream("tavily"):
+                    response = await self.session.post(path, json=payload)
+            except self._httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                if response.status_code not in TavilyClient.RETRY_STATUSES or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+            attempt += 1
+            await asyncio.sleep(delay)
+    
+    def call_stats(self) -> Dict[str, int]:
+        """Aantal upstream calls per client methode (samengevoegde calls tellen 1x)"""
+        return dict(self._calls)
+    
+    async def close(self):
+        """Sluit alle open verbindingen"""
+        await self.session.aclose()
+    
+    async def search(
+        self,
+        query: str,
+        max_results: int = 5,
+        search_depth: str = "basic",
+        include_domains: Optional[List[str]] = None,
+        exclude_domains: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Async variant van TavilyClient.search"""
+        payload: Dict[str, Any] = {
+            "query": query,
+            "max_results": max_results,
+            "search_depth": search_depth,
+        }
+        if include_domains:
+            payload["include_domains"] = include_domains
+        if exclude_domains:
+            payload["exclude_domains"] = exclude_domains
+        return await self._post("/search", payload, method="search")
+    
+    async def get_clean_results(
+        self,
+        query: str,
+        max_results: int = 5,
+        search_depth: str = "basic",
+        include_domains: Optional[List[str]] = None,
+        exclude_domains: Optional[List[str]] = None
+    ) -> List[Dict[str, str]]:
+        """Async variant van TavilyClient.get_clean_results (title, url, content)"""
+        results = await self.search(
+            query,
+            max_results,
+            search_depth=search_depth,
+            include_domains=include_domains,
+            exclude_domains=exclude_domains
+        )
+        return TavilyClient._clean(results)
+    
+    async def search_news(self, query: str, max_results: int = 5, days: int = 7) -> List[Dict[str, str]]:
+        """Async variant van TavilyClient.search_news"""
+        payload = {
+            "query": query,
+            "max_results": max_results,
+            "search_depth": "advanced",
+            "topic": "news",
+            "days": days
+        }
+        results = await self._post("/search", payload, method="search_news")
+        return TavilyClient._clean(results, "published_date")
 
 
 # Convenience functies
@@ -142,21 +436,16 @@ def search_and_summarize(
     """
     Zoek met Tavily en laat Gemini samenvatten
     Combineert beide clients voor één actie
-    """
-    from .gemini_client import GeminiClient
-    
-    # Search
-    tavily = TavilyClient(tavily_key)
-    results = tavily.get_clean_results(query, max_results)
     
-    # Format voor Gemini
-    context = "\n\n".join([
-        f"Bron: {r['title']}\nURL: {r['url']}\n{r['content']}"
-        for r in results
-    ])
+    Zonder keys worden de process-wide clients en caches uit lib/utils gebruikt
+    (zie lib/search_pipeline.py); met expliciete keys worden losse clients gemaakt.
+    """
+    if not tavily_key and not gemini_key:
+        from lib.search_pipeline import search_and_summarize as pipeline
+        return pipeline(query, max_results=max_results)
     
-    # Summarize
-    gemini = GeminiClient(gemini_key)
-    prompt = f"Geef een heldere samenvatting van deze zoekresultaten over '{query}':\n\n{context}"
+    from lib.gemini_client import GeminiClient
+    from lib.search_pipeline import build_summary_prompt
     
-    return gemini.chat(prompt)
+    results = TavilyClient(tavily_key).get_clean_results(query, max_results)
+    return GeminiClient(gemini_key).chat(build_summary_prompt(query, results))
@@ -3,18 +3,35 @@ Utility functies voor de API
 Shared helpers, clients, responses
 """
 from firebase_functions import https_fn
-from firebase_admin import firestore
-from typing import Dict, Any, List, Optional
-import json
+from typing import Dict, Any, List, Optional, TYPE_CHECKING
 import os
-from lib.gemini_client import GeminiClient
-from lib.tavily_client import TavilyClient
+from lib.startup import timed
+from lib.cache import TTLCache, FirestoreCache, TieredCache
+from lib.encoding import json_dumps
+
+if TYPE_CHECKING:
+    # Alleen voor type hints: de echte imports zijn lazy (cold start)
+    from lib.gemini_client import GeminiClient
+    from lib.tavily_client import TavilyClient, AsyncTavilyClient
+    from lib.chat_sessions import ChatSessionStore
+    from lib.image_cache import ImageAnalysisCache
+    from lib.semantic_cache import SemanticCache
+    from lib.vector_index import ItemIndex
+    from lib.stream_buffer import ResumableStreams
 
 
 # Global variables voor lazy initialization
 _db = None
 _gemini_client = None
 _tavily_client = None
+_async_tavily_client = None
+_search_cache = None
+_summary_cache = None
+_chat_session_store = None
+_image_cache = None
+_semantic_cache = None
+_item_index = None
+_chat_streams = None
 
 
 def get_db():
@@ -24,11 +41,13 @@ def get_db():
     """
     global _db
     if _db is None:
+        with timed("firebase_admin.firestore"):
+            from firebase_admin import firestore
         _db = firestore.client()
     return _db
 
 
-def get_gemini_client() -> GeminiClient:
+def get_gemini_client() -> "GeminiClient":
     """
     Lazy initialization van Gemini client
     Returns: GeminiClient instance
@@ -39,11 +58,12 @@ def get_gemini_client() -> GeminiClient:
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable not set")
+        from lib.gemini_client import GeminiClient
         _gemini_client = GeminiClient(api_key)
     return _gemini_client
 
 
-def get_tavily_client() -> TavilyClient:
+def get_tavily_client() -> "TavilyClient":
     """
     Lazy initialization van Tavily client
     Returns: TavilyClient instance
@@ -54,13 +74,237 @@ def get_tavily_client() -> TavilyClient:
         api_key = os.getenv("TAVILY_API_KEY")
         if not api_key:
             raise ValueError("TAVILY_API_KEY environment variable not set")
+        from lib.tavily_client import TavilyClient
         _tavily_client = TavilyClient(api_key)
     return _tavily_client
 
 
+def get_async_tavily_client() -> "AsyncTavilyClient":
+    """
+    Lazy initialization van de async Tavily client (httpx)
+    Alleen gebruiken vanaf de achtergrond loop uit lib/aio.py (de pool hoort bij die loop).
+    
+    Returns: AsyncTavilyClient instance
+    Raises: ValueError als TAVILY_API_KEY niet gezet is
+    """
+    global _async_tavily_client
+    if _async_tavily_client is None:
+        api_key = os.getenv("TAVILY_API_KEY")
+        if not api_key:
+            raise ValueError("TAVILY_API_KEY environment variable not set")
+        from lib.tavily_client import AsyncTavilyClient
+        _async_tavily_client = AsyncTavilyClient(api_key)
+    return _async_tavily_client
+
+
+def get_chat_session_store() -> "ChatSessionStore":
+    """
+    Lazy initialization van de server-side chat sessie opslag
+    
+    Config (env vars):
+        CHAT_TOKEN_BUDGET: Max geschatte tokens in de geschiedenis voor compactie (default: 4000)
+        CHAT_KEEP_RECENT_TURNS: Turns die letterlijk bewaard blijven (default: 6)
+        CHAT_CONTEXT_CACHE_MIN_TOKENS: Prefix grootte voor upstream context caching (default: 32768)
+    
+    Returns: ChatSessionStore instance
+    """
+    global _chat_session_store
+    if _chat_session_store is None:
+        from lib.chat_sessions import ChatSessionStore
+        _chat_session_store = ChatSessionStore(
+            get_db,
+            get_gemini_client,
+            token_budget=int(os.getenv("CHAT_TOKEN_BUDGET", "4000")),
+            keep_recent=int(os.getenv("CHAT_KEEP_RECENT_TURNS", "6")),
+            cache_min_tokens=int(os.getenv("CHAT_CONTEXT_CACHE_MIN_TOKENS", "32768"))
+        )
+    return _chat_session_store
+
+
+def get_chat_streams() -> "ResumableStreams":
+    """
+    Lazy initialization van de hervatbare chat streams (buffers voor Last-Event-ID reconnects)
+    
+    Config (env vars):
+        CHAT_STREAM_TTL: Seconden dat een afgeronde stream hervat kan worden (default: 300)
+        CHAT_STREAM_MAX: Max buffers in het geheugen per instance (default: 256)
+        CHAT_STREAM_FIRESTORE: "1" om streams ook naar Firestore te schrijven (reconnects via andere instances)
+    
+    Returns: ResumableStreams instance
+    """
+    global _chat_streams
+    if _chat_streams is None:
+        from lib.stream_buffer import ResumableStreams
+        _chat_streams = ResumableStreams(
+            get_db if os.getenv("CHAT_STREAM_FIRESTORE") == "1" else None,
+            ttl=float(os.getenv("CHAT_STREAM_TTL", "300")),
+            max_streams=int(os.getenv("CHAT_STREAM_MAX", "256"))
+        )
+    return _chat_streams
+
+
+def get_image_cache() -> "ImageAnalysisCache":
+    """
+    Lazy initialization van de image analyse cache (IMAGE_CACHE_* env vars)
+    Defaults: 1024 entries, 4MB, TTL 86400s
+    
+    Extra config:
+        IMAGE_CACHE_PERCEPTUAL_DISTANCE: Max hamming afstand voor perceptual matches (default: 4)
+    
+    Returns: ImageAnalysisCache instance
+    """
+    global _image_cache
+    if _image_cache is None:
+        from lib.image_cache import ImageAnalysisCache
+        _image_cache = ImageAnalysisCache(
+            _cache_from_env("IMAGE_CACHE", "_cache_image", 1024, 4 * 1024 * 1024, 86400),
+            perceptual_threshold=int(os.getenv("IMAGE_CACHE_PERCEPTUAL_DISTANCE", "4"))
+        )
+    return _image_cache
+
+
+def get_semantic_cache() -> "SemanticCache":
+    """
+    Lazy initialization van de semantische chat cache
+    
+    Config (env vars):
+        SEMANTIC_CACHE_THRESHOLD: Min cosine similarity voor een hit (default: 0.92)
+        SEMANTIC_CACHE_MAX_ENTRIES: Max entries per system prompt (default: 2048)
+        SEMANTIC_CACHE_TTL: Levensduur van een antwoord in seconden (default: 86400)
+        SEMANTIC_CACHE_FIRESTORE: "1" voor gedeelde Firestore laag over alle instances
+    
+    Returns: SemanticCache instance
+    """
+    global _semantic_cache
+    if _semantic_cache is None:
+        from lib.semantic_cache import SemanticCache
+        _semantic_cache = SemanticCache(
+            lambda texts: get_gemini_client().embed(texts),
+            get_db if os.getenv("SEMANTIC_CACHE_FIRESTORE") == "1" else None,
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+            max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2048")),
+            ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+        )
+    return _semantic_cache
+
+
+def get_item_index() -> "ItemIndex":
+    """
+    Lazy initialization van de vector index over `items` (laadt pas bij de eerste search)
+    
+    Config (env vars):
+        ITEMS_EMBEDDING_DIM: Dimensie van de item embeddings (default: 256)
+        ITEMS_INDEX_SHARD_SIZE: Vectoren per shard (default: 4096)
+        ITEMS_INDEX_DIR: Map voor memory-mapped shards (default: "" = alles in het geheugen;
+            alleen zinvol op een disk-backed map, /tmp in Cloud Functions is RAM)
+        ITEMS_INDEX_REFRESH: Min seconden tussen incrementele refreshes (default: 30)
+    
+    Returns: ItemIndex instance
+    """
+    global _item_index
+    if _item_index is None:
+        from lib.vector_index import ItemIndex
+        _item_index = ItemIndex(
+            get_db,
+            dim=items_embedding_dim(),
+            shard_size=int(os.getenv("ITEMS_INDEX_SHARD_SIZE", "4096")),
+            directory=os.getenv("ITEMS_INDEX_DIR", "") or None,
+            refresh_interval=float(os.getenv("ITEMS_INDEX_REFRESH", "30"))
+        )
+    return _item_index
+
+
+def items_embedding_dim() -> int:
+    return int(os.getenv("ITEMS_EMBEDDING_DIM", "256"))
+
+
+def runtime_stats() -> Dict[str, Any]:
+    """
+    Stats van caches en clients die in dit proces al geïnitialiseerd zijn
+    (maakt zelf geen clients aan)
+    """
+    stats: Dict[str, Any] = {"caches": {}}
+    if _search_cache is not None:
+        stats["caches"]["search"] = _search_cache.stats()
+    if _summary_cache is not None:
+        stats["caches"]["summary"] = _summary_cache.stats()
+    if _image_cache is not None:
+        stats["caches"]["image"] = _image_cache.stats()
+    if _semantic_cache is not None:
+        stats["caches"]["semantic"] = _semantic_cache.stats()
+    if _item_index is not None:
+        stats["items_index"] = _item_index.stats()
+    if _chat_streams is not None:
+        stats["chat_streams"] = _chat_streams.stats()
+    if _tavily_client is not None:
+        stats["tavily"] = {
+            **_tavily_client.pool_stats(),
+            "calls": _tavily_client.call_stats()
+        }
+    if _async_tavily_client is not None:
+        stats["tavily_async"] = {"calls": _async_tavily_client.call_stats()}
+    return stats
+
+
+def _cache_from_env(prefix: str, collection: str, max_entries: int, max_bytes: int, ttl: float) -> TieredCache:
+    """
+    Bouw een TieredCache met config uit env vars
+    
+    Env vars (met prefix, bijv. SEARCH_CACHE):
+        <PREFIX>_TTL, <PREFIX>_MAX_ENTRIES, <PREFIX>_MAX_BYTES
+        <PREFIX>_FIRESTORE: "1" voor gedeelde Firestore laag over alle instances
+    """
+    local = TTLCache(
+        max_entries=int(os.getenv(f"{prefix}_MAX_ENTRIES", str(max_entries))),
+        max_bytes=int(os.getenv(f"{prefix}_MAX_BYTES", str(max_bytes))),
+        ttl=float(os.getenv(f"{prefix}_TTL", str(ttl)))
+    )
+    remote = None
+    if os.getenv(f"{prefix}_FIRESTORE") == "1":
+        remote = FirestoreCache(collection, get_db)
+    return TieredCache(local, remote)
+
+
+def get_search_cache() -> TieredCache:
+    """
+    Lazy initialization van de search result cache (SEARCH_CACHE_* env vars)
+    Defaults: 512 entries, 16MB, TTL 300s
+    
+    Returns: TieredCache instance
+    """
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = _cache_from_env("SEARCH_CACHE", "_cache_search", 512, 16 * 1024 * 1024, 300)
+    return _search_cache
+
+
+def get_summary_cache() -> TieredCache:
+    """
+    Lazy initialization van de search summary cache (SUMMARY_CACHE_* env vars)
+    Defaults: 256 entries, 4MB, TTL 3600s
+    
+    Returns: TieredCache instance
+    """
+    global _summary_cache
+    if _summary_cache is None:
+        _summary_cache = _cache_from_env("SUMMARY_CACHE", "_cache_summary", 256, 4 * 1024 * 1024, 3600)
+    return _summary_cache
+
+
+def json_default(value: Any) -> Any:
+    """
+    JSON fallback voor Firestore types
+    Timestamps (datetime) → ISO 8601 string, overige types → str
+    """
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
 def create_json_response(
     data: Dict[str, Any],
-    status: int = 200
+    status: int = 200,
+    headers: Optional[Dict[str, str]] = None
 ) -> https_fn.Response:
     """
     Helper voor consistent JSON responses
@@ -68,17 +312,31 @@ def create_json_response(
     Args:
         data: Dictionary met response data
         status: HTTP status code (default: 200)
+        headers: Optionele extra headers
     
     Returns:
         https_fn.Response met JSON content
     """
     return https_fn.Response(
-        json.dumps(data),
+        json_dumps(data, default=json_default),
         status=status,
-        headers={"Content-Type": "application/json"}
+        headers={"Content-Type": "application/json", **(headers or {})}
     )
 
 
+def estimate_tokens(text: str) -> int:
+    """
+    Snelle token schatting zonder API call (~4 tekens per token)
+    
+    Args:
+        text: Input tekst
+    
+    Returns:
+        Geschat aantal tokens
+    """
+    return (len(text) + 3) // 4
+
+
 def validate_required_fields(
     data: Dict[str, Any],
     required_fields: List[str]
@@ -100,6 +358,18 @@ def validate_required_fields(
     return missing
 
 
+def parse_flag(value: Any) -> bool:
+    """
+    Boolean uit een query param, form veld of JSON waarde
+    
+    Alleen "1", "true" en "yes" (hoofdletterongevoelig) en JSON true/1 zijn aan;
+    "0", "false", "no", "" en ontbrekend zijn uit.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return isinstance(value, (bool, int)) and value == 1
+
+
 def normalize_path(path: str) -> str:
     """
     Normaliseer API path voor consistent routing
@@ -124,32 +394,3 @@ def normalize_path(path: str) -> str:
         path = '/api' + path
     
     return path
-
-
-def parse_route(path: str) -> tuple[str, Optional[str]]:
-    """
-    Parse path naar route en optionele sub-route
-    
-    Args:
-        path: Normalized API path (e.g., '/api/ai/chat')
-    
-    Returns:
-        Tuple van (main_route, sub_route)
-        Bijvoorbeeld: ('/api/ai/chat', 'chat') of ('/api/hello', None)
-    """
-    # Remove /api prefix
-    if path.startswith('/api'):
-        path = path[4:]  # Remove '/api'
-    
-    # Remove leading/trailing slashes
-    path = path.strip('/')
-    
-    if not path:
-        return ('/', None)
-    
-    # Split op eerste /
-    parts = path.split('/', 1)
-    main_route = parts[0]
-    sub_route = parts[1] if len(parts) > 1 else None
-    
-    return (main_route, sub_route)
@@ -0,0 +1,327 @@
+"""
+Vector index over de Firestore `items` collectie
+Items krijgen bij het schrijven een embedding (zie routes/firestore_routes.py);
+warme instances laden die één keer in float32 shards en houden de index daarna
+incrementeel bij (eigen writes direct, writes van andere instances via een
+created_at watermark query).
+
+Shards hebben een vaste grootte. Met een directory worden volle shards naar disk
+geschreven en memory-mapped teruggelezen (de kernel beheert de pages, geen Python
+heap); alleen de laatste shard staat dan beschrijfbaar in het geheugen. Dat
+scheelt alleen instance geheugen als de directory echt op disk staat: /tmp is in
+Cloud Functions/Cloud Run een in-memory filesystem. Een lookup is één
+matrix-vector product per shard + argpartition voor de top-k.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from lib import metrics
+
+# Item velden waarop gefilterd kan worden (lijsten matchen per element, bijv. tags)
+FILTER_FIELDS = ("category", "tags")
+# Metadata die per rij in het geheugen blijft (de rest staat in Firestore)
+METADATA_FIELDS = ("name", "description", "category", "tags")
+
+
+class _Shard:
+    """Vaste blok vectoren; rij i hoort bij ids[i]"""
+
+    def __init__(self, dim: int, size: int):
+        self.vectors = np.zeros((size, dim), dtype=np.float32)
+        self.ids: List[str] = []
+        self.sealed = False
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def seal(self, directory: Optional[str], number: int):
+        """Schrijf de (volle) shard naar disk en vervang hem door een read-only memory map"""
+        if directory:
+            path = os.path.join(directory, f"shard-{number:05d}.npy")
+            np.save(path, self.vectors)
+            self.vectors = np.load(path, mmap_mode="r")
+        self.sealed = True
+
+
+def normalize(vector: Any) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else array
+
+
+def embedding_text(item: Dict[str, Any]) -> str:
+    """Tekst die voor een item ge-embed wordt (naam + optionele beschrijving)"""
+    return "\n".join(str(item[key]) for key in ("name", "description") if item.get(key))
+
+
+class VectorIndex:
+    """
+    Gebruik:
+        index.add(doc_id, embedding, item)
+        results = index.search(query_vector, k=10, filters={"category": "docs"})
+    """
+
+    def __init__(self, dim: int, shard_size: int = 4096, directory: Optional[str] = None):
+        """
+        Args:
+            dim: Dimensie van de embeddings
+            shard_size: Rijen per shard
+            directory: Map voor memory-mapped shards (None = alles in het geheugen)
+        """
+        self.dim = dim
+        self.shard_size = shard_size
+        self.directory = tempfile.mkdtemp(prefix="index-", dir=directory) if directory else None
+        self._shards: List[_Shard] = [_Shard(dim, shard_size)]
+        # doc id → globale rij (shard * shard_size + offset)
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Dict[str, Any]] = []
+        self._deleted: Set[int] = set()
+        # veld → waarde → rijen
+        self._postings: Dict[str, Dict[Any, Set[int]]] = {field: {} for field in FILTER_FIELDS}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows
+
+    def add(self, doc_id: str, vector: Any, item: Dict[str, Any]):
+        """Voeg een item toe (bestaand id → oude rij wordt vervangen)"""
+        vector = normalize(vector)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Embedding has dimension {vector.shape[-1]}, index expects {self.dim}")
+        metadata = {key: item[key] for key in METADATA_FIELDS if item.get(key) is not None}
+
+        with self._lock:
+            if doc_id in self._rows:
+                self._delete_row(self._rows.pop(doc_id))
+            shard = self._shards[-1]
+            if len(shard) == self.shard_size:
+                shard.seal(self.directory, len(self._shards) - 1)
+                shard = _Shard(self.dim, self.shard_size)
+                self._shards.append(shard)
+
+            row = (len(self._shards) - 1) * self.shard_size + len(shard)
+            shard.vectors[len(shard)] = vector
+            shard.ids.append(doc_id)
+            self._metadata.append(metadata)
+            self._rows[doc_id] = row
+            for field in FILTER_FIELDS:
+                for value in _values(metadata.get(field)):
+                    self._postings[field].setdefault(value, set()).add(row)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            row = self._rows.pop(doc_id, None)
+            if row is not None:
+                self._delete_row(row)
+
+    def _delete_row(self, row: int):
+        """Tombstone: de rij blijft staan (shards zijn read-only) maar telt niet meer mee"""
+        self._deleted.add(row)
+        metadata = self._metadata[row]
+        for field in FILTER_FIELDS:
+            for value in _values(metadata.get(field)):
+                self._postings[field].get(value, set()).discard(row)
+
+    def _allowed(self, filters: Optional[Dict[str, Any]]) -> Optional[Set[int]]:
+        """
+        Rijen die aan alle filters voldoen (None = geen filter)
+        Meerdere waarden voor één veld = OR, meerdere velden = AND.
+
+        Raises:
+            ValueError: Bij een onbekend filter veld
+        """
+        if not filters:
+            return None
+        allowed: Optional[Set[int]] = None
+        for field, wanted in filters.items():
+            if field not in self._postings:
+                raise ValueError(f"Unsupported filter: {field} (supported: {', '.join(FILTER_FIELDS)})")
+            rows: Set[int] = set()
+            for value in _values(wanted):
+                rows |= self._postings[field].get(value, set())
+            allowed = rows if allowed is None else allowed & rows
+        return allowed
+
+    def search(
+        self,
+        vector: Any,
+        k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        min_score: float = -1.0
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k items op cosine similarity
+
+        Args:
+            vector: Query embedding
+            k: Aantal resultaten
+            filters: Bijv. {"category": "docs", "tags": ["a", "b"]}
+            min_score: Resultaten met een lagere score weglaten
+
+        Returns:
+            [{"id": ..., "score": ..., **metadata}] aflopend op score
+
+        Raises:
+            ValueError: Bij een onbekend filter veld
+        """
+        query = normalize(vector)
+        with self._lock:
+            allowed = self._allowed(filters)
+            shards = [(s.vectors, len(s)) for s in self._shards]
+            ids = [s.ids for s in self._shards]
+            deleted = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+        if allowed is not None:
+            allowed_rows = np.fromiter(allowed, dtype=np.int64, count=len(allowed))
+            allowed_rows.sort()
+        deleted.sort()
+
+        candidates: List[Tuple[float, int]] = []
+        for number, (vectors, count) in enumerate(shards):
+            if count == 0:
+                continue
+            offset = number * self.shard_size
+            scores = vectors[:count] @ query
+            if allowed is not None:
+                mask = np.zeros(count, dtype=bool)
+                mask[_slice(allowed_rows, offset, count)] = True
+                scores = np.where(mask, scores, -np.inf)
+            if len(deleted):
+                scores[_slice(deleted, offset, count)] = -np.inf
+            top = min(k, count)
+            best = np.argpartition(-scores, top - 1)[:top]
+            candidates.extend((float(scores[i]), offset + int(i)) for i in best if scores[i] > -np.inf)
+
+        candidates.sort(reverse=True)
+        results = []
+        for score, row in candidates[:k]:
+            if score < min_score:
+                break
+            shard, local = divmod(row, self.shard_size)
+            results.append({"id": ids[shard][local], "score": round(score, 4), **self._metadata[row]})
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "items": len(self._rows),
+                "shards": len(self._shards),
+                "mapped_shards": sum(1 for s in self._shards if s.sealed and self.directory),
+                "deleted": len(self._deleted),
+                "dim": self.dim,
+                "bytes": sum(s.vectors.nbytes for s in self._shards),
+            }
+
+    def close(self):
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _slice(rows: np.ndarray, offset: int, count: int) -> np.ndarray:
+    """Lokale indices van de (gesorteerde) globale rijen die in [offset, offset + count) vallen"""
+    start, end = np.searchsorted(rows, (offset, offset + count))
+    return rows[start:end] - offset
+
+
+def _values(value: Any) -> Iterable[Any]:
+    if value is None:
+        return ()
+    if isinstance(value, (list, tuple, set)):
+        return value
+    return (value,)
+
+
+class ItemIndex:
+    """
+    VectorIndex gevuld vanuit Firestore
+    De eerste search laadt alle items met een embedding; daarna haalt elke search
+    (hoogstens elke refresh_interval seconden) alleen items op met een nieuwere created_at.
+    """
+
+    COLLECTION = "items"
+
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        dim: int,
+        shard_size: int = 4096,
+        directory: Optional[str] = None,
+        refresh_interval: float = 30,
+        overlap: float = 60
+    ):
+        """
+        Args:
+            get_db: Functie die de Firestore client teruggeeft
+            dim: Dimensie van de embeddings
+            shard_size: Rijen per shard
+            directory: Map voor memory-mapped shards (None = alles in het geheugen)
+            refresh_interval: Min seconden tussen incrementele refreshes
+            overlap: Seconden die een refresh terugkijkt vóór de watermark (writes van
+                andere instances kunnen out-of-order committen; dubbele ids worden overgeslagen)
+        """
+        self._get_db = get_db
+        self.index = VectorIndex(dim, shard_size, directory)
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap
+        self._watermark = None
+        self._loaded = False
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def add(self, doc_id: str, item: Dict[str, Any]):
+        """
+        Eigen write: direct zichtbaar in deze instance (andere instances via refresh)
+        Embeddings met een andere dimensie dan de index worden overgeslagen, net als in refresh.
+        """
+        embedding = item.get("embedding")
+        if embedding is None or len(embedding) != self.index.dim:
+            return
+        self.index.add(doc_id, embedding, item)
+
+    def refresh(self, force: bool = False):
+        """Laad de collectie (eerste keer) of alleen nieuwe items sinds de watermark"""
+        if not force and self._loaded and time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        # Eén refresh tegelijk; andere requests zoeken in de huidige index
+        if not self._refresh_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            query = self._get_db().collection(self.COLLECTION).order_by("created_at")
+            if self._watermark is not None:
+                query = query.start_at({"created_at": self._watermark - timedelta(seconds=self.overlap)})
+            query = query.select([*METADATA_FIELDS, "embedding", "created_at"])
+
+            added = 0
+            for doc in metrics.timed_iter("firestore", query.stream()):
+                data = doc.to_dict()
+                if data.get("created_at") is not None:
+                    self._watermark = data["created_at"]
+                embedding = data.get("embedding")
+                if embedding is None or doc.id in self.index or len(embedding) != self.index.dim:
+                    continue
+                self.index.add(doc.id, embedding, data)
+                added += 1
+            if added:
+                metrics.increment("items_index.loaded", added)
+            self._loaded = True
+            self._last_refresh = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def search(self, vector: Any, k: int = 10, filters: Optional[Dict[str, Any]] = None,
+               min_score: float = -1.0) -> List[Dict[str, Any]]:
+        """VectorIndex.search op de huidige index (roep eerst refresh() aan)"""
+        return self.index.search(vector, k, filters, min_score)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.index.stats(), "loaded": self._loaded}
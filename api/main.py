@@ -4,11 +4,17 @@ Clean, minimale setup - routing gebeurt in lib/router.py
 
 DRY Principe: Alle logic zit in routes/, utilities in lib/
 """
-from firebase_functions import https_fn, options
-from firebase_admin import initialize_app
+# Eerst: start de cold start klok
+from lib.startup import timed
 
-# Import router
-from lib.router import route_request
+with timed("firebase_functions"):
+    from firebase_functions import https_fn, options
+with timed("firebase_admin"):
+    from firebase_admin import initialize_app
+
+# Import router (route modules en AI clients laden lazy, zie lib/router.py)
+with timed("lib.router"):
+    from lib.router import route_request
 
 # Initialize Firebase Admin SDK
 initialize_app()
@@ -28,3 +34,14 @@ def api(req: https_fn.Request) -> https_fn.Response:
     Zie routes/ voor endpoint handlers
     """
     return route_request(req)
+
+
+def __getattr__(name: str):
+    """
+    main:app (ASGI) en main:wsgi_app (WSGI) voor uvicorn/gunicorn, zie lib/asgi.py
+    Lazy zodat de Functions cold start er niet voor betaalt.
+    """
+    if name in ("app", "wsgi_app"):
+        from lib import asgi
+        return getattr(asgi, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
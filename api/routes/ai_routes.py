@@ -3,11 +3,35 @@ Routes voor AI endpoints
 Gemini chat en image analyse
 """
 from firebase_functions import https_fn
-from typing import Dict, Any, Generator
-import json
-import time
-from lib.gemini_client import GeminiClient
-from lib.utils import get_gemini_client, create_json_response, validate_required_fields
+from typing import Dict, Any, Generator, Iterator, Optional
+import os
+from lib import metrics
+from lib.cache import cache_headers
+from lib.chat_sessions import SessionNotFoundError
+from lib.router import route_params
+from lib.sse import SSE_CONNECTED, SSEWriter, sse_response
+from lib.stream_buffer import StreamNotFoundError
+from lib.utils import (
+    get_gemini_client, get_chat_session_store, get_chat_streams, get_image_cache, get_semantic_cache,
+    create_json_response, parse_flag, validate_required_fields
+)
+
+
+def _load_session(data: Dict[str, Any]):
+    """
+    Server-side sessie uit de request body
+    
+    Returns:
+        ChatSession bij "session_id" of "session": true, anders None (stateless met history)
+    
+    Raises:
+        SessionNotFoundError: Als session_id niet bestaat
+    """
+    if data.get("session_id"):
+        return get_chat_session_store().load(data["session_id"])
+    if data.get("session"):
+        return get_chat_session_store().load()
+    return None
 
 
 def handle_chat_stream(req: https_fn.Request) -> https_fn.Response:
@@ -17,8 +41,15 @@ def handle_chat_stream(req: https_fn.Request) -> https_fn.Response:
     
     Body:
         message: str (required)
-        history: list (optional)
+        history: list (optional, genegeerd bij een server-side sessie)
         system_prompt: str (optional)
+        session_id: str (optional, ga verder met een server-side sessie)
+        session: bool (optional, start een nieuwe server-side sessie)
+    
+    Met sessie: header X-Session-Id en "session_id" in het done event
+    
+    De generatie loopt door als de verbinding wegvalt; hervat met
+    GET /api/ai/chat/stream/<X-Stream-Id> en header Last-Event-ID.
     """
     try:
         data = req.get_json()
@@ -34,49 +65,38 @@ def handle_chat_stream(req: https_fn.Request) -> https_fn.Response:
         message = data.get("message")
         history = data.get("history", [])
         system_prompt = data.get("system_prompt")
+        session = _load_session(data)
+        
+        def source():
+            client = get_gemini_client()
+            if session:
+                kwargs = get_chat_session_store().chat_kwargs(session, system_prompt)
+            else:
+                kwargs = {"history": history, "system_prompt": system_prompt}
+            return client.stream_chat(message, **kwargs)
+        
+        def on_complete(text: str):
+            # Sessie opslaan vóór het done event (client kan na done sluiten), ook zonder client
+            if session:
+                get_chat_session_store().record_turn(session, message, text, system_prompt)
         
-        # Generator functie voor streaming
-        def generate():
-            try:
-                client = get_gemini_client()
-                
-                # Add system prompt to history if provided
-                if system_prompt and not history:
-                    history.append({
-                        "role": "user",
-                        "parts": [system_prompt]
-                    })
-                
-                # Send initial SSE comment to establish connection
-                yield ": connected\n\n".encode('utf-8')
-                
-                # Stream response
-                for chunk in client.stream_chat(message, history=history):
-                    # Format als SSE en encode to bytes
-                    chunk_data = json.dumps({'chunk': chunk})
-                    sse_message = f"data: {chunk_data}\n\n"
-                    yield sse_message.encode('utf-8')
-                
-                # Stuur done signaal
-                done_message = f"data: {json.dumps({'done': True})}\n\n"
-                yield done_message.encode('utf-8')
-                
-            except Exception as e:
-                error_data = json.dumps({'error': str(e)})
-                error_message = f"data: {error_data}\n\n"
-                yield error_message.encode('utf-8')
+        # Generatie in een producer thread: chunks blijven hervatbaar na een disconnect
+        stream = get_chat_streams().start(source, on_complete)
+        done = {'done': True, 'stream_id': stream.id}
+        if session:
+            done['session_id'] = session.id
         
         # Return streaming response
-        return https_fn.Response(
-            generate(),
-            status=200,
-            headers={
-                'Content-Type': 'text/event-stream; charset=utf-8',
-                'Cache-Control': 'no-cache, no-transform',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',
-                'Access-Control-Allow-Origin': '*'
-            }
+        response = sse_response(_stream_events(stream.follow(), done))
+        response.headers["X-Stream-Id"] = stream.id
+        if session:
+            response.headers["X-Session-Id"] = session.id
+        return response
+        
+    except SessionNotFoundError as e:
+        return create_json_response(
+            {"error": str(e.args[0])},
+            status=404
         )
         
     except ValueError as e:
@@ -91,6 +111,93 @@ def handle_chat_stream(req: https_fn.Request) -> https_fn.Response:
         )
 
 
+def _stream_events(chunks: Iterator[str], done: Dict[str, Any], start_id: int = 0) -> Generator[bytes, None, None]:
+    """SSE events voor een (hervatte) chat stream: chunks met id, daarna done of error"""
+    writer = SSEWriter(start_id=start_id)
+    try:
+        # Send initial SSE comment to establish connection
+        yield SSE_CONNECTED
+        
+        # Stream response (samengevoegde chunks met id, heartbeats bij stilte)
+        yield from writer.chunks(chunks)
+        yield writer.event(done)
+        
+    except Exception as e:
+        yield writer.event({'error': str(e), 'stream_id': done['stream_id']})
+
+
+def handle_resume_chat_stream(req: https_fn.Request) -> https_fn.Response:
+    """
+    GET /api/ai/chat/stream/<stream_id>
+    Hervat een chat stream na een verbroken verbinding (Server-Sent Events)
+    
+    Header Last-Event-ID (of query param last_event_id): id van het laatst
+    ontvangen event. Zonder id wordt de hele stream opnieuw gestuurd. Loopt de
+    generatie nog, dan lees je daarna live mee; er wordt niets opnieuw gegenereerd.
+    """
+    stream_id = route_params(req)["stream_id"]
+    last_event_id = req.headers.get("Last-Event-ID") or req.args.get("last_event_id") or "0"
+    try:
+        start = int(last_event_id)
+        if start < 0:
+            raise ValueError
+    except ValueError:
+        return create_json_response(
+            {"error": f"Invalid Last-Event-ID: {last_event_id}"},
+            status=400
+        )
+    
+    try:
+        chunks = get_chat_streams().follow(stream_id, start)
+    except StreamNotFoundError as e:
+        return create_json_response(
+            {"error": str(e.args[0])},
+            status=404
+        )
+    except Exception as e:
+        return create_json_response(
+            {"error": f"Resume stream error: {str(e)}"},
+            status=500
+        )
+    
+    response = sse_response(_stream_events(chunks, {'done': True, 'stream_id': stream_id}, start))
+    response.headers["X-Stream-Id"] = stream_id
+    return response
+
+
+def _semantic_cache_enabled(data: Dict[str, Any]) -> bool:
+    """Opt-in per request ("semantic_cache") of voor alle requests via SEMANTIC_CACHE=1"""
+    if "semantic_cache" in data:
+        return bool(data["semantic_cache"])
+    return os.getenv("SEMANTIC_CACHE") == "1"
+
+
+def _chat_with_semantic_cache(client, message: str, system_prompt: Optional[str]) -> https_fn.Response:
+    """Chat via de semantische cache; als embedden faalt gewoon zonder cache"""
+    cache = get_semantic_cache()
+    try:
+        answer, info = cache.lookup(message, system_prompt)
+    except Exception:
+        metrics.increment("semantic_cache.error")
+        answer, info = None, None
+    
+    if answer is None:
+        answer = client.chat(message, system_prompt=system_prompt)
+        if info is not None:
+            cache.store(info, answer)
+    
+    headers = {}
+    if info is not None:
+        headers = {
+            "X-Cache": info["status"],
+            "X-Cache-Match": "semantic",
+            "X-Cache-Similarity": str(info["similarity"]),
+        }
+        if info["status"] == "HIT":
+            headers["Age"] = str(int(info["age"]))
+    return create_json_response({"response": answer, "message": message}, headers=headers)
+
+
 def handle_chat(req: https_fn.Request) -> https_fn.Response:
     """
     POST /api/ai/chat
@@ -98,8 +205,11 @@ def handle_chat(req: https_fn.Request) -> https_fn.Response:
     
     Body:
         message: str (required)
-        history: list (optional)
+        history: list (optional, genegeerd bij een server-side sessie)
         system_prompt: str (optional)
+        session_id: str (optional, ga verder met een server-side sessie)
+        session: bool (optional, start een nieuwe server-side sessie)
+        semantic_cache: bool (optional, default SEMANTIC_CACHE env; alleen zonder history/sessie)
     """
     try:
         data = req.get_json()
@@ -115,9 +225,24 @@ def handle_chat(req: https_fn.Request) -> https_fn.Response:
         message = data.get("message")
         history = data.get("history", [])
         system_prompt = data.get("system_prompt")
+        session = _load_session(data)
         
         # Call Gemini
         client = get_gemini_client()
+        if session:
+            store = get_chat_session_store()
+            response = client.chat(message, **store.chat_kwargs(session, system_prompt))
+            store.record_turn(session, message, response, system_prompt)
+            return create_json_response({
+                "response": response,
+                "message": message,
+                "session_id": session.id
+            })
+        
+        # Losse vragen (zonder context) mogen een semantisch gelijk eerder antwoord krijgen
+        if not history and _semantic_cache_enabled(data):
+            return _chat_with_semantic_cache(client, message, system_prompt)
+        
         response = client.chat(message, history=history, system_prompt=system_prompt)
         
         return create_json_response({
@@ -125,6 +250,11 @@ def handle_chat(req: https_fn.Request) -> https_fn.Response:
             "message": message
         })
         
+    except SessionNotFoundError as e:
+        return create_json_response(
+            {"error": str(e.args[0])},
+            status=404
+        )
     except ValueError as e:
         return create_json_response(
             {"error": str(e)},
@@ -137,38 +267,124 @@ def handle_chat(req: https_fn.Request) -> https_fn.Response:
         )
 
 
+# Extra bytes bovenop de image limiet voor multipart boundaries/headers en JSON velden
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+
 def handle_image_analysis(req: https_fn.Request) -> https_fn.Response:
     """
     POST /api/ai/image
     Analyseer afbeelding met Gemini
     
-    Body:
+    JSON body (Content-Type: application/json):
         image_data: str (required, base64)
         message: str (optional, default: "Beschrijf deze afbeelding")
+        perceptual: bool (optional, cache match ook op visueel gelijke images)
+    
+    Multipart (Content-Type: multipart/form-data):
+        image: file (required)
+        message: str (optional)
+    
+    Raw body (Content-Type: image/* of application/octet-stream):
+        De image bytes zelf, message als query param (?message=...)
+    
+    perceptual kan bij multipart/raw als form veld of query param (?perceptual=1);
+    alleen 1/true/yes zetten het aan.
+    Resultaten worden gecached op image content hash + prompt (headers X-Cache, X-Cache-Match, Age).
+    
+    Uploads boven de limiet worden op basis van Content-Length geweigerd (413)
+    voordat de body gelezen wordt. De image wordt vóór de model call verkleind en
+    her-encoded (zie lib/image_pipeline.py); "image" in de response bevat bytes en
+    afmetingen voor en na.
     """
+    # PIL pas laden als er echt een image binnenkomt (chat routes betalen er niet voor)
+    from lib.image_pipeline import (
+        MAX_INPUT_BYTES, ImageTooLargeError, InvalidImageError,
+        decode_base64_image, prepare_image, read_into_buffer, read_multipart_image
+    )
+    
     try:
-        data = req.get_json()
+        mimetype = req.mimetype
+        binary = mimetype.startswith("image/") or mimetype == "application/octet-stream"
+        multipart = mimetype == "multipart/form-data"
         
-        # Validatie
-        missing = validate_required_fields(data, ['image_data'])
-        if missing:
-            return create_json_response(
-                {"error": f"Missing required fields: {', '.join(missing)}"},
-                status=400
+        # Vroeg weigeren op Content-Length (base64 JSON is ~4/3 groter)
+        max_body = MAX_INPUT_BYTES if binary or multipart else MAX_INPUT_BYTES * 4 // 3
+        if req.content_length and req.content_length > max_body + UPLOAD_OVERHEAD_BYTES:
+            raise ImageTooLargeError(
+                f"Upload too large: {req.content_length} bytes (max {max_body})"
             )
         
-        message = data.get("message", "Beschrijf deze afbeelding")
-        image_data = data.get("image_data")
+        default_message = "Beschrijf deze afbeelding"
+        perceptual = parse_flag(req.args.get("perceptual"))
+        if binary:
+            message = req.args.get("message", default_message)
+            image_bytes = read_into_buffer(req.stream, req.content_length)
+        elif multipart:
+            # Zelf parsen: req.files zou de upload eerst naar een SpooledTemporaryFile kopiëren
+            image_bytes, form = read_multipart_image(
+                req.stream, req.mimetype_params.get("boundary", ""), req.content_length
+            )
+            if image_bytes is None:
+                return create_json_response(
+                    {"error": "Missing required fields: image"},
+                    status=400
+                )
+            message = form.get("message", default_message)
+            perceptual = perceptual or parse_flag(form.get("perceptual"))
+        else:
+            data = req.get_json()
+            
+            # Validatie
+            missing = validate_required_fields(data, ['image_data'])
+            if missing:
+                return create_json_response(
+                    {"error": f"Missing required fields: {', '.join(missing)}"},
+                    status=400
+                )
+            
+            message = data.get("message", default_message)
+            perceptual = perceptual or parse_flag(data.get("perceptual"))
+            image_bytes = decode_base64_image(data.pop("image_data"))
         
-        # Call Gemini
-        client = get_gemini_client()
-        response = client.chat_with_image(message, image_data, image_format="base64")
+        if not len(image_bytes):
+            return create_json_response({"error": "Empty image"}, status=400)
         
-        return create_json_response({
-            "response": response,
-            "message": message
-        })
+        image = prepare_image(image_bytes)
+        del image_bytes
+        metrics.observe("image.bytes_in", image.bytes_in)
+        metrics.observe("image.bytes_out", image.bytes_out)
+        
+        # Cache lookup (exact of perceptual), anders Gemini
+        cache = get_image_cache()
+        response, cache_info = cache.lookup(image, message, perceptual=perceptual)
+        if response is None:
+            client = get_gemini_client()
+            response = client.analyze_prepared_image(message, image)
+            cache.store(image, message, response)
         
+        headers = cache_headers(cache_info)
+        if cache_info["match"]:
+            headers["X-Cache-Match"] = cache_info["match"]
+        return create_json_response(
+            {
+                "response": response,
+                "message": message,
+                "image": image.stats()
+            },
+            headers=headers
+        )
+        
+    except ImageTooLargeError as e:
+        return create_json_response(
+            {"error": str(e)},
+            status=413
+        )
+    except InvalidImageError as e:
+        return create_json_response(
+            {"error": str(e)},
+            status=400
+        )
     except ValueError as e:
         return create_json_response(
             {"error": str(e)},
@@ -4,7 +4,11 @@ Health check, hello, root endpoint
 """
 from firebase_functions import https_fn
 from typing import Dict, Any
-from lib.utils import create_json_response
+import hmac
+import os
+from lib import metrics
+from lib.startup import startup_report
+from lib.utils import create_json_response, runtime_stats
 
 
 def handle_root(req: https_fn.Request) -> https_fn.Response:
@@ -17,11 +21,17 @@ def handle_root(req: https_fn.Request) -> https_fn.Response:
 
 
 def handle_health(req: https_fn.Request) -> https_fn.Response:
-    """GET /api/health - Health check endpoint"""
-    return create_json_response({
+    """
+    GET /api/health - Health check endpoint
+    GET /api/health?timings=1 - Inclusief cold start rapport per module
+    """
+    data = {
         "status": "ok",
         "message": "API is running"
-    })
+    }
+    if req.args.get("timings"):
+        data["startup"] = startup_report()
+    return create_json_response(data)
 
 
 def handle_hello(req: https_fn.Request) -> https_fn.Response:
@@ -30,3 +40,28 @@ def handle_hello(req: https_fn.Request) -> https_fn.Response:
     return create_json_response({
         "message": f"Hello, {name}!"
     })
+
+
+def handle_metrics(req: https_fn.Request) -> https_fn.Response:
+    """
+    GET /api/metrics - Histograms (p50/p95/p99) per route en upstream, counters en cache stats
+    Metrics zijn per instance (in-process)
+    
+    Alleen met METRICS_TOKEN gezet (anders 404) en header
+    `Authorization: Bearer <METRICS_TOKEN>` (anders 401): de stats tonen verkeer,
+    latencies en token gebruik en zijn niet publiek.
+    """
+    token = os.getenv("METRICS_TOKEN")
+    if not token:
+        return create_json_response({"error": "Not found"}, status=404)
+    supplied = req.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+        return create_json_response(
+            {"error": "Unauthorized"},
+            status=401,
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return create_json_response({
+        **metrics.snapshot(),
+        **runtime_stats()
+    })
@@ -4,9 +4,146 @@ Items CRUD voorbeeld
 """
 from firebase_functions import https_fn
 from firebase_admin import firestore
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
+import base64
 import json
-from lib.utils import get_db, create_json_response
+import os
+import re
+import time
+from lib import metrics
+from lib.encoding import json_dumps
+from lib.utils import (
+    get_db, get_gemini_client, get_item_index, items_embedding_dim,
+    create_json_response, json_default
+)
+
+# Paginatie limieten
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_.]*$")
+
+# Bulk write limieten
+FIRESTORE_BATCH_LIMIT = 500  # Max operaties per Firestore batch commit
+BATCH_WRITE_WORKERS = 4      # Max gelijktijdige batch commits
+MAX_BULK_ITEMS = 10000
+
+# Vector search limieten
+MAX_SEARCH_K = 100
+MAX_TAGS = 32
+
+
+def _new_item(data: Any) -> Dict[str, Any]:
+    """
+    Firestore document voor een nieuw item
+    
+    Raises:
+        ValueError: Als het item ongeldig is
+    """
+    if not isinstance(data, dict) or not data.get("name"):
+        raise ValueError("Name is required")
+    item = {
+        "name": data["name"],
+        "created_at": firestore.SERVER_TIMESTAMP
+    }
+    for key in ("description", "category"):
+        if data.get(key) is not None:
+            if not isinstance(data[key], str):
+                raise ValueError(f"{key} must be a string")
+            item[key] = data[key]
+    if data.get("tags") is not None:
+        tags = data["tags"]
+        if not isinstance(tags, list) or len(tags) > MAX_TAGS or not all(isinstance(t, str) for t in tags):
+            raise ValueError(f"tags must be a list of at most {MAX_TAGS} strings")
+        item["tags"] = tags
+    return item
+
+
+def _embed_items(items: List[Dict[str, Any]]):
+    """
+    Voeg een `embedding` toe aan nieuwe items (één Gemini call per 100 items)
+    
+    Best effort: als embedden faalt wordt het item zonder embedding opgeslagen
+    (het staat dan niet in /api/items/search). ITEMS_EMBEDDINGS=0 zet dit uit.
+    """
+    if not items or os.getenv("ITEMS_EMBEDDINGS", "1") != "1":
+        return
+    # Lazy: vector_index laadt numpy (GET /api/items heeft het niet nodig)
+    from lib.vector_index import embedding_text
+    try:
+        vectors = get_gemini_client().embed(
+            [embedding_text(item) for item in items],
+            task_type="RETRIEVAL_DOCUMENT",
+            output_dimensionality=items_embedding_dim()
+        )
+    except Exception:
+        metrics.increment("items.embed_errors", len(items))
+        return
+    for item, vector in zip(items, vectors):
+        item["embedding"] = vector
+
+
+def _index_items(items: List[Tuple[str, Dict[str, Any]]]):
+    """
+    Nieuwe items (doc id, item) direct in de vector index van deze instance
+
+    Best effort, net als _embed_items: de items staan al in Firestore, dus een
+    fout hier mag de write niet laten falen (andere instances en de volgende
+    refresh laden ze alsnog).
+    """
+    try:
+        item_index = get_item_index()
+    except Exception:
+        metrics.increment("items_index.add_errors", len(items))
+        return
+    for doc_id, item in items:
+        try:
+            item_index.add(doc_id, item)
+        except Exception:
+            metrics.increment("items_index.add_errors")
+
+
+def _encode_page_token(doc_id: str) -> str:
+    """Opaque page token (base64url JSON met het laatste document id)"""
+    raw = json.dumps({"after": doc_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def _decode_page_token(token: str) -> str:
+    """
+    Raises:
+        ValueError: Bij een ongeldig token
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))["after"]
+    except Exception:
+        raise ValueError("Invalid page token")
+
+
+def _parse_fields(value: Optional[str]) -> Optional[List[str]]:
+    """
+    fields=name,created_at → ["name", "created_at"] ("id" zit er altijd in)
+    
+    Raises:
+        ValueError: Bij een ongeldige field naam
+    """
+    if not value:
+        return None
+    fields = [f.strip() for f in value.split(",") if f.strip() and f.strip() != "id"]
+    for field in fields:
+        if not _FIELD_PATTERN.match(field):
+            raise ValueError(f"Invalid field: {field}")
+    return fields
+
+
+def _doc_to_item(doc) -> Dict[str, Any]:
+    item = doc.to_dict()
+    # Embeddings zijn intern (alleen voor de vector index)
+    item.pop("embedding", None)
+    item["id"] = doc.id
+    return item
 
 
 def handle_create_item(req: https_fn.Request) -> https_fn.Response:
@@ -16,22 +153,26 @@ def handle_create_item(req: https_fn.Request) -> https_fn.Response:
     
     Body:
         name: str (required)
+        description: str (optional, telt mee in de embedding)
+        category: str (optional, filterbaar in /api/items/search)
+        tags: List[str] (optional, filterbaar in /api/items/search)
     """
     try:
         data = req.get_json()
-        name = data.get("name")
         
-        if not name:
+        try:
+            item = _new_item(data)
+        except ValueError as e:
             return create_json_response(
-                {"error": "Name is required"},
+                {"error": str(e)},
                 status=400
             )
         
+        _embed_items([item])
         doc_ref = get_db().collection("items").document()
-        doc_ref.set({
-            "name": name,
-            "created_at": firestore.SERVER_TIMESTAMP
-        })
+        with metrics.timed_upstream("firestore"):
+            doc_ref.set(item)
+        _index_items([(doc_ref.id, item)])
         
         return create_json_response(
             {"id": doc_ref.id, "message": "Item created"},
@@ -45,22 +186,287 @@ def handle_create_item(req: https_fn.Request) -> https_fn.Response:
         )
 
 
+def _read_bulk_items(req: https_fn.Request) -> Iterator[Any]:
+    """
+    Items uit een bulk request body
+    
+    NDJSON (Content-Type: application/x-ndjson) wordt regel voor regel van de
+    stream gelezen; JSON mag een array of {"items": [...]} zijn.
+    
+    Raises:
+        ValueError: Bij een ongeldige body of een JSON array met meer dan
+            MAX_BULK_ITEMS items (vóór het eerste item, er is dan nog niets geschreven)
+    """
+    if req.mimetype == "application/x-ndjson":
+        for line in req.stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield ValueError("Invalid JSON line")
+        return
+    
+    data = req.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise ValueError("Body must be a JSON array, {\"items\": [...]} or NDJSON")
+    if len(data) > MAX_BULK_ITEMS:
+        raise ValueError(f"Too many items: {len(data)} (max {MAX_BULK_ITEMS})")
+    yield from data
+
+
+def _commit_batch(chunk: List[Tuple[int, Any, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Embed + commit 1 Firestore batch en geef per item het resultaat terug"""
+    _embed_items([item for _, _, item in chunk])
+    batch = get_db().batch()
+    for _, doc_ref, item in chunk:
+        batch.set(doc_ref, item)
+    try:
+        with metrics.timed_upstream("firestore"):
+            batch.commit()
+    except Exception as e:
+        return [{"index": index, "error": str(e)} for index, _, _ in chunk]
+    _index_items([(doc_ref.id, item) for _, doc_ref, item in chunk])
+    return [{"index": index, "id": doc_ref.id} for index, doc_ref, _ in chunk]
+
+
+def handle_create_items_batch(req: https_fn.Request) -> https_fn.Response:
+    """
+    POST /api/items/batch
+    Maak veel items tegelijk via Firestore batched writes
+    
+    Body (JSON): [{"name": ...}, ...] of {"items": [...]}
+    Body (NDJSON, Content-Type: application/x-ndjson): 1 item per regel
+    
+    Items worden in batches van max 500 writes gecommit, max 4 commits tegelijk.
+    Embeddings worden per batch berekend (in dezelfde workers).
+    
+    Max 10000 items: een grotere JSON array wordt geweigerd (400, niets geschreven).
+    NDJSON wordt na 10000 regels niet verder gelezen; de eerste regel daarna krijgt
+    een error in results en "truncated" is true (de items ervoor zijn gewoon aangemaakt).
+    
+    Response:
+        results: [{"index": i, "id": ...} of {"index": i, "error": ...}] (op volgorde)
+        count, created, failed, truncated, elapsed_ms, items_per_second
+    """
+    try:
+        start = time.perf_counter()
+        collection = get_db().collection("items")
+        results: List[Dict[str, Any]] = []
+        pending: List[Future] = []
+        chunk: List[Tuple[int, Any, Dict[str, Any]]] = []
+        count = 0
+        truncated = False
+        
+        with ThreadPoolExecutor(max_workers=BATCH_WRITE_WORKERS) as pool:
+            def submit(chunk):
+                # Backpressure: niet meer dan 2x workers commits in de wachtrij
+                while len(pending) >= BATCH_WRITE_WORKERS * 2:
+                    results.extend(pending.pop(0).result())
+                pending.append(pool.submit(metrics.copy_context().run, _commit_batch, chunk))
+            
+            for index, data in enumerate(_read_bulk_items(req)):
+                count += 1
+                if index >= MAX_BULK_ITEMS:
+                    # Alleen bij NDJSON (arrays worden vooraf geweigerd): stoppen met lezen,
+                    # wat al gecommit is blijft staan en komt gewoon in results
+                    results.append({"index": index, "error": f"Too many items (max {MAX_BULK_ITEMS}), rest not read"})
+                    truncated = True
+                    break
+                try:
+                    if isinstance(data, ValueError):
+                        raise data
+                    item = _new_item(data)
+                except ValueError as e:
+                    results.append({"index": index, "error": str(e)})
+                    continue
+                chunk.append((index, collection.document(), item))
+                if len(chunk) == FIRESTORE_BATCH_LIMIT:
+                    submit(chunk)
+                    chunk = []
+            
+            if chunk:
+                submit(chunk)
+            for future in pending:
+                results.extend(future.result())
+        
+        elapsed = time.perf_counter() - start
+        results.sort(key=lambda r: r["index"])
+        created = sum(1 for r in results if "id" in r)
+        return create_json_response(
+            {
+                "results": results,
+                "count": count,
+                "created": created,
+                "failed": count - created,
+                "truncated": truncated,
+                "elapsed_ms": round(elapsed * 1000, 2),
+                "items_per_second": round(created / elapsed, 1) if elapsed > 0 else None
+            },
+            status=201 if created else 400
+        )
+        
+    except ValueError as e:
+        return create_json_response(
+            {"error": str(e)},
+            status=400
+        )
+    except Exception as e:
+        return create_json_response(
+            {"error": str(e)},
+            status=500
+        )
+
+
 def handle_get_items(req: https_fn.Request) -> https_fn.Response:
     """
     GET /api/items
-    Haal alle items op uit Firestore
+    Haal items op uit Firestore (gepagineerd, nieuwste eerst)
+    
+    Query params:
+        limit: int (optional, default: 50, max: 500)
+        start_after: str (optional, next_page_token van de vorige pagina)
+        fields: str (optional, comma-separated projectie, bijv. "name,created_at")
+        order: str (optional, "desc" of "asc" op created_at, default: "desc")
+        format: str (optional, "ndjson" streamt items zodra ze uit Firestore komen;
+                zonder limit wordt dan de hele collectie gestreamd)
+    
+    Response:
+        {"items": [...], "next_page_token": str | null}
+        NDJSON: 1 item per regel, laatste regel {"next_page_token": str | null}
     """
     try:
+        args = req.args
+        ndjson = args.get("format") == "ndjson" or "application/x-ndjson" in req.headers.get("Accept", "")
+        
+        limit = args.get("limit", type=int)
+        if limit is None and not ndjson:
+            limit = DEFAULT_PAGE_SIZE
+        if limit is not None and (limit < 1 or (not ndjson and limit > MAX_PAGE_SIZE)):
+            return create_json_response(
+                {"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"},
+                status=400
+            )
+        
+        fields = _parse_fields(args.get("fields"))
+        direction = firestore.Query.ASCENDING if args.get("order") == "asc" else firestore.Query.DESCENDING
+        
+        collection = get_db().collection("items")
+        query = collection.order_by("created_at", direction=direction)
+        if fields:
+            query = query.select(fields)
+        
+        token = args.get("start_after")
+        if token:
+            with metrics.timed_upstream("firestore"):
+                cursor = collection.document(_decode_page_token(token)).get()
+            if not cursor.exists:
+                return create_json_response({"error": "Invalid page token"}, status=400)
+            query = query.start_after(cursor)
+        
+        # 1 extra ophalen om te weten of er een volgende pagina is
+        if limit is not None:
+            query = query.limit(limit + 1)
+        
+        if ndjson:
+            def generate():
+                count = 0
+                last_id = None
+                for doc in metrics.timed_iter("firestore", query.stream()):
+                    if limit is not None and count == limit:
+                        yield json_dumps({"next_page_token": _encode_page_token(last_id)}) + b"\n"
+                        return
+                    count += 1
+                    last_id = doc.id
+                    yield json_dumps(_doc_to_item(doc), default=json_default) + b"\n"
+                yield json_dumps({"next_page_token": None}) + b"\n"
+            
+            return https_fn.Response(
+                generate(),
+                status=200,
+                headers={'Content-Type': 'application/x-ndjson', 'X-Accel-Buffering': 'no'}
+            )
+        
         items = []
-        docs = get_db().collection("items").stream()
+        next_page_token = None
+        for doc in metrics.timed_iter("firestore", query.stream()):
+            if len(items) == limit:
+                next_page_token = _encode_page_token(items[-1]["id"])
+                break
+            items.append(_doc_to_item(doc))
         
-        for doc in docs:
-            item = doc.to_dict()
-            item["id"] = doc.id
-            items.append(item)
+        return create_json_response({
+            "items": items,
+            "next_page_token": next_page_token
+        })
         
-        return create_json_response({"items": items})
+    except ValueError as e:
+        return create_json_response(
+            {"error": str(e)},
+            status=400
+        )
+    except Exception as e:
+        return create_json_response(
+            {"error": str(e)},
+            status=500
+        )
+
+
+def handle_search_items(req: https_fn.Request) -> https_fn.Response:
+    """
+    POST /api/items/search
+    Top-k items op semantische gelijkenis (vector index in het geheugen van de instance)
+    
+    Body:
+        query: str (required)
+        k: int (optional, default: 10, max: 100)
+        filters: dict (optional, bijv. {"category": "docs", "tags": ["a", "b"]};
+                 lijst = één van de waarden, meerdere velden = allemaal)
+        min_score: float (optional, min cosine similarity)
+    
+    Response:
+        results: [{"id", "score", "name", ...}] (aflopend op score)
+        index_size, took_ms (alleen de index lookup)
+    """
+    try:
+        data = req.get_json(silent=True) or {}
+        query = data.get("query")
+        if not query or not isinstance(query, str):
+            return create_json_response({"error": "Query is required"}, status=400)
+        k = data.get("k", 10)
+        if not isinstance(k, int) or not 1 <= k <= MAX_SEARCH_K:
+            return create_json_response({"error": f"k must be between 1 and {MAX_SEARCH_K}"}, status=400)
+        filters = data.get("filters")
+        if filters is not None and not isinstance(filters, dict):
+            return create_json_response({"error": "filters must be an object"}, status=400)
+        
+        vector = get_gemini_client().embed(
+            [query],
+            task_type="RETRIEVAL_QUERY",
+            output_dimensionality=items_embedding_dim()
+        )[0]
+        
+        item_index = get_item_index()
+        item_index.refresh()
+        start = time.perf_counter()
+        results = item_index.search(vector, k, filters, float(data.get("min_score", -1.0)))
+        took = time.perf_counter() - start
+        metrics.observe("items_index.search_ms", took * 1000)
         
+        return create_json_response({
+            "results": results,
+            "count": len(results),
+            "index_size": len(item_index),
+            "took_ms": round(took * 1000, 3)
+        })
+        
+    except ValueError as e:
+        return create_json_response(
+            {"error": str(e)},
+            status=400
+        )
     except Exception as e:
         return create_json_response(
             {"error": str(e)},
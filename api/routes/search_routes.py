@@ -3,11 +3,22 @@ Routes voor search endpoints
 Tavily web search met optionele AI samenvatting
 """
 from firebase_functions import https_fn
-from typing import Dict, Any
-import json
-import os
-from lib.tavily_client import TavilyClient, search_and_summarize
-from lib.utils import get_tavily_client, create_json_response, validate_required_fields
+import asyncio
+from typing import Dict, Any, List
+from lib import aio
+from lib.cache import cache_headers
+from lib.encoding import json_dumps
+from lib.search_pipeline import (
+    cached_search, cached_search_async, normalize_query, summarize_results, stream_summary
+)
+from lib.sse import SSE_CONNECTED, SSEWriter, sse_response
+from lib.utils import create_json_response, validate_required_fields
+
+
+# Batch limieten
+MAX_BATCH_QUERIES = 20
+BATCH_MAX_WORKERS = 8        # Max gelijktijdige upstream searches per batch
+BATCH_QUERY_TIMEOUT = 15     # Deadline per query in seconden
 
 
 def handle_search(req: https_fn.Request) -> https_fn.Response:
@@ -18,7 +29,22 @@ def handle_search(req: https_fn.Request) -> https_fn.Response:
     Body:
         query: str (required)
         max_results: int (optional, default: 5)
+        search_depth: str (optional, "basic" of "advanced", default: "basic")
+        include_domains: list (optional)
+        exclude_domains: list (optional)
         summarize: bool (optional, default: False)
+        stream: bool (optional, alleen met summarize: samenvatting als SSE stream)
+    
+    Response headers:
+        X-Cache: HIT of MISS (search resultaten)
+        X-Cache-Tier: memory of firestore (alleen bij HIT)
+        Age: leeftijd van het gecachte resultaat in seconden
+        X-Summary-Cache: HIT of MISS (alleen met summarize)
+        X-Context-Tokens: tokens in de samenvatting prompt na context packing (alleen bij MISS)
+        X-Context-Tokens-Saved: tokens die packing bespaarde t.o.v. alle resultaten volledig (alleen bij MISS)
+    
+    Stream events (summarize + stream):
+        {"results": [...]}, daarna {"chunk": "..."}, tot slot {"done": true}
     """
     try:
         data = req.get_json()
@@ -35,26 +61,55 @@ def handle_search(req: https_fn.Request) -> https_fn.Response:
         max_results = data.get("max_results", 5)
         summarize = data.get("summarize", False)
         
+        # Search resultaten (via cache)
+        results, cache_info = cached_search(
+            query,
+            max_results=max_results,
+            search_depth=data.get("search_depth", "basic"),
+            include_domains=data.get("include_domains"),
+            exclude_domains=data.get("exclude_domains")
+        )
+        headers = cache_headers(cache_info)
+        
+        if summarize and data.get("stream"):
+            # Search + gestreamde AI samenvatting (SSE)
+            def generate():
+                writer = SSEWriter()
+                yield SSE_CONNECTED
+                yield writer.event({'results': results})
+                try:
+                    yield from writer.chunks(stream_summary(query, results))
+                    yield writer.event({'done': True})
+                except Exception as e:
+                    yield writer.event({'error': str(e)})
+            
+            response = sse_response(generate())
+            response.headers.update(headers)
+            return response
+        
         if summarize:
             # Search + AI samenvatting
-            summary = search_and_summarize(
-                query,
-                max_results=max_results,
-                tavily_key=os.getenv("TAVILY_API_KEY"),
-                gemini_key=os.getenv("GEMINI_API_KEY")
+            summary, summary_info = summarize_results(query, results)
+            headers["X-Summary-Cache"] = summary_info["status"]
+            if "context" in summary_info:
+                headers["X-Context-Tokens"] = str(summary_info["context"]["tokens_out"])
+                headers["X-Context-Tokens-Saved"] = str(summary_info["context"]["tokens_saved"])
+            return create_json_response(
+                {
+                    "query": query,
+                    "summary": summary
+                },
+                headers=headers
             )
-            return create_json_response({
-                "query": query,
-                "summary": summary
-            })
-        else:
-            # Alleen search resultaten
-            client = get_tavily_client()
-            results = client.get_clean_results(query, max_results=max_results)
-            return create_json_response({
+        
+        # Alleen search resultaten
+        return create_json_response(
+            {
                 "query": query,
                 "results": results
-            })
+            },
+            headers=headers
+        )
         
     except ValueError as e:
         return create_json_response(
@@ -66,3 +121,91 @@ def handle_search(req: https_fn.Request) -> https_fn.Response:
             {"error": f"Search error: {str(e)}"},
             status=500
         )
+
+
+def handle_search_batch(req: https_fn.Request) -> https_fn.Response:
+    """
+    POST /api/search/batch
+    Meerdere searches tegelijk, resultaten gestreamd (NDJSON) zodra ze klaar zijn
+    
+    Body:
+        queries: list[str] (required, max 20)
+        max_results: int (optional, default: 5)
+        search_depth: str (optional, default: "basic")
+        include_domains: list (optional)
+        exclude_domains: list (optional)
+    
+    Response (application/x-ndjson), 1 regel per unieke query in volgorde van afronding:
+        {"query": ..., "indices": [...], "results": [...], "cache": "HIT"/"MISS"}
+        {"query": ..., "indices": [...], "error": "..."}
+    Laatste regel: {"done": true, "count": n}
+    """
+    try:
+        data = req.get_json()
+        
+        # Validatie
+        missing = validate_required_fields(data, ['queries'])
+        if missing:
+            return create_json_response(
+                {"error": f"Missing required fields: {', '.join(missing)}"},
+                status=400
+            )
+        
+        queries = data.get("queries")
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+            return create_json_response(
+                {"error": "queries must be a non-empty list of strings"},
+                status=400
+            )
+        if len(queries) > MAX_BATCH_QUERIES:
+            return create_json_response(
+                {"error": f"Too many queries (max {MAX_BATCH_QUERIES})"},
+                status=400
+            )
+        
+        options = {
+            "max_results": data.get("max_results", 5),
+            "search_depth": data.get("search_depth", "basic"),
+            "include_domains": data.get("include_domains"),
+            "exclude_domains": data.get("exclude_domains"),
+        }
+        
+        # Dedupe: identieke (genormaliseerde) queries 1x zoeken
+        groups: Dict[str, List[int]] = {}
+        for index, query in enumerate(queries):
+            groups.setdefault(normalize_query(query), []).append(index)
+        
+        # Generator functie voor streaming (searches concurrent op de async loop, zonder thread per query)
+        def generate():
+            batch = list(groups.values())
+            searches = (cached_search_async(queries[indices[0]], **options) for indices in batch)
+            for position, outcome in aio.iter_completed(searches, limit=BATCH_MAX_WORKERS, timeout=BATCH_QUERY_TIMEOUT):
+                indices = batch[position]
+                line = {"query": queries[indices[0]], "indices": indices}
+                if isinstance(outcome, asyncio.TimeoutError):
+                    line["error"] = f"Timeout after {BATCH_QUERY_TIMEOUT}s"
+                elif isinstance(outcome, Exception):
+                    line["error"] = str(outcome)
+                else:
+                    results, cache_info = outcome
+                    line["results"] = results
+                    line["cache"] = cache_info["status"]
+                yield json_dumps(line) + b"\n"
+            
+            yield json_dumps({"done": True, "count": len(groups)}) + b"\n"
+        
+        return https_fn.Response(
+            generate(),
+            status=200,
+            headers={
+                'Content-Type': 'application/x-ndjson',
+                'Cache-Control': 'no-cache, no-transform',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+        
+    except Exception as e:
+        return create_json_response(
+            {"error": f"Search batch error: {str(e)}"},
+            status=500
+        )